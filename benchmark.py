@@ -0,0 +1,334 @@
+# Benchmark suite of the test's hot paths, with JSON baselines and regression checks
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+from metrics import summarize_values
+from profiling import benchmark_tree_build
+
+
+# The address of the emulated board, when no board is given
+EMULATED_BOARD_IP_ADDRESS = "127.0.0.2"
+
+DDR_READ_SIZES = (4096, 65536, 1048576)
+
+
+def _result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def _median_secs(run, repeat):
+    """
+    Run a function several times, and return its median wall-clock time in seconds.
+    """
+    elapsed_secs = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        run()
+        elapsed_secs.append(time.perf_counter() - start_time)
+    return summarize_values(elapsed_secs)["p50"]
+
+
+class BoardSession:
+    """
+    A pyrogue Root connected to a board, or to a board emulator started for the benchmarks, with the polling off.
+    """
+    def __init__(self, board_ip_address=None, connect_timeout_secs=30):
+        import pyrogue as pr
+        from FpgaTopLevel import FpgaTopLevel
+
+        self.emulator = None
+        if not board_ip_address:
+            from board_emulator import BoardEmulator
+            board_ip_address = EMULATED_BOARD_IP_ADDRESS
+            self.emulator = BoardEmulator(board_ip_address)
+            self.emulator.start()
+
+        self.root = pr.Root(name='AMCc', description='')
+        self.root.add(FpgaTopLevel(commType='eth-rssi-interleaved', ipAddr=board_ip_address, pcieRssiLink=4,
+                                   devices=["AxiVersion", "DDR"]))
+        self.root.start(pollEn=False)
+
+        start_time = time.time()
+        while True:
+            try:
+                self.root.FpgaTopLevel.AmcCarrierCore.AxiVersion.ScratchPad.get()
+                break
+            except Exception as error:
+                if time.time() - start_time > connect_timeout_secs:
+                    self.close()
+                    raise RuntimeError("Cannot reach the board at {0}: {1}".format(board_ip_address, error))
+                time.sleep(0.1)
+
+    def close(self):
+        self.root.stop()
+        self.root.FpgaTopLevel.stream.stop()
+        if self.emulator:
+            self.emulator.stop()
+
+
+def benchmark_scratchpad(session, round_trips=2000):
+    """
+    Measure the ScratchPad write/read round trips per second.
+    """
+    scratch_pad = session.root.FpgaTopLevel.AmcCarrierCore.AxiVersion.ScratchPad
+    start_time = time.perf_counter()
+    for i in range(round_trips):
+        scratch_pad.set(i, write=True)
+        if scratch_pad.get() != i:
+            raise RuntimeError("ScratchPad read-back mismatch. Expected: {0}".format(i))
+    elapsed_secs = time.perf_counter() - start_time
+    return {"scratchpad_round_trips_per_sec": _result(round_trips / elapsed_secs, "round trips/s", True)}
+
+
+def benchmark_ddr_raw_read(session, read_sizes=DDR_READ_SIZES, bytes_per_size=0x1000000):
+    """
+    Measure the MB/s of DDR _rawRead calls, for each read size in bytes.
+    """
+    ddr = session.root.FpgaTopLevel.DDR
+    results = {}
+    for read_size in read_sizes:
+        read_count = max(bytes_per_size // read_size, 1)
+        start_time = time.perf_counter()
+        for i in range(read_count):
+            ddr._rawRead(offset=(i * read_size) % (0x10000000 - read_size), numWords=read_size // 4)
+        elapsed_secs = time.perf_counter() - start_time
+        results["ddr_raw_read_mb_per_sec_{0}".format(read_size)] = \
+            _result(read_size * read_count / elapsed_secs / 1e6, "MB/s", True)
+    return results
+
+
+def benchmark_tree(runs=3):
+    """
+    Measure the build time and memory of the whole FpgaTopLevel device tree, and of the stress device profile.
+    """
+    results = {}
+    for label, devices in (("full", None), ("stress_profile", ["AxiVersion", "DDR"])):
+        tree = benchmark_tree_build(devices=devices, runs=runs)
+        results["tree_build_secs_{0}".format(label)] = _result(tree["build_secs"]["p50"], "s", False)
+        results["tree_held_mb_{0}".format(label)] = _result(tree["held_bytes"] / 1e6, "MB", False)
+    return results
+
+
+def write_mcs_file(path, size, seed=1):
+    """
+    Write an Intel HEX .mcs file of random data, in 16-byte data records.
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as mcs_file:
+        for address in range(0, size, 16):
+            if address % 0x10000 == 0:
+                record = bytes([2, 0, 0, 4]) + (address >> 16).to_bytes(2, "big")
+                mcs_file.write(":{0}{1:02X}\n".format(record.hex().upper(), -sum(record) & 0xFF))
+            data = bytes(rng.getrandbits(8) for _ in range(min(16, size - address)))
+            record = bytes([len(data)]) + (address & 0xFFFF).to_bytes(2, "big") + bytes([0]) + data
+            mcs_file.write(":{0}{1:02X}\n".format(record.hex().upper(), -sum(record) & 0xFF))
+        mcs_file.write(":00000001FF\n")
+
+
+def benchmark_mcs_parse(work_dir_path, size=0x400000, repeat=3):
+    """
+    Measure the parse throughput of McsReader.open, in MB of .mcs file per second.
+    """
+    from surf.misc import McsReader
+
+    mcs_path = os.path.join(work_dir_path, "benchmark.mcs")
+    write_mcs_file(mcs_path, size)
+    mcs_reader = McsReader()
+    median_secs = _median_secs(lambda: mcs_reader.open(mcs_path), repeat)
+    if mcs_reader.size != size:
+        raise RuntimeError("McsReader parsed {0} bytes out of {1}".format(mcs_reader.size, size))
+    return {"mcs_parse_mb_per_sec": _result(os.path.getsize(mcs_path) / median_secs / 1e6, "MB/s", True)}
+
+
+def benchmark_device_file_loads(work_dir_path, repeat=3):
+    """
+    Measure the load times of DacSigGen.LoadCsvFile and Lmk04828.LoadCodeLoaderMacFile, on emulated memories.
+    """
+    import pyrogue as pr
+    import pyrogue.interfaces.simulation
+    from DacSigGen import DacSigGen
+    from surf.devices.ti import Lmk04828
+
+    root = pr.Root(name='Benchmark', description='')
+    root.add(DacSigGen(memBase=pyrogue.interfaces.simulation.MemEmulate(), numOfChs=2, buffSize=2**13,
+                       fillMode=True))
+    root.add(Lmk04828(memBase=pyrogue.interfaces.simulation.MemEmulate()))
+    root.start(pollEn=False)
+    try:
+        csv_path = os.path.join(work_dir_path, "benchmark.csv")
+        with open(csv_path, "w") as csv_file:
+            for i in range(2**13):
+                csv_file.write("{0},{1}\n".format(i % 32768, -(i % 32768)))
+
+        # A CodeLoader file: the setup and modes header, then register address and value lines
+        register_addresses = sorted(int(name[len("LmkReg_0x"):], 16) for name in root.Lmk04828.variables
+                                    if name.startswith("LmkReg_0x"))
+        mac_path = os.path.join(work_dir_path, "benchmark.mac")
+        with open(mac_path, "w") as mac_file:
+            header = ["[SETUP]"] + ["SETUP{0}".format(i) for i in range(4)] + ["PART=LMK04828B"] \
+                + ["SETUP{0}".format(i) for i in range(5)] + ["[MODES]", "NAME00=R0 (INIT)"] \
+                + ["MODE{0}".format(i) for i in range(5)]
+            mac_file.write("\n".join(header) + "\n")
+            for i in range(107):
+                address = register_addresses[i % len(register_addresses)]
+                mac_file.write("R{0}\t0x{1:06X}\n".format(address, address << 8 | (i & 0xFF)))
+                mac_file.write("R{0}=0x{1:06X}\n".format(address, address << 8 | (i & 0xFF)))
+
+        return {
+            "dac_sig_gen_load_csv_secs": _result(_median_secs(lambda: root.DacSigGen.LoadCsvFile(csv_path), repeat),
+                                                 "s", False),
+            "lmk04828_load_mac_secs": _result(
+                _median_secs(lambda: root.Lmk04828.LoadCodeLoaderMacFile(mac_path), repeat), "s", False),
+        }
+    finally:
+        root.stop()
+
+
+BENCHMARKS = ("scratchpad", "ddr", "tree", "mcs", "device_files")
+
+
+def run_benchmarks(names=BENCHMARKS, board_ip_address=None):
+    """
+    Run the benchmarks. A benchmark whose dependencies cannot be imported is skipped.
+
+    Parameters
+    ----------
+    names : tuple
+        The names of the benchmarks to run
+    board_ip_address : str
+        The IP address of the board for the scratchpad and DDR benchmarks, or None to run them on a board emulator
+
+    Returns
+    -------
+    The value, unit and direction of each result, keyed by result name : dict
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir_path:
+        session = None
+        for name in names:
+            logger.info("Running the {0} benchmark...".format(name))
+            try:
+                if name in ("scratchpad", "ddr"):
+                    if session is None:
+                        session = BoardSession(board_ip_address)
+                    results.update(benchmark_scratchpad(session) if name == "scratchpad"
+                                   else benchmark_ddr_raw_read(session))
+                elif name == "tree":
+                    results.update(benchmark_tree())
+                elif name == "mcs":
+                    results.update(benchmark_mcs_parse(work_dir_path))
+                elif name == "device_files":
+                    results.update(benchmark_device_file_loads(work_dir_path))
+                else:
+                    raise ValueError("Invalid benchmark ({0}). Choose from {1}.".format(name, ", ".join(BENCHMARKS)))
+            except ImportError as import_error:
+                logger.info("Skipping the {0} benchmark: {1}. Make sure you've sourced the pyrogue env script."
+                            .format(name, import_error))
+        if session:
+            session.close()
+    return results
+
+
+def save_results(results, output_path):
+    record = {
+        "timestamp": time.time(),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    with open(output_path, "w") as output_file:
+        json.dump(record, output_file, indent=2, sort_keys=True)
+    logger.info("Saved the benchmark results to {0}".format(output_path))
+
+
+def compare_results(baseline, results, threshold=0.1):
+    """
+    Compare benchmark results with a baseline.
+
+    Parameters
+    ----------
+    baseline : dict
+        The baseline results, keyed by result name
+    results : dict
+        The new results, keyed by result name
+    threshold : float
+        The fraction by which a result may be worse than its baseline before it is a regression
+
+    Returns
+    -------
+    The (name, baseline value, value, relative change) of each regression : list
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            logger.info("{0:<36} {1:>12.4g} {2:<14} (no baseline)".format(name, result["value"], result["unit"]))
+            continue
+        baseline_value = baseline[name]["value"]
+        change = (result["value"] - baseline_value) / baseline_value if baseline_value else 0.0
+        worse_change = -change if result["higher_is_better"] else change
+        is_regression = worse_change > threshold
+        logger.info("{0:<36} {1:>12.4g} {2:<14} baseline {3:>12.4g} {4:+7.1%}{5}"
+                    .format(name, result["value"], result["unit"], baseline_value, change,
+                            "  REGRESSED" if is_regression else ""))
+        if is_regression:
+            regressions.append((name, baseline_value, result["value"], change))
+    return regressions
+
+
+def _load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)["results"]
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the test's hot paths.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks, and save the results.")
+    run_parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    run_parser.add_argument("--board-ip", help="Benchmark a board instead of a board emulator.")
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    run_parser.add_argument("--baseline", help="The baseline results file to compare the results to.")
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare saved results with a baseline.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="The fraction by which a result may be worse than its baseline.")
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("Choose the run or compare command.")
+    return args
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+
+    if args.command == "run":
+        results = run_benchmarks(args.only, board_ip_address=args.board_ip)
+        save_results(results, args.output)
+        baseline_path = args.baseline
+    else:
+        results = _load_results(args.results)
+        baseline_path = args.baseline
+
+    if baseline_path:
+        regressions = compare_results(_load_results(baseline_path), results, threshold=args.threshold)
+        if regressions:
+            logger.error("{0} benchmark results regressed by more than {1:.0%}"
+                         .format(len(regressions), args.threshold))
+            sys.exit(1)
@@ -0,0 +1,474 @@
+# An event-driven state machine running the deactivate/activate/stress cycle of the boards, many in one process
+
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import functools
+import re
+import time
+
+from switchtest_logging import logging, set_board_name
+logger = logging.getLogger(__name__)
+
+from metrics import record_metric, record_latency, set_latency_labels, summarize_values
+from shelf import ACTIVATION_SCHEDULES
+
+
+# The states of a test iteration, in order. An iteration ends after COOLDOWN.
+DEACTIVATING = "DEACTIVATING"
+VERIFY_DOWN = "VERIFY_DOWN"
+ACTIVATING = "ACTIVATING"
+VERIFY_UP = "VERIFY_UP"
+STRESSING = "STRESSING"
+COOLDOWN = "COOLDOWN"
+BOARD_STATES = (DEACTIVATING, VERIFY_DOWN, ACTIVATING, VERIFY_UP, STRESSING, COOLDOWN)
+
+# The test phase each state's latencies are labeled with
+STATE_PHASES = {
+    DEACTIVATING: "deactivation",
+    VERIFY_DOWN: "deactivation",
+    ACTIVATING: "activation",
+    VERIFY_UP: "activation",
+    STRESSING: "stress",
+    COOLDOWN: "stress",
+}
+
+# The state to retry from when a state times out. The other states fail the test when they time out.
+RETRY_STATES = {
+    DEACTIVATING: DEACTIVATING,
+    VERIFY_DOWN: DEACTIVATING,
+    ACTIVATING: ACTIVATING,
+    VERIFY_UP: ACTIVATING,
+}
+
+# The PICMG hot swap states of an active and an inactive FRU
+HOT_SWAP_STATE_ACTIVE = 4
+HOT_SWAP_STATE_INACTIVE = 1
+
+
+def parse_hot_swap_state(sensor_output):
+    """
+    Parse the PICMG hot swap state, M0 to M7, from the output of the "Hot Swap" sensor get command, e.g.
+
+         States Asserted       : Hot Swap
+                                 [M4: FRU Active]
+
+    Returns
+    -------
+    The hot swap state number, or None if the output does not report one : int
+    """
+    match = re.search(r"\[M(\d)", sensor_output)
+    return int(match.group(1)) if match else None
+
+
+async def run_blocking(function, *args, **kwargs):
+    """
+    Run a blocking call, e.g. an IPMI command or a stress activity, in the default executor of the event loop, so that
+    the other states and boards keep running meanwhile. The call runs in a copy of the current context, to label its
+    latencies with the calling board.
+
+    A call that times out is not interrupted: it runs on in its thread, and its result is dropped.
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, function, *args, **kwargs))
+
+
+class AsyncActivationScheduler:
+    """
+    Coordinate the board activations of the boards tested from the tasks of one event loop, as the
+    ActivationScheduler does across the board test processes of a shelf.
+
+    Every board waits for all the others to be ready before activating. With the "simultaneous" schedule, all the
+    boards then activate at once. With the "staggered" schedule, each board then waits for its turn, stagger_secs apart
+    in board order. If a board test ends early, or the boards fail to synchronize in time, the scheduler stops
+    synchronizing, and the remaining boards activate on their own schedule.
+    """
+    def __init__(self, board_count, schedule="simultaneous", stagger_secs=5, sync_timeout_secs=900):
+        if schedule not in ACTIVATION_SCHEDULES:
+            raise ValueError("Invalid activation schedule ({0}). Choose one of {1}."
+                             .format(schedule, ", ".join(ACTIVATION_SCHEDULES)))
+
+        self.board_count = board_count
+        self.schedule = schedule
+        self.stagger_secs = stagger_secs
+        self.sync_timeout_secs = sync_timeout_secs
+        self._ready_count = 0
+        self._generation = 0
+        self._is_broken = False
+        self._condition = None
+
+    async def wait_for_activation_turn(self, board_index):
+        """
+        Wait until it is this board's turn to be activated.
+
+        Parameters
+        ----------
+        board_index : int
+            The position of the board in the shelf configuration
+        """
+        # Create the condition in the running event loop
+        self._condition = self._condition or asyncio.Condition()
+        async with self._condition:
+            if not self._is_broken:
+                generation = self._generation
+                self._ready_count += 1
+                if self._ready_count == self.board_count:
+                    self._ready_count = 0
+                    self._generation += 1
+                    self._condition.notify_all()
+                else:
+                    try:
+                        await asyncio.wait_for(self._condition.wait_for(
+                            lambda: self._generation != generation or self._is_broken), self.sync_timeout_secs)
+                    except asyncio.TimeoutError:
+                        self._is_broken = True
+                        self._condition.notify_all()
+            if self._is_broken:
+                logger.warning("Board activations are no longer synchronized across the shelf.")
+                return
+
+        if self.schedule == "staggered" and board_index:
+            await asyncio.sleep(board_index * self.stagger_secs)
+
+    async def leave(self):
+        """
+        Stop synchronizing the board activations, e.g. when a board test has ended.
+        """
+        self._condition = self._condition or asyncio.Condition()
+        async with self._condition:
+            self._is_broken = True
+            self._condition.notify_all()
+
+
+class BoardCycle:
+    """
+    Run the test iterations of one board as an explicit state machine: DEACTIVATING, VERIFY_DOWN, ACTIVATING,
+    VERIFY_UP, STRESSING, then COOLDOWN.
+
+    Each state is a coroutine. The blocking calls, i.e. the IPMI commands and the board test's stress activities, run
+    in the executor of the event loop, while the liveness probes run natively on the event loop. The independent work
+    of a state overlaps: the board is probed while the "Hot Swap" sensor command is in flight, and the board test is
+    prepared, e.g. its pyrogue device tree built, while the board boots. The boards tested from the same event loop
+    overlap entirely.
+
+    Each state may have a timeout. A deactivation or activation state that times out, e.g. because the board does not
+    reach the expected state in time, is retried from its command, up to retries times; the other states fail the test.
+    The time spent in each state is recorded as the "state_<state>" operation latency of the board, and summarized at
+    the end of each iteration.
+    """
+    def __init__(self, board_test, board_ip_address, activation_cmd, deactivation_cmd, execute_cmd, prober,
+                 status_cmd=None, name=None, cycles=1, retries=10, poll_interval_secs=1, cooldown_secs=0,
+                 state_timeouts_secs=None, before_activation=None):
+        """
+        Parameters
+        ----------
+        board_test : object
+            The board test, with the blocking start_iteration(iteration), prepare(), stress(iteration) and
+            end_iteration(iteration) methods, and the is_retryable(error) method telling whether a stress activity
+            error is worth another activation
+        board_ip_address : str
+            The IP address of the board
+        activation_cmd : str
+            The command to activate the board
+        deactivation_cmd : str
+            The command to deactivate the board
+        execute_cmd : callable
+            Runs a command, blocking, and returns its (return code, stdout, stderr)
+        prober : BoardProber
+            The prober of the board's liveness
+        status_cmd : str
+            The command to get the board's "Hot Swap" sensor. If given, a board state transition is only complete once
+            the sensor reports the expected hot swap state.
+        name : str
+            The name to tag the log messages of the board with, e.g. its slot, when several boards are tested in the
+            same process, or None not to tag them
+        cycles : int
+            The number of test iterations to run, or -1 to run until a failure
+        retries : int
+            The number of times to retry a deactivation, an activation, or a stress activity
+        poll_interval_secs : float
+            The time between two polls of the board state
+        cooldown_secs : float
+            The time to wait after the stress activities, before the next iteration
+        state_timeouts_secs : dict
+            The timeout of each state, in seconds, or None for no timeout
+        before_activation : coroutine function
+            Awaited before the first activation command of each iteration, e.g. to wait for the board's turn in the
+            shelf
+        """
+        self.board_test = board_test
+        self.board_ip_address = board_ip_address
+        self.activation_cmd = activation_cmd
+        self.deactivation_cmd = deactivation_cmd
+        self.execute_cmd = execute_cmd
+        self.prober = prober
+        self.status_cmd = status_cmd
+        self.name = name or board_ip_address
+        self.logger = logger
+        self._log_name = name
+        self.cycles = cycles
+        self.retries = retries
+        self.poll_interval_secs = poll_interval_secs
+        self.cooldown_secs = cooldown_secs
+        self.state_timeouts_secs = dict(state_timeouts_secs or {})
+        self.before_activation = before_activation
+
+        invalid_states = set(self.state_timeouts_secs) - set(BOARD_STATES)
+        if invalid_states:
+            raise ValueError("Invalid state timeouts ({0}). Choose from {1}."
+                             .format(", ".join(sorted(invalid_states)), ", ".join(BOARD_STATES)))
+
+        self.state = None
+        self.iteration = 0
+        self.state_secs = collections.defaultdict(list)
+        self._retry_count = 0
+        self._stress_retry_count = 0
+        self._is_turn_taken = False
+        self._prepare_task = None
+
+    async def run(self):
+        """
+        Run the test iterations of the board.
+
+        Raises SystemError, RuntimeError
+        """
+        if self._log_name:
+            set_board_name(self._log_name)
+        set_latency_labels(board=self.board_ip_address, phase="startup")
+        if self.cycles == -1:
+            self.logger.info("Looping the test indefinitely. Press <Ctrl-C> to terminate.")
+        else:
+            self.logger.info("Looping the test {0} times. Press <Ctrl-C> to terminate.".format(self.cycles))
+
+        self.logger.info("\n\n--- Detecting if the board is active ---")
+        if not await self._probe():
+            self.logger.error("Cannot start the test. The board has to be activated first.")
+            raise SystemError
+
+        try:
+            while self.cycles == -1 or self.iteration < self.cycles:
+                self.iteration += 1
+                self.logger.info("\n=== Starting Test Iteration: {0} ===\n".format(self.iteration))
+                await run_blocking(self.board_test.start_iteration, self.iteration)
+                self._retry_count = self._stress_retry_count = 0
+                self._is_turn_taken = False
+
+                state = DEACTIVATING
+                while state:
+                    if state == ACTIVATING:
+                        await self._wait_for_activation_turn()
+                    state = await self._run_state(state)
+
+                self._log_state_summary()
+                self.logger.info("\n\n=== Ending Test Iteration: {0} ===".format(self.iteration))
+        finally:
+            if self._prepare_task and not self._prepare_task.done():
+                self._prepare_task.cancel()
+
+    async def _run_state(self, state):
+        """
+        Run one state, within its timeout, and record the time spent in it.
+
+        Returns
+        -------
+        The next state, or None at the end of the iteration : str
+        """
+        self.state = state
+        set_latency_labels(phase=STATE_PHASES[state])
+        handler = getattr(self, "_" + state.lower())
+        timeout_secs = self.state_timeouts_secs.get(state)
+
+        start_time = time.perf_counter()
+        try:
+            next_state = await asyncio.wait_for(handler(), timeout_secs)
+        except asyncio.TimeoutError:
+            next_state = self._retry_after_timeout(state, timeout_secs)
+        elapsed_secs = time.perf_counter() - start_time
+
+        self.state_secs[state].append(elapsed_secs)
+        record_latency("state_" + state.lower(), elapsed_secs)
+        self.logger.debug("{0} -> {1} after {2:.2f} seconds".format(state, next_state or "END", elapsed_secs))
+        return next_state
+
+    def _retry_after_timeout(self, state, timeout_secs):
+        if state not in RETRY_STATES:
+            raise RuntimeError("The board at {0} timed out in the {1} state after {2} seconds"
+                               .format(self.board_ip_address, state, timeout_secs))
+        action = "DEACTIVATED" if RETRY_STATES[state] == DEACTIVATING else "ACTIVATED"
+        if self._retry_count >= self.retries:
+            self.logger.error("The board CANNOT be {0}. Ending the test.".format(action))
+            raise RuntimeError("The board at {0} cannot be {1}".format(self.board_ip_address, action))
+        self._retry_count += 1
+        self.logger.info("{0} timed out after {1} seconds. Retrying the board {2}. Attempt {3} out of {4}."
+                         .format(state, timeout_secs, "deactivation" if action == "DEACTIVATED" else "activation",
+                                 self._retry_count, self.retries))
+        return RETRY_STATES[state]
+
+    async def _deactivating(self):
+        self.logger.info("\n--- BOARD DEACTIVATION ---")
+        await self._run_cmd(self.deactivation_cmd)
+        return VERIFY_DOWN
+
+    async def _verify_down(self):
+        await self._wait_for_board_state(False)
+        self._retry_count = 0
+        return ACTIVATING
+
+    async def _activating(self):
+        self.logger.info("\n--- BOARD ACTIVATION ---")
+        # Prepare the board test while the board boots
+        if self._prepare_task is None:
+            self._prepare_task = asyncio.ensure_future(run_blocking(self.board_test.prepare))
+        await self._run_cmd(self.activation_cmd)
+        return VERIFY_UP
+
+    async def _wait_for_activation_turn(self):
+        """
+        Wait for the board's turn in the shelf before its first activation command of the iteration. The wait is not
+        part of the ACTIVATING state, so that the state's timeout only bounds the activation itself.
+        """
+        if self.before_activation and not self._is_turn_taken:
+            self._is_turn_taken = True
+            await self.before_activation()
+
+    async def _verify_up(self):
+        await self._wait_for_board_state(True)
+        return STRESSING
+
+    async def _stressing(self):
+        await self._prepare_task
+        try:
+            await run_blocking(self.board_test.stress, self.iteration)
+        except Exception as error:
+            if not self.board_test.is_retryable(error) or self._stress_retry_count >= self.retries:
+                raise
+            self.logger.info("The stress activities failed. Exception type: {0}. Exception {1}."
+                             .format(type(error), error))
+            if not await self._probe():
+                raise
+            self._stress_retry_count += 1
+            self.logger.info("Continuing the test. Increment retry count. Attempt {0} out of {1}."
+                             .format(self._stress_retry_count, self.retries))
+            return ACTIVATING
+        return COOLDOWN
+
+    async def _cooldown(self):
+        await run_blocking(self.board_test.end_iteration, self.iteration)
+        await asyncio.sleep(self.cooldown_secs)
+        return None
+
+    async def _run_cmd(self, cmd):
+        self.logger.info("## Running IPMI comand: ##")
+        self.logger.info(cmd)
+        return_code, stdout_data, stderr_data = await run_blocking(self.execute_cmd, cmd)
+        self.logger.info("Return Code: {0}\n".format(return_code))
+        if stdout_data:
+            self.logger.debug("### stdout ###\n{0}".format(stdout_data))
+        if stderr_data:
+            self.logger.debug("### stderr ###\n{0}".format(stderr_data))
+        return stdout_data
+
+    async def _probe(self):
+        """
+        Probe the board's liveness, and record the latency of the probe as the "ping_probe" operation.
+        """
+        start_time = time.perf_counter()
+        is_board_responding = await self.prober.probe(self.board_ip_address)
+        record_latency("ping_probe", time.perf_counter() - start_time)
+        return is_board_responding
+
+    async def _get_hot_swap_state(self):
+        if not self.status_cmd:
+            return None
+        _, stdout_data, _ = await run_blocking(self.execute_cmd, self.status_cmd)
+        return parse_hot_swap_state(stdout_data)
+
+    async def _wait_for_board_state(self, expected_board_is_active):
+        """
+        Poll the board's liveness and, if a status command is given, its "Hot Swap" sensor, concurrently, until the
+        board reaches the expected state. The state's timeout bounds the wait. The time it took is recorded as the
+        "time_to_active_secs" or "time_to_inactive_secs" metric.
+        """
+        state_name = "ACTIVE" if expected_board_is_active else "INACTIVE"
+        expected_hot_swap_state = HOT_SWAP_STATE_ACTIVE if expected_board_is_active else HOT_SWAP_STATE_INACTIVE
+        self.logger.info("\n\n--- Waiting for the board to become {0} ---".format(state_name))
+
+        start_time = time.time()
+        while True:
+            is_board_responding, hot_swap_state = await asyncio.gather(self._probe(), self._get_hot_swap_state())
+            if is_board_responding == expected_board_is_active and hot_swap_state in (None, expected_hot_swap_state):
+                elapsed_secs = time.time() - start_time
+                record_metric("time_to_{0}_secs".format(state_name.lower()), elapsed_secs)
+                self.logger.info("The board is {0}, as expected, after {1:.1f} seconds."
+                                 .format(state_name, elapsed_secs))
+                return
+            self.logger.debug("The board is expected to be {0}, but it is {1}responding to probes, with the hot swap "
+                              "state M{2}.".format(state_name, "" if is_board_responding else "not ", hot_swap_state))
+            await asyncio.sleep(self.poll_interval_secs)
+
+    def _log_state_summary(self):
+        for state in BOARD_STATES:
+            summary = summarize_values(self.state_secs[state])
+            if summary["count"]:
+                self.logger.info("Time in {0}: min/p50/max {1:.1f}/{2:.1f}/{3:.1f} seconds over {4} runs"
+                                 .format(state, summary["min"], summary["p50"], summary["max"], summary["count"]))
+
+
+async def run_board_cycles(board_cycles, scheduler=None):
+    """
+    Run the test of several boards concurrently, from the tasks of the running event loop.
+
+    Parameters
+    ----------
+    board_cycles : list of BoardCycle
+        The state machines of the boards
+    scheduler : AsyncActivationScheduler
+        The scheduler coordinating the board activations, left by each board when its test ends, or None
+
+    Returns
+    -------
+    The exception that ended the test of each board, or None if it passed, in the board order : list
+    """
+    async def _run(board_cycle):
+        try:
+            await board_cycle.run()
+        except Exception as error:
+            board_cycle.logger.error("Unexpected exception in the {0} state. Exception type: {1}. Exception: {2}"
+                                     .format(board_cycle.state, type(error), error))
+            return error
+        finally:
+            if scheduler:
+                await scheduler.leave()
+        return None
+
+    return await asyncio.gather(*(_run(board_cycle) for board_cycle in board_cycles))
+
+
+def run_boards(board_cycles, scheduler=None, max_workers=None):
+    """
+    Run the test of several boards concurrently in this process, on a new event loop.
+
+    Parameters
+    ----------
+    board_cycles : list of BoardCycle
+        The state machines of the boards
+    scheduler : AsyncActivationScheduler
+        The scheduler coordinating the board activations, or None
+    max_workers : int
+        The number of threads running the blocking calls of all the boards, or None for 4 threads per board
+
+    Returns
+    -------
+    The exception that ended the test of each board, or None if it passed, in the board order : list
+    """
+    loop = asyncio.new_event_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or 4 * len(board_cycles),
+                                                     thread_name_prefix="board-cycle")
+    loop.set_default_executor(executor)
+    try:
+        return loop.run_until_complete(run_board_cycles(board_cycles, scheduler=scheduler))
+    finally:
+        loop.close()
+        executor.shutdown(wait=False)
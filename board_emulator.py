@@ -0,0 +1,626 @@
+# A local stand-in for an FPGA board, serving SRPv3 register and DDR access over RSSI/UDP
+
+import argparse
+import collections
+import heapq
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from rssi import pack_rssi_header, rssi_checksum, RSSI_SYN, RSSI_ACK, RSSI_RST, RSSI_NUL, RSSI_HEADER_SIZE, \
+    RSSI_SYN_HEADER_SIZE
+
+
+# The UDP ports of the board's RSSI servers
+RSSI_REGISTER_PORT = 8193
+RSSI_DATA_PORT = 8194
+RSSI_INTERLEAVED_PORT = 8198
+
+# The tDests of the SRPv3 register and DDR accesses
+TDEST_REGISTERS = 0x0
+TDEST_DDR = 0x4
+
+REGISTER_SPACE_SIZE = 0x100000000
+DDR_SIZE = 0x10000000
+
+# SRPv3 opcodes
+SRP_VERSION = 0x03
+SRP_NON_POSTED_READ = 0x0
+SRP_NON_POSTED_WRITE = 0x1
+SRP_POSTED_WRITE = 0x2
+SRP_NULL = 0x3
+
+SRP_HEADER = struct.Struct("<IIIII")
+SRP_FOOTER = struct.Struct("<I")
+
+# The SRPv3 footer of a request outside the memory, as an AXI decode error
+SRP_STATUS_DECODE_ERROR = 0x3
+
+
+class SparseMemory:
+    """
+    A byte-addressed memory, allocated in pages on first write. Unwritten bytes read as zero.
+    """
+    PAGE_SIZE = 0x10000
+
+    def __init__(self, size):
+        self.size = size
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def contains(self, address, size):
+        return 0 <= address and address + size <= self.size
+
+    def read(self, address, size):
+        data = bytearray(size)
+        with self._lock:
+            for position, page, page_offset, length in self._spans(address, size):
+                page_data = self._pages.get(page)
+                if page_data is not None:
+                    data[position:position + length] = page_data[page_offset:page_offset + length]
+        return data
+
+    def write(self, address, data):
+        with self._lock:
+            for position, page, page_offset, length in self._spans(address, len(data)):
+                page_data = self._pages.get(page)
+                if page_data is None:
+                    page_data = self._pages[page] = bytearray(self.PAGE_SIZE)
+                page_data[page_offset:page_offset + length] = data[position:position + length]
+
+    def _spans(self, address, size):
+        position = 0
+        while position < size:
+            page, page_offset = divmod(address + position, self.PAGE_SIZE)
+            length = min(self.PAGE_SIZE - page_offset, size - position)
+            yield position, page, page_offset, length
+            position += length
+
+
+def handle_srp_frame(frame, memory):
+    """
+    Serve an SRPv3 request frame on a memory.
+
+    Returns
+    -------
+    The response frame, or None for posted writes and invalid requests : bytes
+    """
+    if len(frame) < SRP_HEADER.size:
+        return None
+    header_word, transaction_id, address_low, address_high, request_size = SRP_HEADER.unpack_from(frame)
+    if header_word & 0xFF != SRP_VERSION:
+        logger.debug("Dropping an SRP frame of version 0x{0:02X}".format(header_word & 0xFF))
+        return None
+
+    opcode = (header_word >> 8) & 0x3
+    address = address_high << 32 | address_low
+    size = request_size + 1
+    header = frame[:SRP_HEADER.size]
+
+    if opcode == SRP_NULL:
+        return bytes(header) + SRP_FOOTER.pack(0)
+    if not memory.contains(address, size):
+        data, status = bytes(size if opcode == SRP_NON_POSTED_READ else len(frame) - SRP_HEADER.size), \
+            SRP_STATUS_DECODE_ERROR
+    elif opcode == SRP_NON_POSTED_READ:
+        data, status = memory.read(address, size), 0
+    else:
+        data, status = frame[SRP_HEADER.size:SRP_HEADER.size + size], 0
+        if len(data) != size:
+            logger.debug("Dropping an SRP write of {0} bytes, announcing {1} bytes".format(len(data), size))
+            return None
+        memory.write(address, data)
+
+    if opcode == SRP_POSTED_WRITE:
+        return None
+    # Write responses echo the written data
+    return bytes(header) + bytes(data) + SRP_FOOTER.pack(status)
+
+
+class Packetizer:
+    """
+    Split frames into the segments of the AXI stream packetizer, and reassemble the segments into frames.
+
+    Version 1 (ports 8193 and 8194) has an 8-byte header with the frame and segment numbers and a 1-byte tail with the
+    EOF bit. Version 2 (port 8198) has an 8-byte header with the SOF bit and a per-tDest segment sequence number, and
+    an 8-byte tail with the EOF bit, the byte count of the last 8-byte word, and a CRC, not set by the emulator.
+    """
+    def __init__(self, version):
+        self.version = version
+        self._frames = {}
+        self._frame_numbers = collections.Counter()
+        self._segment_sequences = collections.Counter()
+
+    def split(self, tdest, frame, max_segment_size):
+        """
+        Split a frame into segments of at most max_segment_size bytes, including the packetizer header and tail.
+
+        Returns
+        -------
+        The segments : list
+        """
+        segments = []
+        if self.version == 2:
+            chunk_size = max((max_segment_size - 16) // 8 * 8, 8)
+            chunks = [frame[i:i + chunk_size] for i in range(0, len(frame), chunk_size)] or [b""]
+            for index, chunk in enumerate(chunks):
+                is_last = index == len(chunks) - 1
+                header = struct.pack("<BBBBHBB", 0x2, 0x2 if index == 0 else 0x0, tdest, 0,
+                                     self._segment_sequences[tdest] & 0xFFFF, 0, 0x80 if index == 0 else 0x00)
+                self._segment_sequences[tdest] += 1
+                last_bytes = (len(chunk) - 1) % 8 + 1 if chunk else 0
+                padded = bytes(chunk) + bytes(-len(chunk) % 8)
+                tail = struct.pack("<BBBBI", 0, 0x1 if is_last else 0x0, last_bytes if is_last else 8, 0, 0)
+                segments.append(header + padded + tail)
+        else:
+            chunk_size = max(max_segment_size - 9, 1)
+            chunks = [frame[i:i + chunk_size] for i in range(0, len(frame), chunk_size)] or [b""]
+            frame_number = self._frame_numbers[tdest] & 0xFFF
+            self._frame_numbers[tdest] += 1
+            for index, chunk in enumerate(chunks):
+                header = struct.pack("<Q", frame_number << 4 | index << 16 | tdest << 40
+                                     | (0x2 if index == 0 else 0x0) << 56)
+                tail = bytes([0x80 if index == len(chunks) - 1 else 0x00])
+                segments.append(header + bytes(chunk) + tail)
+        return segments
+
+    def push(self, segment):
+        """
+        Add a received segment to the frame being reassembled on its tDest.
+
+        Returns
+        -------
+        The tDest and the frame when the segment completes a frame, or None : tuple
+        """
+        if self.version == 2:
+            if len(segment) < 16 or segment[0] & 0xF != 0x2:
+                return None
+            tdest = segment[2]
+            is_sof = bool(segment[7] & 0x80)
+            is_eof = bool(segment[-7] & 0x1)
+            last_bytes = segment[-6] or 8
+            data = segment[8:-8]
+            if is_eof:
+                data = data[:len(data) - 8 + last_bytes] if data else data
+        else:
+            if len(segment) < 9:
+                return None
+            header = struct.unpack_from("<Q", segment)[0]
+            tdest = (header >> 40) & 0xFF
+            is_sof = (header >> 16) & 0xFFFFFF == 0
+            is_eof = bool(segment[-1] & 0x80)
+            data = segment[8:-1]
+
+        if is_sof:
+            self._frames[tdest] = bytearray()
+        elif tdest not in self._frames:
+            logger.debug("Dropping a packetizer segment without a start of frame on tDest 0x{0:X}".format(tdest))
+            return None
+        self._frames[tdest] += data
+        if is_eof:
+            return tdest, bytes(self._frames.pop(tdest))
+        return None
+
+
+class LinkImpairments:
+    """
+    Delay, drop and reorder the datagrams sent by the emulator, and drop the datagrams it receives, to emulate a
+    lossy or congested switch path.
+    """
+    def __init__(self, latency_secs=0.0, jitter_secs=0.0, loss_rate=0.0, reorder_rate=0.0, reorder_delay_secs=0.002,
+                 seed=None):
+        """
+        Parameters
+        ----------
+        latency_secs : float
+            The delay added to every datagram sent
+        jitter_secs : float
+            The maximum random delay added on top of the latency
+        loss_rate : float
+            The probability to drop each datagram, sent or received
+        reorder_rate : float
+            The probability to hold back each datagram sent by reorder_delay_secs, so that the next ones overtake it
+        reorder_delay_secs : float
+            The extra delay of the datagrams held back
+        seed : int
+            The seed of the random impairments, for repeatable runs
+        """
+        self.latency_secs = latency_secs
+        self.jitter_secs = jitter_secs
+        self.loss_rate = loss_rate
+        self.reorder_rate = reorder_rate
+        self.reorder_delay_secs = reorder_delay_secs
+        self._random = random.Random(seed)
+
+    @property
+    def is_enabled(self):
+        return bool(self.latency_secs or self.jitter_secs or self.loss_rate or self.reorder_rate)
+
+    def drops(self):
+        return self.loss_rate > 0 and self._random.random() < self.loss_rate
+
+    def send_delay_secs(self):
+        delay_secs = self.latency_secs
+        if self.jitter_secs:
+            delay_secs += self._random.uniform(0, self.jitter_secs)
+        if self.reorder_rate and self._random.random() < self.reorder_rate:
+            delay_secs += self.reorder_delay_secs
+        return delay_secs
+
+
+class RssiConnection:
+    """
+    The server side of an RSSI connection with one client.
+    """
+    def __init__(self, address, syn_header, local_sequence):
+        self.address = address
+        self.remote_sequence = syn_header[2]
+        self.local_sequence = local_sequence
+        self.syn_parameters = bytes(syn_header[4:22])
+        self.max_outstanding = max(syn_header[5], 1)
+        self.max_segment_size = struct.unpack_from(">H", syn_header, 6)[0] or 1400
+        # The unacknowledged segments by sequence number, as [segment, send time]
+        self.unacknowledged = collections.OrderedDict()
+        self.pending = collections.deque()
+        self.is_open = False
+
+
+class RssiServer:
+    """
+    Serve RSSI connections on a UDP port, and route the frames of their packetizer to SRPv3 memories by tDest.
+    """
+    RETRANSMIT_TIMEOUT_SECS = 0.05
+
+    def __init__(self, host, port, packetizer_version, routes, impairments, is_active):
+        """
+        Parameters
+        ----------
+        host : str
+            The address to serve on
+        port : int
+            The UDP port to serve on
+        packetizer_version : int
+            The AXI stream packetizer version, 1 or 2
+        routes : dict
+            The SparseMemory served by SRPv3 on each tDest. Frames on other tDests are dropped.
+        impairments : LinkImpairments
+            The impairments of the datagrams sent and received
+        is_active : callable
+            Returns False while the emulated board is powered off
+        """
+        self.port = port
+        self.packetizer_version = packetizer_version
+        self.routes = routes
+        self.impairments = impairments
+        self.is_active = is_active
+        self.frame_count = 0
+        self.retransmit_count = 0
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._socket.bind((host, port))
+        self._socket.settimeout(0.01)
+        self._connections = {}
+        self._packetizers = {}
+        self._send_queue = []
+        self._send_counter = itertools.count()
+        self._send_condition = threading.Condition()
+        self._threads = []
+        self._is_running = False
+
+    def start(self):
+        self._is_running = True
+        self._threads = [threading.Thread(target=self._serve, name="RssiServer-{0}".format(self.port), daemon=True)]
+        if self.impairments.is_enabled:
+            self._threads.append(threading.Thread(target=self._send_delayed, name="RssiSender-{0}".format(self.port),
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._is_running = False
+        with self._send_condition:
+            self._send_condition.notify()
+        for thread in self._threads:
+            thread.join()
+        self._socket.close()
+
+    def reset(self):
+        """
+        Drop all the connections, as a board power cycle does.
+        """
+        self._connections.clear()
+        self._packetizers.clear()
+
+    def _serve(self):
+        while self._is_running:
+            try:
+                datagram, address = self._socket.recvfrom(65536)
+            except socket.timeout:
+                self._retransmit()
+                continue
+
+            if not self.is_active():
+                self.reset()
+                continue
+            if self.impairments.drops():
+                continue
+            try:
+                self._handle_segment(datagram, address)
+            except (struct.error, IndexError) as error:
+                logger.debug("Dropping a malformed RSSI segment from {0}: {1}".format(address, error))
+            self._retransmit()
+
+    def _handle_segment(self, segment, address):
+        header_size = segment[1]
+        if len(segment) < header_size or header_size not in (RSSI_HEADER_SIZE, RSSI_SYN_HEADER_SIZE):
+            return
+        header = segment[:header_size]
+        if struct.unpack_from(">H", header, header_size - 2)[0] != rssi_checksum(header):
+            logger.debug("Dropping an RSSI segment with a bad checksum from {0}".format(address))
+            return
+
+        flags = header[0]
+        if flags & RSSI_SYN:
+            # A new connection, or a client reconnecting
+            connection = self._connections[address] = RssiConnection(address, header, random.randrange(256))
+            self._packetizers[address] = Packetizer(self.packetizer_version)
+            self._send(connection, pack_rssi_header(RSSI_SYN | RSSI_ACK, connection.local_sequence,
+                                                    connection.remote_sequence, connection.syn_parameters))
+            connection.local_sequence = (connection.local_sequence + 1) & 0xFF
+            return
+
+        connection = self._connections.get(address)
+        if connection is None:
+            self._send_to(address, pack_rssi_header(RSSI_RST, 0, 0))
+            return
+        if flags & RSSI_RST:
+            del self._connections[address]
+            return
+        if flags & RSSI_ACK:
+            connection.is_open = True
+            self._acknowledge(connection, header[3])
+
+        payload = segment[header_size:]
+        if not (flags & RSSI_NUL or payload):
+            return
+        # Data and NUL segments take a sequence number, and are only accepted in order
+        if header[2] != (connection.remote_sequence + 1) & 0xFF:
+            self._send(connection, pack_rssi_header(RSSI_ACK, connection.local_sequence, connection.remote_sequence))
+            return
+        connection.remote_sequence = header[2]
+
+        response_segments = []
+        if payload:
+            frame = self._packetizers[address].push(payload)
+            if frame:
+                response_segments = self._handle_frame(connection, address, *frame)
+        if response_segments:
+            for response_segment in response_segments:
+                connection.pending.append(response_segment)
+            self._send_pending(connection)
+        else:
+            self._send(connection, pack_rssi_header(RSSI_ACK, connection.local_sequence, connection.remote_sequence))
+
+    def _handle_frame(self, connection, address, tdest, frame):
+        memory = self.routes.get(tdest)
+        if memory is None:
+            return []
+        self.frame_count += 1
+        response = handle_srp_frame(frame, memory)
+        if response is None:
+            return []
+        return self._packetizers[address].split(tdest, response, connection.max_segment_size - RSSI_HEADER_SIZE)
+
+    def _acknowledge(self, connection, acknowledge):
+        # Retire the segments up to the acknowledged sequence number, in the window of the outstanding segments
+        while connection.unacknowledged:
+            sequence = next(iter(connection.unacknowledged))
+            if (acknowledge - sequence) & 0xFF >= 0x80:
+                break
+            del connection.unacknowledged[sequence]
+        self._send_pending(connection)
+
+    def _send_pending(self, connection):
+        while connection.pending and len(connection.unacknowledged) < connection.max_outstanding:
+            sequence = connection.local_sequence
+            segment = pack_rssi_header(RSSI_ACK, sequence, connection.remote_sequence) + connection.pending.popleft()
+            connection.local_sequence = (sequence + 1) & 0xFF
+            connection.unacknowledged[sequence] = [segment, time.time()]
+            self._send(connection, segment)
+
+    def _retransmit(self):
+        now = time.time()
+        for connection in list(self._connections.values()):
+            for entry in connection.unacknowledged.values():
+                if now - entry[1] >= self.RETRANSMIT_TIMEOUT_SECS:
+                    # Refresh the acknowledge number of the retransmitted segment
+                    segment = entry[0]
+                    header = pack_rssi_header(segment[0], segment[2], connection.remote_sequence)
+                    entry[0] = header + segment[RSSI_HEADER_SIZE:]
+                    entry[1] = now
+                    self.retransmit_count += 1
+                    self._send(connection, entry[0])
+
+    def _send(self, connection, segment):
+        self._send_to(connection.address, segment)
+
+    def _send_to(self, address, segment):
+        if self.impairments.drops():
+            return
+        if not self.impairments.is_enabled:
+            self._socket.sendto(segment, address)
+            return
+        send_time = time.time() + self.impairments.send_delay_secs()
+        with self._send_condition:
+            heapq.heappush(self._send_queue, (send_time, next(self._send_counter), bytes(segment), address))
+            self._send_condition.notify()
+
+    def _send_delayed(self):
+        while self._is_running:
+            with self._send_condition:
+                if not self._send_queue:
+                    self._send_condition.wait(0.1)
+                    continue
+                send_time, _, segment, address = self._send_queue[0]
+                delay_secs = send_time - time.time()
+                if delay_secs > 0:
+                    self._send_condition.wait(delay_secs)
+                    continue
+                heapq.heappop(self._send_queue)
+            self._socket.sendto(segment, address)
+
+
+class BoardEmulator:
+    """
+    Emulate the network side of an FPGA board: SRPv3 over the packetizer over RSSI, on the UDP ports of the board.
+
+    Port 8193 serves the register space on tDest 0x0 (packetizer version 1), port 8194 accepts the bulk data
+    connection, and port 8198 serves the register space on tDest 0x0 and the DDR on tDest 0x4 (packetizer version 2,
+    interleaved). The register space and the DDR are in-memory stores, and the register space can be seeded with the
+    default values of the pyrogue device tree. While the board is powered off, all the datagrams are dropped and the
+    connections are reset.
+    """
+    def __init__(self, host="127.0.0.1", ddr_size=DDR_SIZE, impairments=None,
+                 ports=(RSSI_REGISTER_PORT, RSSI_DATA_PORT, RSSI_INTERLEAVED_PORT)):
+        """
+        Parameters
+        ----------
+        host : str
+            The address to serve on. Emulate several boards on the 127.0.0.0/8 loopback addresses.
+        ddr_size : int
+            The size of the DDR in bytes
+        impairments : LinkImpairments
+            The impairments of the datagrams sent and received, or None
+        ports : tuple
+            The register, bulk data and interleaved RSSI ports. Use 0 to pick free ports.
+        """
+        self.registers = SparseMemory(REGISTER_SPACE_SIZE)
+        self.ddr = SparseMemory(ddr_size)
+        self.impairments = impairments or LinkImpairments()
+        self.is_powered = True
+
+        register_port, data_port, interleaved_port = ports
+        is_active = lambda: self.is_powered
+        self.servers = [
+            RssiServer(host, register_port, 1, {TDEST_REGISTERS: self.registers}, self.impairments, is_active),
+            RssiServer(host, data_port, 1, {}, self.impairments, is_active),
+            RssiServer(host, interleaved_port, 2, {TDEST_REGISTERS: self.registers, TDEST_DDR: self.ddr},
+                       self.impairments, is_active),
+        ]
+
+    @property
+    def addresses(self):
+        return [server._socket.getsockname() for server in self.servers]
+
+    def start(self):
+        """
+        Serve in background threads.
+        """
+        for server in self.servers:
+            server.start()
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+    def set_powered(self, is_powered):
+        """
+        Power the emulated board on or off. Powering it off drops all the RSSI connections.
+        """
+        self.is_powered = is_powered
+        if not is_powered:
+            for server in self.servers:
+                server.reset()
+
+
+def seed_registers_from_tree(memory, devices=None):
+    """
+    Write the default values of the registers of the FpgaTopLevel device tree into the register memory.
+
+    Parameters
+    ----------
+    memory : SparseMemory
+        The register memory
+    devices : list
+        The names of the devices of the tree to seed, or None for all of them
+
+    Returns
+    -------
+    The number of registers seeded : int
+    """
+    import pyrogue as pr
+    from FpgaTopLevel import FpgaTopLevel
+
+    root = pr.Root(name='AMCc', description='')
+    root.add(FpgaTopLevel(simGui=True, devices=devices))
+    root.start(pollEn=False)
+    try:
+        seeded_count = 0
+        for variable in _remote_variables(root.FpgaTopLevel.AmcCarrierCore):
+            default = getattr(variable, "_default", None)
+            bit_offsets = getattr(variable, "_bitOffset", None)
+            bit_sizes = getattr(variable, "_bitSize", None)
+            if not isinstance(default, int) or not bit_offsets or not bit_sizes:
+                continue
+
+            span = (max(offset + size for offset, size in zip(bit_offsets, bit_sizes)) + 7) // 8
+            word = int.from_bytes(memory.read(variable.address, span), "little")
+            value = int(default)
+            for offset, size in zip(bit_offsets, bit_sizes):
+                mask = (1 << size) - 1
+                word = (word & ~(mask << offset)) | ((value & mask) << offset)
+                value >>= size
+            memory.write(variable.address, word.to_bytes(span, "little"))
+            seeded_count += 1
+        return seeded_count
+    finally:
+        root.stop()
+
+
+def _remote_variables(device):
+    for variable in device.variables.values():
+        if hasattr(variable, "address") and not getattr(variable, "_isLocal", False):
+            yield variable
+    for child in device.devices.values():
+        yield from _remote_variables(child)
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Emulate an FPGA board serving SRPv3 over RSSI/UDP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="The delay added to every datagram sent.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0,
+                        help="The maximum random delay added on top of the latency.")
+    parser.add_argument("--loss", type=float, default=0.0, help="The probability to drop each datagram.")
+    parser.add_argument("--reorder", type=float, default=0.0,
+                        help="The probability to hold back each datagram sent, so that the next ones overtake it.")
+    parser.add_argument("--seed", type=int, default=None, help="The seed of the random impairments.")
+    parser.add_argument("--seed-from-tree", action="store_true",
+                        help="Seed the registers with the default values of the pyrogue device tree.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    logger.setLevel(logging.INFO)
+
+    impairments = LinkImpairments(latency_secs=args.latency_ms / 1000, jitter_secs=args.jitter_ms / 1000,
+                                  loss_rate=args.loss, reorder_rate=args.reorder, seed=args.seed)
+    emulator = BoardEmulator(args.host, impairments=impairments)
+    if args.seed_from_tree:
+        logger.info("Seeded {0} registers from the device tree".format(seed_registers_from_tree(emulator.registers)))
+    emulator.start()
+    logger.info("Emulating a board on {0}".format(", ".join("{0}:{1}".format(*address)
+                                                            for address in emulator.addresses)))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
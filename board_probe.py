@@ -0,0 +1,289 @@
+# In-process board liveness probing, replacing the ping subprocess
+
+import argparse
+import asyncio
+import os
+import socket
+import struct
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from rssi import pack_rssi_header, RSSI_SYN, RSSI_ACK, RSSI_RST, RSSI_HEADER_SIZE
+
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# The RSSI UDP ports to probe: the legacy non-interleaved RSSI server only. The interleaved RSSI server, on port 8198,
+# serves a single connection, that of pyrogue, which a probe's SYN or RST could break while pyrogue opens it.
+RSSI_PORTS = (8193,)
+
+# The connection parameters of the RSSI SYN probe: version and checksum flags, 1 outstanding segment, a 1024-byte
+# maximum segment size, the retransmission, cumulative acknowledgement and null timeouts, the maximum retransmissions
+# and cumulative acknowledgements, and the timeout unit
+RSSI_PROBE_SYN_PARAMETERS = struct.pack(">BBHHHHBBBB", 0x08, 1, 1024, 50, 50, 3000, 15, 2, 0, 3)
+
+
+def _icmp_checksum(packet):
+    """
+    Compute the Internet checksum of an ICMP packet.
+    """
+    if len(packet) % 2:
+        packet += b"\x00"
+    total = sum(struct.unpack("!{0}H".format(len(packet) // 2), packet))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _build_icmp_echo_request(sequence):
+    """
+    Build an ICMP echo request. The kernel fills in the identifier of unprivileged ICMP sockets.
+    """
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, os.getpid() & 0xFFFF, sequence)
+    payload = b"switchtest"
+    checksum = _icmp_checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, os.getpid() & 0xFFFF, sequence) + payload
+
+
+def build_rssi_syn_probe(sequence):
+    """
+    Build the RSSI SYN opening a connection with a board's RSSI server, which the server answers with a SYN-ACK, or
+    with a RST if it does not accept the connection.
+    """
+    return bytes(pack_rssi_header(RSSI_SYN, sequence, 0, RSSI_PROBE_SYN_PARAMETERS))
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    """
+    Resolve a future as soon as the probed host shows any sign of life.
+
+    The RSSI connection opened by an RSSI SYN probe is reset as soon as its SYN-ACK arrives, or when the probe ends,
+    so that the board does not keep it.
+    """
+    def __init__(self, alive, icmp=False):
+        self.alive = alive
+        self.icmp = icmp
+        self.transport = None
+        self._syn_sequence = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send_syn(self, sequence):
+        self.transport.sendto(build_rssi_syn_probe(sequence))
+        self._syn_sequence = sequence
+
+    def reset(self, acknowledge=0):
+        """
+        Reset the RSSI connection opened by the last SYN probe, if it is not reset already.
+        """
+        if self._syn_sequence is not None and not self.transport.is_closing():
+            self.transport.sendto(bytes(pack_rssi_header(RSSI_RST, self._syn_sequence + 1, acknowledge)))
+        self._syn_sequence = None
+
+    def datagram_received(self, data, addr):
+        if self.icmp and (not data or data[0] != ICMP_ECHO_REPLY):
+            return
+        if not self.icmp and len(data) >= RSSI_HEADER_SIZE and data[0] & RSSI_SYN and data[0] & RSSI_ACK:
+            self.reset(acknowledge=data[2])
+        if not self.alive.done():
+            self.alive.set_result(True)
+
+    def error_received(self, exc):
+        # An ICMP port unreachable means that the host's network stack is up
+        if isinstance(exc, ConnectionRefusedError) and not self.alive.done():
+            self.alive.set_result(True)
+
+
+class BoardProber:
+    """
+    Probe whether a board responds on the network, without forking a ping process.
+
+    The probe uses an unprivileged ICMP echo socket where the host permits it (see the net.ipv4.ping_group_range
+    sysctl), and falls back to RSSI SYN probes on the board's RSSI UDP ports otherwise. A SYN probe counts as a
+    response if the board answers it, with a SYN-ACK or a RST, or if its network stack rejects the datagram with an
+    ICMP port unreachable. Each probe is sent from its own UDP port, and so opens an RSSI connection of its own, apart
+    from the connection of the stress activities.
+
+    The probe attempts are sent interval_secs apart, and the probe returns as soon as the first response arrives. A
+    board is only found unresponsive after every attempt has timed out.
+    """
+    def __init__(self, timeout_secs=1.0, attempts=5, interval_secs=0.2, udp_ports=RSSI_PORTS, use_icmp=True):
+        """
+        Parameters
+        ----------
+        timeout_secs : float
+            How long to wait for a response to the last probe attempt
+        attempts : int
+            The number of probe attempts to send
+        interval_secs : float
+            The delay between two probe attempts
+        udp_ports : tuple
+            The RSSI UDP ports to probe when ICMP sockets are not permitted
+        use_icmp : bool
+            True to probe with ICMP echo requests where permitted; False to always probe with UDP
+        """
+        self.timeout_secs = timeout_secs
+        self.attempts = attempts
+        self.interval_secs = interval_secs
+        self.udp_ports = tuple(udp_ports)
+        self.use_icmp = use_icmp
+
+    @classmethod
+    def from_configs(cls, probe_configs):
+        """
+        Create a prober from the "probe" section of the test configurations.
+        """
+        return cls(timeout_secs=float(probe_configs.get("timeout_secs", 1.0)),
+                   attempts=int(probe_configs.get("attempts", 5)),
+                   interval_secs=float(probe_configs.get("interval_secs", 0.2)),
+                   udp_ports=probe_configs.get("udp_ports", RSSI_PORTS),
+                   use_icmp=probe_configs.get("use_icmp", True))
+
+    async def probe(self, ip_address):
+        """
+        Probe a host.
+
+        Parameters
+        ----------
+        ip_address : str
+            The IP address of the host
+
+        Returns
+        -------
+        True if the host responded to any probe attempt; False if not : bool
+        """
+        loop = asyncio.get_event_loop()
+        alive = loop.create_future()
+        transports = []
+        rssi_protocols = []
+
+        try:
+            icmp_endpoint = self._open_icmp(loop, alive) if self.use_icmp else None
+            if icmp_endpoint:
+                icmp_transport = await icmp_endpoint
+                transports.append(icmp_transport)
+
+                def _send(attempt):
+                    icmp_transport.sendto(_build_icmp_echo_request(attempt), (ip_address, 0))
+            else:
+                for port in self.udp_ports:
+                    transport, protocol = await loop.create_datagram_endpoint(lambda: _ProbeProtocol(alive),
+                                                                              remote_addr=(ip_address, port))
+                    transports.append(transport)
+                    rssi_protocols.append(protocol)
+
+                def _send(attempt):
+                    for protocol in rssi_protocols:
+                        protocol.send_syn(attempt)
+
+            for attempt in range(self.attempts):
+                _send(attempt)
+                wait_secs = self.timeout_secs if attempt == self.attempts - 1 else self.interval_secs
+                try:
+                    return await asyncio.wait_for(asyncio.shield(alive), wait_secs)
+                except asyncio.TimeoutError:
+                    pass
+            return False
+        finally:
+            for protocol in rssi_protocols:
+                protocol.reset()
+            for transport in transports:
+                transport.close()
+
+    def _open_icmp(self, loop, alive):
+        """
+        Open an unprivileged ICMP echo socket.
+
+        Returns
+        -------
+        The coroutine creating the datagram endpoint, or None if the host does not permit ICMP sockets
+        """
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        except (PermissionError, OSError) as error:
+            logger.debug("ICMP sockets are not permitted ({0}). Probing the UDP ports {1} instead."
+                         .format(error, self.udp_ports))
+            return None
+
+        sock.setblocking(False)
+
+        async def _create():
+            transport, _ = await loop.create_datagram_endpoint(lambda: _ProbeProtocol(alive, icmp=True), sock=sock)
+            return transport
+        return _create()
+
+    def is_alive(self, ip_address):
+        """
+        Probe a host from synchronous code.
+
+        Returns
+        -------
+        True if the host responded to any probe attempt; False if not : bool
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.probe(ip_address))
+        finally:
+            loop.close()
+
+
+class UdpEchoServerProtocol(asyncio.DatagramProtocol):
+    """
+    A local stand-in for a board, echoing back every datagram.
+    """
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+
+
+async def serve_udp_echo(host="127.0.0.1", ports=RSSI_PORTS):
+    """
+    Serve UDP echo on the given ports until cancelled.
+    """
+    loop = asyncio.get_event_loop()
+    transports = []
+    try:
+        for port in ports:
+            transport, _ = await loop.create_datagram_endpoint(UdpEchoServerProtocol, local_addr=(host, port))
+            transports.append(transport)
+        logger.info("Serving UDP echo on {0}, ports {1}".format(host, ", ".join(map(str, ports))))
+        await loop.create_future()
+    finally:
+        for transport in transports:
+            transport.close()
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Probe whether a board responds on the network.")
+    parser.add_argument("ip_address", help="The IP address to probe, or to serve UDP echo on with --echo-server.")
+    parser.add_argument("--udp-only", action="store_true", help="Probe the RSSI UDP ports only.")
+    parser.add_argument("--udp-ports", type=int, nargs="+", default=list(RSSI_PORTS))
+    parser.add_argument("--timeout-secs", type=float, default=1.0)
+    parser.add_argument("--attempts", type=int, default=5)
+    parser.add_argument("--echo-server", action="store_true",
+                        help="Serve UDP echo on the RSSI ports instead, as a local stand-in for a board.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    logger.setLevel(logging.INFO)
+
+    if args.echo_server:
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(serve_udp_echo(args.ip_address, args.udp_ports))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.close()
+    else:
+        prober = BoardProber(timeout_secs=args.timeout_secs, attempts=args.attempts, udp_ports=args.udp_ports,
+                             use_icmp=not args.udp_only)
+        alive = prober.is_alive(args.ip_address)
+        logger.info("{0} is {1}".format(args.ip_address, "ALIVE" if alive else "NOT RESPONDING"))
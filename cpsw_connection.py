@@ -0,0 +1,128 @@
+# A cached CPSW hierarchy of a board, surviving the board power cycles of the test
+
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import record_metric, record_latency
+
+
+class CpswConnection:
+    """
+    Keep one loaded CPSW hierarchy, and the ScalVal handles created from it, across the test iterations.
+
+    The YAML hierarchy is loaded on the first connection only, and each ScalVal handle is created on first use. On
+    each later connection, after the board is power cycled, a register read is retried with a bounded exponential
+    backoff until the board answers. If the board still does not answer after REBIND_AFTER_ATTEMPTS attempts, the
+    hierarchy is reloaded, with a new protocol stack, and the cached handles are rebound to it.
+    """
+    # The number of failed register reads after which the hierarchy is reloaded
+    REBIND_AFTER_ATTEMPTS = 3
+
+    def __init__(self, yaml_path, load_hierarchy, create_scal_val, top_dev="NetIODev",
+                 probe_path="mmio/AmcCarrierCore/AxiVersion/ScratchPad", initial_backoff_secs=0.1,
+                 max_backoff_secs=5.0, connect_timeout_secs=120):
+        """
+        Parameters
+        ----------
+        yaml_path : str
+            The CPSW YAML file of the top-level device
+        load_hierarchy : callable
+            Called as load_hierarchy(yaml_path, top_dev) to load the hierarchy, e.g. Path.loadYamlFile
+        create_scal_val : callable
+            Called as create_scal_val(path) to create a ScalVal handle, e.g. ScalVal.create
+        top_dev : str
+            The name of the top-level device in the YAML file
+        probe_path : str
+            The path of the register read to check that the board answers
+        initial_backoff_secs : float
+            The delay before the first connection retry
+        max_backoff_secs : float
+            The maximum delay between two connection retries
+        connect_timeout_secs : float
+            How long to retry before giving up on a connection
+        """
+        self.yaml_path = yaml_path
+        self.load_hierarchy = load_hierarchy
+        self.create_scal_val = create_scal_val
+        self.top_dev = top_dev
+        self.probe_path = probe_path
+        self.initial_backoff_secs = initial_backoff_secs
+        self.max_backoff_secs = max_backoff_secs
+        self.connect_timeout_secs = connect_timeout_secs
+        self.root = None
+        self._scal_vals = {}
+
+    def connect(self):
+        """
+        Load the hierarchy on first use, and wait for the first successful register read.
+
+        Raises RuntimeError
+        """
+        start_time = time.time()
+        if self.root is None:
+            self._load()
+
+        backoff_secs = self.initial_backoff_secs
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                self.scal_val(self.probe_path).getVal()
+                break
+            except Exception as error:
+                elapsed_secs = time.time() - start_time
+                if elapsed_secs + backoff_secs > self.connect_timeout_secs:
+                    raise RuntimeError("Cannot reach the board through {0} after {1} attempts over {2:.1f} seconds: "
+                                       "{3}".format(self.yaml_path, attempts, elapsed_secs, error))
+                logger.debug("The board is not answering CPSW yet ({0}). Retrying in {1:.2f} seconds."
+                             .format(error, backoff_secs))
+
+            if attempts == self.REBIND_AFTER_ATTEMPTS:
+                self.rebind()
+            time.sleep(backoff_secs)
+            backoff_secs = min(backoff_secs * 2, self.max_backoff_secs)
+
+        elapsed_secs = time.time() - start_time
+        record_metric("cpsw_time_to_first_transaction_secs", elapsed_secs)
+        record_latency("reconnect", elapsed_secs)
+        logger.info("The first CPSW transaction with the board succeeded {0:.2f} seconds after connecting, after {1} "
+                    "attempts.".format(elapsed_secs, attempts))
+
+    def scal_val(self, path):
+        """
+        Get the ScalVal handle of a path, created on first use and cached.
+
+        Parameters
+        ----------
+        path : str
+            The path of the variable from the top-level device, e.g. "mmio/AmcCarrierCore/AxiVersion/ScratchPad", or
+            "ddr/Words" for an array
+
+        Returns
+        -------
+        The ScalVal handle
+        """
+        scal_val = self._scal_vals.get(path)
+        if scal_val is None:
+            scal_val = self._scal_vals[path] = self.create_scal_val(self.root.findByName(path))
+        return scal_val
+
+    def rebind(self):
+        """
+        Reload the hierarchy, and recreate the cached ScalVal handles from it.
+        """
+        logger.info("Reloading the CPSW hierarchy and rebinding {0} ScalVal handles".format(len(self._scal_vals)))
+        paths = list(self._scal_vals)
+        self._scal_vals = {}
+        self.root = None
+        self._load()
+        for path in paths:
+            self.scal_val(path)
+
+    def _load(self):
+        start_time = time.time()
+        self.root = self.load_hierarchy(self.yaml_path, self.top_dev)
+        logger.info("Loaded the CPSW hierarchy from {0} in {1:.2f} seconds"
+                    .format(self.yaml_path, time.time() - start_time))
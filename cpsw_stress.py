@@ -0,0 +1,80 @@
+# Batched CPSW stress engine
+
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import summarize_latencies, format_latency_summary
+
+
+def batch_start_indices(region_words, batch_words, batch_count):
+    """
+    Spread the first word index of each batch across an array region, cycling back to the start of the region.
+
+    Returns
+    -------
+    The first word index of each batch : list
+    """
+    batches_per_region = max(region_words // batch_words, 1)
+    return [(i % batches_per_region) * batch_words for i in range(batch_count)]
+
+
+def run_cpsw_batched_stress(scal_val, batch_words=1024, batch_count=1000, seed=0):
+    """
+    Write batches of words to an array ScalVal, e.g. a DDR region, and read each batch back, so that each CPSW
+    transaction moves many words instead of one.
+
+    Parameters
+    ----------
+    scal_val : ScalVal
+        The array ScalVal handle, with nelms of at least batch_words
+    batch_words : int
+        The number of 32-bit words in each batch
+    batch_count : int
+        The number of batches to write and read back
+    seed : int
+        Added to the words of each batch, so that each test iteration writes different values
+
+    Returns
+    -------
+    The latency summary of the batch write and read round trips, with the MB/s of the words written and read back :
+    dict
+
+    Raises ValueError, RuntimeError
+    """
+    region_words = scal_val.getNelms()
+    if batch_words <= 0 or batch_words > region_words:
+        raise ValueError("Invalid CPSW batch size ({0} words). Use a positive size, up to the {1} words of the array."
+                         .format(batch_words, region_words))
+
+    latencies = []
+    mismatches = 0
+
+    logger.info("-- CPSW: Start writing to and reading batches of {0} words from the board --".format(batch_words))
+
+    start_time = time.perf_counter()
+    for i, first_index in enumerate(batch_start_indices(region_words, batch_words, batch_count)):
+        expected = [(seed + i + first_index + j) & 0xFFFFFFFF for j in range(batch_words)]
+        last_index = first_index + batch_words - 1
+
+        batch_start_time = time.perf_counter()
+        scal_val.setVal(expected, fromIdx=first_index, toIdx=last_index)
+        values = scal_val.getVal(fromIdx=first_index, toIdx=last_index)
+        latencies.append(time.perf_counter() - batch_start_time)
+
+        batch_mismatches = sum(1 for value, expected_value in zip(values, expected) if value != expected_value)
+        if batch_mismatches:
+            mismatches += batch_mismatches
+            logger.error("-- CPSW: Batch at word {0}: {1} read-back mismatches".format(first_index, batch_mismatches))
+    elapsed_secs = time.perf_counter() - start_time
+
+    summary = summarize_latencies(latencies, elapsed_secs)
+    summary["mismatches"] = mismatches
+    summary["mb_per_sec"] = 2 * 4 * batch_words * batch_count / elapsed_secs / 1e6 if elapsed_secs > 0 else 0.0
+    logger.info("-- CPSW: Batched stress: {0}, {1:.1f} MB/s written and read back, {2} mismatches"
+                .format(format_latency_summary(summary), summary["mb_per_sec"], mismatches))
+
+    if mismatches:
+        raise RuntimeError("CPSW batched stress failed with {0} read-back mismatches".format(mismatches))
+    return summary
@@ -0,0 +1,154 @@
+# Bulk DDR throughput benchmark over the interleaved RSSI link
+
+import json
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import summarize_latencies, format_latency_summary, log2_histogram
+from transactions import TransactionWindow
+
+try:
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+# The size of the DDR memory window of the FpgaTopLevel DDR device (srpDdr, tDest 0x4)
+DDR_WINDOW_SIZE = 0x10000000
+
+DEFAULT_BLOCK_SIZES = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# A block size reaching this fraction of the peak throughput is where the switch path saturates
+SATURATION_EFFICIENCY = 0.9
+
+
+def sweep_offsets(block_size, offset_count, window_size=DDR_WINDOW_SIZE):
+    """
+    Spread block offsets evenly across the memory window, aligned to the block size.
+
+    Parameters
+    ----------
+    block_size : int
+        The block size in bytes, a multiple of 4
+    offset_count : int
+        The number of offsets to spread
+    window_size : int
+        The size of the memory window in bytes
+
+    Returns
+    -------
+    The block offsets, in ascending order : list
+    """
+    alignment = block_size if block_size & (block_size - 1) == 0 else 4
+    last_offset = window_size - block_size
+    if offset_count < 2 or last_offset <= 0:
+        return [0]
+    return sorted({(last_offset * i // (offset_count - 1)) // alignment * alignment for i in range(offset_count)})
+
+
+def run_ddr_benchmark(ddr, block_sizes=DEFAULT_BLOCK_SIZES, offsets_per_size=16, reads_per_size=256,
+                      in_flight_depth=8):
+    """
+    Read DDR blocks of each size from offsets spread across the DDR window, keeping several SRPv3 reads in flight,
+    and measure the throughput and the latency of each size.
+
+    Blocks larger than the maximum transaction size of the memory path are read as several back-to-back transactions.
+
+    Parameters
+    ----------
+    ddr : pr.Device
+        The FpgaTopLevel DDR device
+    block_sizes : tuple
+        The block sizes to sweep, in bytes. Each size must be a multiple of 4.
+    offsets_per_size : int
+        The number of offsets to spread across the DDR window for each block size
+    reads_per_size : int
+        The number of blocks to read for each block size, cycling through the offsets
+    in_flight_depth : int
+        The maximum number of SRPv3 transactions in flight
+
+    Returns
+    -------
+    The benchmark results: the summary of each block size, the size where the throughput saturates, and the
+    transaction error count : dict
+    """
+    max_transaction_size = ddr._reqMaxAccess()
+    window = TransactionWindow(ddr, depth=in_flight_depth)
+    results = []
+
+    logger.info("-- pyrogue: Start the DDR benchmark, {0} transactions in flight, maximum transaction size {1} bytes "
+                "--".format(in_flight_depth, max_transaction_size))
+
+    for block_size in block_sizes:
+        if block_size <= 0 or block_size % 4:
+            raise ValueError("Invalid DDR benchmark block size ({0}). Use a positive multiple of 4.".format(block_size))
+
+        offsets = sweep_offsets(block_size, offsets_per_size)
+        transaction_size = min(block_size, max_transaction_size)
+        window.latencies = []
+        window.errors = 0
+
+        start_time = time.perf_counter()
+        for i in range(reads_per_size):
+            block_offset = offsets[i % len(offsets)]
+            for chunk_offset in range(0, block_size, transaction_size):
+                window.submit(block_offset + chunk_offset,
+                              bytearray(min(transaction_size, block_size - chunk_offset)), rim.Read,
+                              operation="ddr_read")
+        window.drain()
+        elapsed_secs = time.perf_counter() - start_time
+
+        summary = summarize_latencies(window.latencies, elapsed_secs)
+        summary.update({
+            "block_size": block_size,
+            "transactions_per_block": -(-block_size // transaction_size),
+            "offsets": len(offsets),
+            "blocks": reads_per_size,
+            "elapsed_secs": elapsed_secs,
+            "mb_per_sec": block_size * reads_per_size / elapsed_secs / 1e6 if elapsed_secs > 0 else 0.0,
+            "errors": window.errors,
+            "latency_histogram_us": log2_histogram(window.latencies),
+        })
+        results.append(summary)
+        logger.info("-- pyrogue: DDR benchmark, {0} byte blocks: {1:.1f} MB/s, {2}, {3} errors"
+                    .format(block_size, summary["mb_per_sec"], format_latency_summary(summary), window.errors))
+
+    peak_mb_per_sec = max(result["mb_per_sec"] for result in results) if results else 0.0
+    saturation_block_size = None
+    for result in results:
+        result["efficiency"] = result["mb_per_sec"] / peak_mb_per_sec if peak_mb_per_sec else 0.0
+        if saturation_block_size is None and result["efficiency"] >= SATURATION_EFFICIENCY:
+            saturation_block_size = result["block_size"]
+
+    logger.info("-- pyrogue: End the DDR benchmark. Peak {0:.1f} MB/s, saturating from {1} byte blocks --"
+                .format(peak_mb_per_sec, saturation_block_size))
+
+    return {
+        "max_transaction_size": max_transaction_size,
+        "in_flight_depth": in_flight_depth,
+        "peak_mb_per_sec": peak_mb_per_sec,
+        "saturation_block_size": saturation_block_size,
+        "errors": sum(result["errors"] for result in results),
+        "sizes": results,
+    }
+
+
+def save_benchmark_results(results, output_path, **labels):
+    """
+    Append the benchmark results to a JSON lines file, one line per benchmark run.
+
+    Parameters
+    ----------
+    results : dict
+        The benchmark results
+    output_path : str
+        The path of the JSON lines file
+    labels : dict
+        Extra fields to identify the run, e.g. the board IP address
+    """
+    record = dict(labels, timestamp=time.time(), **results)
+    with open(output_path, "a") as output_file:
+        output_file.write(json.dumps(record) + "\n")
+    logger.info("Saved the DDR benchmark results to {0}".format(output_path))
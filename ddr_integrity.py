@@ -0,0 +1,203 @@
+# Zero-copy DDR reads and writes, and DDR data integrity verification with known data patterns
+
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from ddr_benchmark import DDR_WINDOW_SIZE, sweep_offsets
+from transactions import TransactionWindow
+
+try:
+    import numpy as np
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+DDR_PATTERNS = ("address", "prbs")
+
+# The number of mismatching words to log when a verification fails
+MISMATCH_REPORT_COUNT = 8
+
+
+class DdrAccessor:
+    """
+    Read and write DDR blocks directly from and into preallocated buffers.
+
+    The transactions are issued on slices of a memoryview over the caller's buffer, which the memory master fills or
+    sends in place, so that no Python int list is built for the data. Blocks larger than the maximum transaction size of
+    the memory path are split into several transactions, kept in flight together.
+    """
+    def __init__(self, ddr, in_flight_depth=8):
+        """
+        Parameters
+        ----------
+        ddr : pr.Device
+            The FpgaTopLevel DDR device
+        in_flight_depth : int
+            The maximum number of SRPv3 transactions in flight
+        """
+        self.window = TransactionWindow(ddr, depth=in_flight_depth)
+        self.max_transaction_size = ddr._reqMaxAccess()
+
+    def read_into(self, buffer, offset):
+        """
+        Read a DDR block into a buffer, sized to the block.
+
+        Parameters
+        ----------
+        buffer : np.ndarray or bytearray
+            A writable, contiguous buffer to receive the data
+        offset : int
+            The DDR byte offset of the block
+
+        Returns
+        -------
+        The buffer
+        """
+        self._transfer(buffer, offset, rim.Read)
+        return buffer
+
+    def write_from(self, buffer, offset):
+        """
+        Write a DDR block from a buffer.
+
+        Parameters
+        ----------
+        buffer : np.ndarray or bytearray
+            A contiguous buffer holding the data
+        offset : int
+            The DDR byte offset of the block
+        """
+        self._transfer(buffer, offset, rim.Write)
+
+    def _transfer(self, buffer, offset, txn_type):
+        view = memoryview(buffer).cast("B")
+        errors = self.window.errors
+        operation = "ddr_read" if txn_type == rim.Read else "ddr_write"
+        for chunk_offset in range(0, len(view), self.max_transaction_size):
+            self.window.submit(offset + chunk_offset, view[chunk_offset:chunk_offset + self.max_transaction_size],
+                               txn_type, operation=operation)
+        self.window.drain()
+
+        if self.window.errors != errors:
+            raise RuntimeError("DDR {0} of {1} bytes at offset 0x{2:08X} failed with {3} transaction errors"
+                               .format("read" if txn_type == rim.Read else "write", len(view), offset,
+                                       self.window.errors - errors))
+
+
+def build_pattern(pattern, offset, word_count, seed=1):
+    """
+    Build the 32-bit words of a known data pattern for a DDR block.
+
+    Parameters
+    ----------
+    pattern : str
+        "address" for each word holding its own DDR byte offset, or "prbs" for pseudo-random words, repeatable from the
+        seed and the block offset
+    offset : int
+        The DDR byte offset of the block
+    word_count : int
+        The number of 32-bit words in the block
+    seed : int
+        The seed of the "prbs" pattern
+
+    Returns
+    -------
+    The pattern words : np.ndarray of np.uint32
+    """
+    if pattern == "address":
+        return np.arange(offset, offset + word_count * 4, 4, dtype=np.uint32)
+    if pattern == "prbs":
+        random_state = np.random.RandomState((seed * 0x9E3779B1 + offset) & 0xFFFFFFFF)
+        return random_state.randint(0, 1 << 32, size=word_count, dtype=np.uint64).astype(np.uint32)
+    raise ValueError("Invalid DDR pattern ({0}). Choose one of {1}.".format(pattern, ", ".join(DDR_PATTERNS)))
+
+
+def find_mismatches(expected, actual, offset):
+    """
+    Compare the words read back from a DDR block with the expected ones.
+
+    Returns
+    -------
+    The mismatch count, and the (DDR byte offset, expected, actual) words of the first mismatches : tuple
+    """
+    mismatch_indices = np.flatnonzero(expected != actual)
+    first_mismatches = [(offset + int(index) * 4, int(expected[index]), int(actual[index]))
+                        for index in mismatch_indices[:MISMATCH_REPORT_COUNT]]
+    return len(mismatch_indices), first_mismatches
+
+
+def run_ddr_integrity_check(ddr, pattern="address", block_size=0x400000, block_count=16, in_flight_depth=8, seed=1):
+    """
+    Fill DDR blocks spread across the DDR window with a known data pattern, read them back, and compare every word, to
+    detect data corrupted through the switch.
+
+    Parameters
+    ----------
+    ddr : pr.Device
+        The FpgaTopLevel DDR device
+    pattern : str
+        "address" or "prbs"
+    block_size : int
+        The size of each block in bytes, a multiple of 4
+    block_count : int
+        The number of blocks to spread across the DDR window
+    in_flight_depth : int
+        The maximum number of SRPv3 transactions in flight
+    seed : int
+        The seed of the "prbs" pattern
+
+    Returns
+    -------
+    The byte count, the write and read MB/s, and the mismatch count with the first mismatches : dict
+    """
+    if block_size <= 0 or block_size % 4 or block_size > DDR_WINDOW_SIZE:
+        raise ValueError("Invalid DDR block size ({0}). Use a positive multiple of 4, up to 0x{1:X}."
+                         .format(block_size, DDR_WINDOW_SIZE))
+
+    accessor = DdrAccessor(ddr, in_flight_depth=in_flight_depth)
+    read_buffer = np.empty(block_size // 4, dtype=np.uint32)
+    offsets = sweep_offsets(block_size, block_count)
+    write_secs = read_secs = 0.0
+    mismatch_count = 0
+    first_mismatches = []
+
+    logger.info("-- pyrogue: Start the DDR integrity check, {0} blocks of {1} bytes, {2} pattern --"
+                .format(len(offsets), block_size, pattern))
+
+    for offset in offsets:
+        expected = build_pattern(pattern, offset, block_size // 4, seed=seed)
+
+        start_time = time.perf_counter()
+        accessor.write_from(expected, offset)
+        write_secs += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        accessor.read_into(read_buffer, offset)
+        read_secs += time.perf_counter() - start_time
+
+        block_mismatch_count, block_first_mismatches = find_mismatches(expected, read_buffer, offset)
+        if block_mismatch_count:
+            logger.error("-- pyrogue: DDR block at offset 0x{0:08X}: {1} mismatching words. First mismatches "
+                         "(offset, expected, read): {2}"
+                         .format(offset, block_mismatch_count,
+                                 ", ".join("(0x{0:08X}, 0x{1:08X}, 0x{2:08X})".format(*mismatch)
+                                           for mismatch in block_first_mismatches)))
+            mismatch_count += block_mismatch_count
+            first_mismatches.extend(block_first_mismatches[:MISMATCH_REPORT_COUNT - len(first_mismatches)])
+
+    byte_count = block_size * len(offsets)
+    summary = {
+        "pattern": pattern,
+        "byte_count": byte_count,
+        "write_mb_per_sec": byte_count / write_secs / 1e6 if write_secs > 0 else 0.0,
+        "read_mb_per_sec": byte_count / read_secs / 1e6 if read_secs > 0 else 0.0,
+        "mismatches": mismatch_count,
+        "first_mismatches": first_mismatches,
+    }
+    logger.info("-- pyrogue: End the DDR integrity check. {0} bytes, write {1:.1f} MB/s, read {2:.1f} MB/s, {3} "
+                "mismatching words --".format(byte_count, summary["write_mb_per_sec"], summary["read_mb_per_sec"],
+                                              mismatch_count))
+    return summary
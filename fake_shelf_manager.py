@@ -0,0 +1,233 @@
+# A local stand-in for an ATCA shelf manager, serving the IPMI-over-LAN commands the test uses
+
+import argparse
+import struct
+import socket
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from ipmi_session import IpmiError, IpmiMessage, pack_lan_packet, unpack_lan_packet, IPMI_LAN_PORT, AUTH_TYPE_NONE, \
+    NETFN_APP, NETFN_SENSOR_EVENT, NETFN_PICMG, CMD_GET_DEVICE_ID, CMD_SEND_MESSAGE, \
+    CMD_GET_CHANNEL_AUTH_CAPABILITIES, CMD_GET_SESSION_CHALLENGE, CMD_ACTIVATE_SESSION, \
+    CMD_SET_SESSION_PRIVILEGE_LEVEL, CMD_CLOSE_SESSION, CMD_GET_DEVICE_SDR, CMD_RESERVE_DEVICE_SDR_REPOSITORY, \
+    CMD_GET_SENSOR_READING, PICMG_IDENTIFIER, PICMG_CMD_SET_FRU_ACTIVATION_POLICY, PICMG_CMD_SET_FRU_ACTIVATION, \
+    SDR_TYPE_COMPACT_SENSOR, SDR_LAST_RECORD_ID, SENSOR_TYPE_FRU_HOT_SWAP
+
+
+COMPLETION_CODE_OK = 0x00
+COMPLETION_CODE_INVALID_COMMAND = 0xC1
+COMPLETION_CODE_INVALID_DATA = 0xCC
+
+HOT_SWAP_SENSOR_NUMBER = 0
+HOT_SWAP_SENSOR_NAME = "Hot Swap"
+
+
+class FakeBoard:
+    """
+    The FRU 0 of a board, moving between the M1 (inactive) and M4 (active) hot swap states.
+    """
+    def __init__(self, transition_delay_secs=0.0):
+        self.transition_delay_secs = transition_delay_secs
+        self.locked = False
+        self._state = 4
+        self._target_state = 4
+        self._transition_time = 0.0
+
+    @property
+    def hot_swap_state(self):
+        if self._state != self._target_state and time.time() >= self._transition_time:
+            self._state = self._target_state
+        return self._state
+
+    def transition(self, target_state):
+        self._target_state = target_state
+        self._transition_time = time.time() + self.transition_delay_secs
+
+
+def _build_hot_swap_sdr_record():
+    """
+    Build the compact sensor SDR record of the board's FRU hot swap sensor.
+    """
+    body = bytearray(27)
+    body[0] = 0x20                            # Sensor owner ID
+    body[2] = HOT_SWAP_SENSOR_NUMBER
+    body[3] = 0xA0                            # Entity ID: PICMG front board
+    body[7] = SENSOR_TYPE_FRU_HOT_SWAP
+    body[8] = 0x6F                            # Sensor-specific event/reading type
+    body[26] = 0xC0 | len(HOT_SWAP_SENSOR_NAME)
+    body += HOT_SWAP_SENSOR_NAME.encode("ascii")
+    return struct.pack("<HBBB", 0, 0x51, SDR_TYPE_COMPACT_SENSOR, len(body)) + bytes(body)
+
+
+class FakeShelfManager:
+    """
+    Serve the IPMI v1.5 LAN commands the test uses, without authentication: session management, and the PICMG FRU
+    activation, device SDR and sensor reading commands bridged to the boards. Every IPMB address is a board, active
+    when first addressed.
+    """
+    def __init__(self, host="127.0.0.1", port=IPMI_LAN_PORT, transition_delay_secs=0.0):
+        """
+        Parameters
+        ----------
+        host : str
+            The address to serve on
+        port : int
+            The UDP port to serve on. Use 0 to pick a free port.
+        transition_delay_secs : float
+            How long a board takes to reach the M1 or M4 state after a FRU activation command
+        """
+        self.transition_delay_secs = transition_delay_secs
+        self.boards = {}
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.settimeout(0.1)
+        self._next_session_id = 0x1000
+        self._sdr_record = _build_hot_swap_sdr_record()
+        self._thread = None
+        self._is_running = False
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self._is_running = True
+        self._thread = threading.Thread(target=self.serve_forever, name="FakeShelfManager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._is_running = False
+        if self._thread:
+            self._thread.join()
+        self._socket.close()
+
+    def serve_forever(self):
+        self._is_running = True
+        while self._is_running:
+            try:
+                packet, address = self._socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+
+            try:
+                session_sequence, session_id, message = unpack_lan_packet(packet)
+                request = IpmiMessage.unpack(message)
+            except IpmiError as error:
+                logger.debug("Dropping a packet from {0}: {1}".format(address, error))
+                continue
+
+            for response_data in self._handle(request):
+                response = IpmiMessage(request.second_address, request.netfn + 1, request.second_lun,
+                                       request.first_address, request.sequence, request.first_lun, request.cmd,
+                                       response_data)
+                self._socket.sendto(pack_lan_packet(0, session_id, response.pack()), address)
+
+    def get_board(self, target):
+        if target not in self.boards:
+            self.boards[target] = FakeBoard(self.transition_delay_secs)
+        return self.boards[target]
+
+    def _handle(self, request):
+        """
+        Handle a request to the shelf manager.
+
+        Returns
+        -------
+        The data of each response to send : list
+        """
+        if request.netfn != NETFN_APP:
+            return [bytes([COMPLETION_CODE_INVALID_COMMAND])]
+
+        if request.cmd == CMD_SEND_MESSAGE:
+            bridged = IpmiMessage.unpack(request.data[1:])
+            bridged_response = IpmiMessage(bridged.second_address, bridged.netfn + 1, bridged.second_lun,
+                                           bridged.first_address, bridged.sequence, bridged.first_lun, bridged.cmd,
+                                           self._handle_board(self.get_board(bridged.first_address), bridged))
+            return [bytes([COMPLETION_CODE_OK]), bytes([COMPLETION_CODE_OK]) + bridged_response.pack()]
+
+        if request.cmd == CMD_GET_CHANNEL_AUTH_CAPABILITIES:
+            return [bytes([COMPLETION_CODE_OK, 0x01, 1 << AUTH_TYPE_NONE, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])]
+
+        if request.cmd == CMD_GET_SESSION_CHALLENGE:
+            self._next_session_id += 1
+            return [bytes([COMPLETION_CODE_OK]) + struct.pack("<I", self._next_session_id) + bytes(16)]
+
+        if request.cmd == CMD_ACTIVATE_SESSION:
+            return [bytes([COMPLETION_CODE_OK, AUTH_TYPE_NONE]) + struct.pack("<II", self._next_session_id, 1)
+                    + bytes([request.data[1]])]
+
+        if request.cmd == CMD_SET_SESSION_PRIVILEGE_LEVEL:
+            return [bytes([COMPLETION_CODE_OK, request.data[0]])]
+
+        if request.cmd == CMD_CLOSE_SESSION:
+            return [bytes([COMPLETION_CODE_OK])]
+
+        if request.cmd == CMD_GET_DEVICE_ID:
+            return [bytes([COMPLETION_CODE_OK]) + bytes(11)]
+
+        return [bytes([COMPLETION_CODE_INVALID_COMMAND])]
+
+    def _handle_board(self, board, request):
+        """
+        Handle a request bridged to a board.
+
+        Returns
+        -------
+        The response data : bytes
+        """
+        if request.netfn == NETFN_PICMG and request.cmd == PICMG_CMD_SET_FRU_ACTIVATION:
+            board.transition(4 if request.data[2] else 1)
+            return bytes([COMPLETION_CODE_OK, PICMG_IDENTIFIER])
+
+        if request.netfn == NETFN_PICMG and request.cmd == PICMG_CMD_SET_FRU_ACTIVATION_POLICY:
+            # Bit 0 of the mask and value is the Locked bit. Unlocking an inactive FRU lets it activate.
+            if request.data[2] & 0x1:
+                board.locked = bool(request.data[3] & 0x1)
+                if not board.locked and board.hot_swap_state == 1:
+                    board.transition(4)
+            return bytes([COMPLETION_CODE_OK, PICMG_IDENTIFIER])
+
+        if request.netfn == NETFN_SENSOR_EVENT and request.cmd == CMD_RESERVE_DEVICE_SDR_REPOSITORY:
+            return bytes([COMPLETION_CODE_OK, 0x01, 0x00])
+
+        if request.netfn == NETFN_SENSOR_EVENT and request.cmd == CMD_GET_DEVICE_SDR:
+            record_id, offset, count = struct.unpack_from("<HBB", request.data, 2)
+            if record_id != 0:
+                return bytes([COMPLETION_CODE_INVALID_DATA])
+            return bytes([COMPLETION_CODE_OK]) + struct.pack("<H", SDR_LAST_RECORD_ID) \
+                + self._sdr_record[offset:offset + count]
+
+        if request.netfn == NETFN_SENSOR_EVENT and request.cmd == CMD_GET_SENSOR_READING:
+            if request.data[0] != HOT_SWAP_SENSOR_NUMBER:
+                return bytes([COMPLETION_CODE_INVALID_DATA])
+            return bytes([COMPLETION_CODE_OK, 0x00, 0xC0]) + struct.pack("<H", 1 << board.hot_swap_state)
+
+        return bytes([COMPLETION_CODE_INVALID_COMMAND])
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Serve a fake ATCA shelf manager over IPMI LAN.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=IPMI_LAN_PORT)
+    parser.add_argument("--transition-delay-secs", type=float, default=2.0,
+                        help="How long a board takes to activate or deactivate.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    logger.setLevel(logging.INFO)
+
+    shelf_manager = FakeShelfManager(args.host, args.port, transition_delay_secs=args.transition_delay_secs)
+    logger.info("Serving a fake shelf manager on {0}:{1}".format(*shelf_manager.address))
+    try:
+        shelf_manager.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,568 @@
+# Persistent IPMI-over-LAN sessions to the shelf manager, replacing one ipmitool process per command
+
+import collections
+import os
+import shlex
+import socket
+import struct
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+
+IPMI_LAN_PORT = 623
+
+# RMCP header: version 1.0, no RMCP ACK, IPMI message class
+RMCP_HEADER = bytes([0x06, 0x00, 0xFF, 0x07])
+
+AUTH_TYPE_NONE = 0x00
+PRIVILEGE_ADMINISTRATOR = 0x04
+
+BMC_ADDRESS = 0x20
+REMOTE_SWID = 0x81
+
+NETFN_SENSOR_EVENT = 0x04
+NETFN_APP = 0x06
+NETFN_PICMG = 0x2C
+
+CMD_GET_DEVICE_ID = 0x01
+CMD_SEND_MESSAGE = 0x34
+CMD_GET_CHANNEL_AUTH_CAPABILITIES = 0x38
+CMD_GET_SESSION_CHALLENGE = 0x39
+CMD_ACTIVATE_SESSION = 0x3A
+CMD_SET_SESSION_PRIVILEGE_LEVEL = 0x3B
+CMD_CLOSE_SESSION = 0x3C
+
+CMD_GET_DEVICE_SDR = 0x21
+CMD_RESERVE_DEVICE_SDR_REPOSITORY = 0x22
+CMD_GET_SENSOR_READING = 0x2D
+
+PICMG_IDENTIFIER = 0x00
+PICMG_CMD_SET_FRU_ACTIVATION_POLICY = 0x0A
+PICMG_CMD_SET_FRU_ACTIVATION = 0x0C
+
+SDR_TYPE_FULL_SENSOR = 0x01
+SDR_TYPE_COMPACT_SENSOR = 0x02
+SDR_LAST_RECORD_ID = 0xFFFF
+SDR_READ_CHUNK_SIZE = 16
+
+SENSOR_TYPE_FRU_HOT_SWAP = 0xF0
+
+HOT_SWAP_STATE_NAMES = ("FRU Not Installed", "FRU Inactive", "FRU Activation Request", "FRU Activation In Progress",
+                        "FRU Active", "FRU Deactivation Request", "FRU Deactivation In Progress",
+                        "FRU Communication Lost")
+
+
+class IpmiError(Exception):
+    pass
+
+
+class IpmiTimeoutError(IpmiError):
+    pass
+
+
+class IpmiSensorNotFoundError(IpmiError):
+    pass
+
+
+class IpmiCompletionCodeError(IpmiError):
+    def __init__(self, netfn, cmd, completion_code):
+        super().__init__("IPMI command 0x{0:02x} (netFn 0x{1:02x}) failed with completion code 0x{2:02x}"
+                         .format(cmd, netfn, completion_code))
+        self.completion_code = completion_code
+
+
+class IpmiMessage:
+    """
+    An IPMI message, as carried by the LAN interface and the IPMB. For a request, first_address is the responder's
+    address and second_address the requester's; a response swaps them.
+    """
+    def __init__(self, first_address, netfn, first_lun, second_address, sequence, second_lun, cmd, data=b""):
+        self.first_address = first_address
+        self.netfn = netfn
+        self.first_lun = first_lun
+        self.second_address = second_address
+        self.sequence = sequence
+        self.second_lun = second_lun
+        self.cmd = cmd
+        self.data = bytes(data)
+
+    def pack(self):
+        header = bytes([self.first_address, (self.netfn << 2) | self.first_lun])
+        body = bytes([self.second_address, (self.sequence << 2) | self.second_lun, self.cmd]) + self.data
+        return header + bytes([checksum(header)]) + body + bytes([checksum(body)])
+
+    @classmethod
+    def unpack(cls, message):
+        """
+        Raises IpmiError if the message is truncated or its checksums do not match
+        """
+        if len(message) < 7:
+            raise IpmiError("Truncated IPMI message ({0} bytes)".format(len(message)))
+        if checksum(message[:2]) != message[2] or checksum(message[3:-1]) != message[-1]:
+            raise IpmiError("Bad IPMI message checksum")
+        return cls(message[0], message[1] >> 2, message[1] & 0x3, message[3], message[4] >> 2, message[4] & 0x3,
+                   message[5], message[6:-1])
+
+
+def checksum(data):
+    """
+    Compute the IPMI two's complement checksum.
+    """
+    return -sum(data) & 0xFF
+
+
+def pack_lan_packet(session_sequence, session_id, message):
+    """
+    Wrap an IPMI message into an RMCP packet with an IPMI v1.5 session header, without authentication.
+    """
+    return RMCP_HEADER + struct.pack("<BII", AUTH_TYPE_NONE, session_sequence, session_id) + bytes([len(message)]) \
+        + message
+
+
+def unpack_lan_packet(packet):
+    """
+    Unwrap the IPMI message from an RMCP packet.
+
+    Returns
+    -------
+    The session sequence number, the session ID, and the IPMI message : tuple
+
+    Raises IpmiError
+    """
+    if len(packet) < 14 or packet[:4] != RMCP_HEADER:
+        raise IpmiError("Not an IPMI RMCP packet")
+
+    auth_type, session_sequence, session_id = struct.unpack_from("<BII", packet, 4)
+    offset = 13 if auth_type == AUTH_TYPE_NONE else 29
+    length = packet[offset]
+    return session_sequence, session_id, packet[offset + 1:offset + 1 + length]
+
+
+class IpmiResult:
+    """
+    The result of an IPMI command, in the same shape as the result of an ipmitool process, plus the parsed value.
+    """
+    def __init__(self, return_code, stdout="", stderr="", value=None):
+        self.return_code = return_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.value = value
+
+
+class IpmiSession:
+    """
+    An IPMI v1.5 LAN session to a shelf manager, without authentication (ipmitool -I lan -A NONE).
+
+    The session stays open across commands, so that each command costs a single UDP round trip instead of an ipmitool
+    process start-up and a session handshake. Commands to a board are bridged by the shelf manager over the IPMB, like
+    ipmitool's -t and -b options do.
+    """
+    def __init__(self, host, port=IPMI_LAN_PORT, timeout_secs=1.0, retries=3):
+        """
+        Parameters
+        ----------
+        host : str
+            The hostname of the shelf manager
+        port : int
+            The IPMI LAN UDP port of the shelf manager
+        timeout_secs : float
+            How long to wait for each response
+        retries : int
+            The number of times to resend a request that got no response
+        """
+        self.host = host
+        self.port = port
+        self.timeout_secs = timeout_secs
+        self.retries = retries
+
+        self._socket = None
+        self._session_id = 0
+        self._session_sequence = 0
+        self._is_active = False
+        self._request_sequence = 0
+        self._sensor_numbers = {}
+
+    @property
+    def is_open(self):
+        return self._socket is not None and self._is_active
+
+    def open(self):
+        """
+        Activate a session with the shelf manager.
+
+        Raises IpmiError
+        """
+        self.close()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.settimeout(self.timeout_secs)
+        self._socket.connect((self.host, self.port))
+
+        capabilities = self.request(NETFN_APP, CMD_GET_CHANNEL_AUTH_CAPABILITIES,
+                                    bytes([0x0E, PRIVILEGE_ADMINISTRATOR]))
+        if not capabilities[1] & (1 << AUTH_TYPE_NONE):
+            raise IpmiError("The shelf manager {0} does not accept unauthenticated sessions".format(self.host))
+
+        challenge = self.request(NETFN_APP, CMD_GET_SESSION_CHALLENGE, bytes([AUTH_TYPE_NONE]) + bytes(16))
+        self._session_id = struct.unpack_from("<I", challenge, 0)[0]
+
+        activation = self.request(NETFN_APP, CMD_ACTIVATE_SESSION,
+                                  bytes([AUTH_TYPE_NONE, PRIVILEGE_ADMINISTRATOR]) + challenge[4:20]
+                                  + struct.pack("<I", 1))
+        self._session_id, self._session_sequence = struct.unpack_from("<II", activation, 1)
+        self._is_active = True
+
+        self.request(NETFN_APP, CMD_SET_SESSION_PRIVILEGE_LEVEL, bytes([PRIVILEGE_ADMINISTRATOR]))
+        logger.debug("Opened IPMI session 0x{0:08x} with {1}".format(self._session_id, self.host))
+
+    def close(self):
+        """
+        Close the session, if open.
+        """
+        if self._socket is None:
+            return
+
+        if self._is_active:
+            try:
+                self.request(NETFN_APP, CMD_CLOSE_SESSION, struct.pack("<I", self._session_id))
+            except IpmiError as error:
+                logger.debug("Cannot close IPMI session 0x{0:08x} cleanly: {1}".format(self._session_id, error))
+
+        self._socket.close()
+        self._socket = None
+        self._session_id = 0
+        self._session_sequence = 0
+        self._is_active = False
+
+    def request(self, netfn, cmd, data=b"", target=None, channel=0):
+        """
+        Send an IPMI request and wait for its response.
+
+        Parameters
+        ----------
+        netfn : int
+            The network function of the request
+        cmd : int
+            The command of the request
+        data : bytes
+            The request data
+        target : int
+            The IPMB address of the board to bridge the request to, or None to send it to the shelf manager itself
+        channel : int
+            The shelf manager channel to bridge the request over
+
+        Returns
+        -------
+        The response data, without the completion code : bytes
+
+        Raises IpmiError
+        """
+        self._request_sequence = (self._request_sequence + 1) & 0x3F
+        message = IpmiMessage(BMC_ADDRESS, netfn, 0, REMOTE_SWID, self._request_sequence, 0, cmd, data)
+        if target is not None:
+            bridged = IpmiMessage(target, netfn, 0, BMC_ADDRESS, self._request_sequence, 0, cmd, data)
+            message = IpmiMessage(BMC_ADDRESS, NETFN_APP, 0, REMOTE_SWID, self._request_sequence, 0, CMD_SEND_MESSAGE,
+                                  bytes([0x40 | channel]) + bridged.pack())
+
+        for attempt in range(self.retries + 1):
+            # The session sequence number stays null until the session is activated
+            if self._is_active:
+                self._session_sequence = (self._session_sequence + 1) & 0xFFFFFFFF
+            self._socket.send(pack_lan_packet(self._session_sequence, self._session_id, message.pack()))
+
+            response = self._receive_response(message, target is not None)
+            if response is not None:
+                break
+        else:
+            raise IpmiTimeoutError("No response from {0} to IPMI command 0x{1:02x} (netFn 0x{2:02x}) after {3} "
+                                   "attempts".format(self.host, cmd, netfn, self.retries + 1))
+
+        if not response.data or response.data[0] != 0:
+            raise IpmiCompletionCodeError(netfn, cmd, response.data[0] if response.data else 0xFF)
+        return response.data[1:]
+
+    def _receive_response(self, request, bridged):
+        """
+        Wait for the response to a request. For a bridged request, the shelf manager first acknowledges the Send
+        Message request, and then delivers the board's response encapsulated in another Send Message response.
+
+        Returns
+        -------
+        The response, or None if it did not arrive in time : IpmiMessage
+        """
+        deadline = time.time() + self.timeout_secs
+        while True:
+            self._socket.settimeout(max(deadline - time.time(), 0.001))
+            try:
+                packet = self._socket.recv(1024)
+            except socket.timeout:
+                return None
+
+            try:
+                response = IpmiMessage.unpack(unpack_lan_packet(packet)[2])
+            except IpmiError as error:
+                logger.debug("Dropping an IPMI packet from {0}: {1}".format(self.host, error))
+                continue
+
+            if response.cmd != request.cmd or response.sequence != request.sequence:
+                continue
+            if not bridged:
+                return response
+            if len(response.data) <= 1:
+                # The shelf manager acknowledged the Send Message request, or rejected it
+                if response.data[:1] != b"\x00":
+                    return response
+                continue
+
+            # Unwrap the board's response. Some shelf managers append the Send Message checksum to it.
+            bridged_request = IpmiMessage.unpack(request.data[1:])
+            for encapsulated in (response.data[1:], response.data[1:-1]):
+                try:
+                    bridged_response = IpmiMessage.unpack(encapsulated)
+                except IpmiError:
+                    continue
+                if bridged_response.cmd == bridged_request.cmd and bridged_response.netfn == bridged_request.netfn + 1:
+                    return bridged_response
+
+    def set_fru_activation(self, target, fru, activate):
+        """
+        Activate or deactivate a FRU of a board (ipmitool picmg activate/deactivate).
+        """
+        self.request(NETFN_PICMG, PICMG_CMD_SET_FRU_ACTIVATION, bytes([PICMG_IDENTIFIER, fru, int(activate)]),
+                     target=target)
+
+    def set_fru_activation_policy(self, target, fru, mask, value):
+        """
+        Set the activation policy of a FRU of a board (ipmitool picmg policy set).
+        """
+        self.request(NETFN_PICMG, PICMG_CMD_SET_FRU_ACTIVATION_POLICY,
+                     bytes([PICMG_IDENTIFIER, fru, mask & 0xFF, value & 0xFF]), target=target)
+
+    def find_sensor_number(self, target, sensor_name):
+        """
+        Find a sensor of a board by its ID string, by walking the board's device SDR repository. The sensor numbers are
+        cached for the lifetime of the session object.
+
+        Returns
+        -------
+        The sensor number : int
+
+        Raises IpmiError
+        """
+        key = (target, sensor_name)
+        if key not in self._sensor_numbers:
+            reservation = self.request(NETFN_SENSOR_EVENT, CMD_RESERVE_DEVICE_SDR_REPOSITORY, target=target)[:2]
+            record_id = 0
+            while record_id != SDR_LAST_RECORD_ID:
+                next_record_id, record = self._read_sdr_record(target, reservation, record_id)
+                sensor = _parse_sensor_record(record)
+                if sensor:
+                    self._sensor_numbers.setdefault((target, sensor[0]), sensor[1])
+                record_id = next_record_id
+
+        if key not in self._sensor_numbers:
+            raise IpmiSensorNotFoundError("The board 0x{0:02x} has no sensor named '{1}'".format(target, sensor_name))
+        return self._sensor_numbers[key]
+
+    def _read_sdr_record(self, target, reservation, record_id):
+        """
+        Read an SDR record in IPMB-sized chunks.
+
+        Returns
+        -------
+        The ID of the next record, and the record : tuple
+        """
+        record = b""
+        record_length = 5
+        next_record_id = SDR_LAST_RECORD_ID
+        while len(record) < record_length:
+            chunk_size = min(SDR_READ_CHUNK_SIZE, record_length - len(record))
+            response = self.request(NETFN_SENSOR_EVENT, CMD_GET_DEVICE_SDR,
+                                    reservation + struct.pack("<HBB", record_id, len(record), chunk_size),
+                                    target=target)
+            next_record_id = struct.unpack_from("<H", response, 0)[0]
+            record += response[2:]
+            if len(record) >= 5:
+                record_length = 5 + record[4]
+        return next_record_id, record
+
+    def get_sensor_states(self, target, sensor_name):
+        """
+        Read the asserted states of a discrete sensor of a board.
+
+        Returns
+        -------
+        The sensor number, and the offsets of the asserted states : tuple
+        """
+        sensor_number = self.find_sensor_number(target, sensor_name)
+        reading = self.request(NETFN_SENSOR_EVENT, CMD_GET_SENSOR_READING, bytes([sensor_number]), target=target)
+        state_bits = reading[2] | ((reading[3] if len(reading) > 3 else 0) << 8)
+        return sensor_number, [offset for offset in range(15) if state_bits & (1 << offset)]
+
+    def run(self, target, channel, command_args):
+        """
+        Run an ipmitool command natively.
+
+        Parameters
+        ----------
+        target : int
+            The IPMB address of the board
+        channel : int
+            The shelf manager channel to bridge the command over
+        command_args : list
+            The ipmitool command and its arguments, e.g. ["picmg", "deactivate", "0"]
+
+        Returns
+        -------
+        The command result, or None if the command is not supported natively : IpmiResult
+        """
+        if command_args[:2] in (["picmg", "activate"], ["picmg", "deactivate"]) and len(command_args) == 3:
+            self.set_fru_activation(target, int(command_args[2], 0), command_args[1] == "activate")
+            return IpmiResult(0)
+
+        if command_args[:3] == ["picmg", "policy", "set"] and len(command_args) == 6:
+            fru, mask, value = [int(arg, 0) for arg in command_args[3:]]
+            self.set_fru_activation_policy(target, fru, mask, value)
+            return IpmiResult(0)
+
+        if command_args[:2] == ["sensor", "get"] and len(command_args) > 2:
+            output = []
+            readings = {}
+            for sensor_name in command_args[2:]:
+                sensor_number, states = self.get_sensor_states(target, sensor_name)
+                readings[sensor_name] = states
+                output.append("Sensor ID              : {0} (0x{1:x})".format(sensor_name, sensor_number))
+                output.append(" States Asserted       : " + " ".join(_format_sensor_state(sensor_name, state)
+                                                                         for state in states))
+            return IpmiResult(0, "\n".join(output) + "\n", value=readings)
+
+        return None
+
+
+def _parse_sensor_record(record):
+    """
+    Get the sensor ID string and number from a full or compact sensor SDR record.
+
+    Returns
+    -------
+    The sensor ID string and number, or None if the record is not a sensor record : tuple
+    """
+    record_type = record[3]
+    if record_type == SDR_TYPE_FULL_SENSOR:
+        id_offset = 47
+    elif record_type == SDR_TYPE_COMPACT_SENSOR:
+        id_offset = 31
+    else:
+        return None
+
+    id_length = record[id_offset] & 0x1F
+    sensor_name = record[id_offset + 1:id_offset + 1 + id_length].decode("ascii", "replace")
+    return sensor_name, record[7]
+
+
+def _format_sensor_state(sensor_name, state):
+    if "Hot Swap" in sensor_name and state < len(HOT_SWAP_STATE_NAMES):
+        return "[M{0}: {1}]".format(state, HOT_SWAP_STATE_NAMES[state])
+    return "[State {0}]".format(state)
+
+
+def parse_ipmitool_cmd(cmd):
+    """
+    Parse an ipmitool command line, as built by the test.
+
+    Returns
+    -------
+    The shelf manager host, the UDP port, the board's IPMB address, the bridging channel and the ipmitool command
+    arguments, or None if the command line uses options that the native session does not support : tuple
+    """
+    args = shlex.split(cmd)
+    if not args or os.path.basename(args[0]) != "ipmitool":
+        return None
+
+    host = None
+    port = IPMI_LAN_PORT
+    target = None
+    channel = 0
+    i = 1
+    while i < len(args) and args[i].startswith("-"):
+        option = args[i]
+        value = args[i + 1] if i + 1 < len(args) else None
+        if option == "-I" and value == "lan":
+            pass
+        elif option == "-A" and value == "NONE":
+            pass
+        elif option == "-H":
+            host = value
+        elif option == "-p":
+            port = int(value)
+        elif option == "-t":
+            target = int(value, 0)
+        elif option == "-b":
+            channel = int(value, 0)
+        else:
+            return None
+        i += 2
+
+    if host is None or target is None:
+        return None
+    return host, port, target, channel, args[i:]
+
+
+class IpmiSessionPool:
+    """
+    Keep one open IPMI session per shelf manager, and run ipmitool command lines through them.
+
+    A command line that the native session does not support is run by ipmitool instead. A session that stops
+    responding, e.g. because the shelf manager closed it after a long period of inactivity, is reopened once.
+    """
+    def __init__(self, timeout_secs=1.0, retries=3):
+        self.timeout_secs = timeout_secs
+        self.retries = retries
+        self._sessions = {}
+        self._locks = collections.defaultdict(threading.Lock)
+        self._pool_lock = threading.Lock()
+
+    def run(self, cmd):
+        """
+        Run an ipmitool command line through a persistent session.
+
+        Returns
+        -------
+        The command result, or None if the command line is not supported natively : IpmiResult
+        """
+        parsed_cmd = parse_ipmitool_cmd(cmd)
+        if parsed_cmd is None:
+            return None
+        host, port, target, channel, command_args = parsed_cmd
+
+        # The commands of the boards tested concurrently share the session of their shelf manager, one at a time
+        with self._pool_lock:
+            session_lock = self._locks[(host, port)]
+        with session_lock:
+            return self._run(host, port, target, channel, command_args)
+
+    def _run(self, host, port, target, channel, command_args):
+        session = self._sessions.get((host, port))
+        if session is None:
+            session = self._sessions[(host, port)] = IpmiSession(host, port, timeout_secs=self.timeout_secs,
+                                                                  retries=self.retries)
+
+        for attempt in range(2):
+            try:
+                if not session.is_open:
+                    session.open()
+                return session.run(target, channel, command_args)
+            except (IpmiCompletionCodeError, IpmiSensorNotFoundError) as error:
+                return IpmiResult(1, stderr=str(error))
+            except (IpmiError, OSError) as error:
+                session.close()
+                if attempt:
+                    return IpmiResult(1, stderr=str(error))
+                logger.debug("Reopening the IPMI session with {0}: {1}".format(host, error))
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
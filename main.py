@@ -8,27 +8,85 @@ import json
 import time
 from logging.handlers import RotatingFileHandler
 
-from switchtest_logging import logging, log_formatter
+from switchtest_logging import logging, log_formatter, queued_logging, ReadbackLog
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 import traceback
+import contextlib
+import functools
 
 from version import VERSION
 from arg_parser import ArgParser
+from pyrogue_connection import PyrogueConnection
+from cpsw_connection import CpswConnection
+from cpsw_stress import run_cpsw_batched_stress
+from shelf import run_shelf, setup_board_logging, setup_shelf_logging
+from board_probe import BoardProber
+from metrics import get_metric_summary, record_latency
+from metrics_server import MetricsServer, LatencyDump
+from ipmi_session import IpmiSessionPool
+from board_cycle import BoardCycle, AsyncActivationScheduler, run_blocking, run_boards, VERIFY_DOWN, VERIFY_UP
 
-try:
-    import pyrogue as pr
-    from FpgaTopLevel import *
-except ImportError as import_error:
-    logger.info("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
-try:
-    from pycpsw import *
-except ImportError as import_error:
-    logger.info("ImportError exception: {0}. Make sure you've sourced the CPSW env script.".format(import_error))
 
-global status_cmd
-global board_ip_address
+# The status command of the board, in single-board mode, for the diagnostics of an unexpected exception. It stays None
+# in shelf mode, where each board runs its own diagnostics.
+status_cmd = None
+
+# The board liveness prober, configured from the "probe" test settings when the test starts
+board_prober = BoardProber()
+
+# The persistent IPMI sessions to the shelf managers, when the "session" IPMI backend is configured
+ipmi_sessions = None
+
+
+def _load_pyrogue_backend():
+    """
+    Import pyrogue, the FpgaTopLevel device tree, and the pyrogue stress activities. These imports take seconds, and
+    are only made when the pyrogue stress commands are run.
+
+    Raises ImportError
+    """
+    global pr, FpgaTopLevel, run_pipelined_scratchpad_stress, run_ddr_benchmark, save_benchmark_results, \
+        DEFAULT_BLOCK_SIZES, DdrAccessor, run_ddr_integrity_check, PollScheduler, run_prbs_line_rate_test, \
+        save_prbs_report, run_mixed_traffic, TraceRecorder, register_operations, ddr_operations, find_latency_knee, \
+        save_open_loop_report, compile_workload, run_workload
+
+    start_time = time.perf_counter()
+    try:
+        import pyrogue as pr
+        from FpgaTopLevel import FpgaTopLevel
+    except ImportError as import_error:
+        logger.error("ImportError exception: {0}. Make sure you've sourced the pyrogue env script."
+                     .format(import_error))
+        raise
+    from pyrogue_stress import run_pipelined_scratchpad_stress
+    from ddr_benchmark import run_ddr_benchmark, save_benchmark_results, DEFAULT_BLOCK_SIZES
+    from ddr_integrity import DdrAccessor, run_ddr_integrity_check
+    from poll_scheduler import PollScheduler
+    from prbs_stress import run_prbs_line_rate_test, save_prbs_report
+    from mixed_traffic import run_mixed_traffic
+    from transaction_trace import TraceRecorder
+    from open_loop import register_operations, ddr_operations, find_latency_knee, save_open_loop_report
+    from workload import compile_workload, run_workload
+    logger.debug("Loaded the pyrogue backend in {0:.2f} seconds".format(time.perf_counter() - start_time))
+
+
+def _load_cpsw_backend():
+    """
+    Import CPSW, only when the CPSW stress commands are run.
+
+    Raises ImportError
+    """
+    global Path, ScalVal
+
+    start_time = time.perf_counter()
+    try:
+        from pycpsw import Path, ScalVal
+    except ImportError as import_error:
+        logger.error("ImportError exception: {0}. Make sure you've sourced the CPSW env script.".format(import_error))
+        raise
+    logger.debug("Loaded the CPSW backend in {0:.2f} seconds".format(time.perf_counter() - start_time))
 
 
 def main():
@@ -37,12 +95,12 @@ def main():
     config_file = vars(args)["config-file"]
     test_configs = _parse_config_file(config_file)
 
-    # If the user provides a logdir path, use it. Otherwise, use the default, ./logs_{hostname}/
-    log_dir_path = test_configs["test"].get("custom_log_directory_path", None)
+    if vars(args)["profile_startup"]:
+        _profile_startup(test_configs)
+        return
+
+    log_dir_path = _get_log_dir_path(test_configs)
     logger.info("Log Directory: {0}".format(log_dir_path))
-    if not log_dir_path:
-        hostname = socket.gethostname()
-        log_dir_path = "./logs_" + hostname
     try:
         os.makedirs(log_dir_path)
     except os.error as err:
@@ -64,34 +122,147 @@ def main():
 
     logger.info("\n\n############ TEST STARTS #############\n")
 
+    boards = test_configs["hardware"].get("boards")
+    if boards:
+        # Shelf mode: run the test on all the boards concurrently, one process per board, or all the boards from the
+        # event loop of this process
+        shelf_configs = test_configs["test"].get("shelf", {})
+        if shelf_configs.get("engine", "processes") == "event_loop":
+            failed_slots = _run_shelf_in_process(boards, test_configs, log_dir_path)
+        else:
+            exit_codes = run_shelf(boards, _run_board_test, runner_args=(test_configs, log_dir_path),
+                                   schedule=shelf_configs.get("activation_schedule", "simultaneous"),
+                                   stagger_secs=int(shelf_configs.get("stagger_secs", 5)))
+            failed_slots = [board["slot"] for board, exit_code in zip(boards, exit_codes) if exit_code != 0]
+        if failed_slots:
+            logger.error("The test FAILED on the boards in slots: {0}".format(", ".join(map(str, failed_slots))))
+            sys.exit(1)
+    else:
+        # Get the customized status, board activation, and board deactivation commands from the user's configurations
+        global status_cmd
+        status_cmd, activation_cmd, deactivation_cmd = _build_ipmi_cmds(test_configs,
+                                                                        test_configs["hardware"]["slot"])
+
+        # Run the test
+        with _logging_pipeline(test_configs):
+            run_test(activation_cmd, deactivation_cmd, test_configs, status_cmd=status_cmd)
+
+    logger.info("\n############ TEST ENDS #############\n\n")
+    logger.info(''.join(['-' * 30, '\n']))
+
+
+def _profile_startup(test_configs):
+    """
+    Log the import-time breakdown of the test, and of the backends selected by the test mode, by top-level package.
+    Each part is imported in a fresh interpreter, as on a cold start.
+    """
+    from profiling import profile_startup, STARTUP_IMPORTS
+
+    mode_configs = test_configs["test"]["mode"]
+    selected_parts = ["main"]
+    if mode_configs["run_pyrogue_stress_cmds"]:
+        selected_parts.append("pyrogue")
+    if mode_configs["run_cpsw_stress_cmds"]:
+        selected_parts.append("cpsw")
+    profile_startup({part: STARTUP_IMPORTS[part] for part in selected_parts})
+
+
+def _build_ipmi_cmds(test_configs, slot_number):
+    """
+    Build the IPMI status, board activation, and board deactivation commands for a board.
+
+    Parameters
+    ----------
+    test_configs : dict
+        The user settings to be applied to the test
+    slot_number : int
+        The slot number of the board in the shelf
+
+    Returns
+    -------
+    The status, activation, and deactivation commands : tuple
+    """
     # Get the Shelf Manager address
     shelf_manager = test_configs["hardware"]["shelf_manager"]
 
-    # Get the FPGA Board's slot number, and translate it to the the IPMI address
-    slot_number = test_configs["hardware"]["slot"]
+    # Translate the FPGA Board's slot number to the IPMI address
     target = str(hex(int(0x80) + 2 * slot_number))
 
     # IPMI command prefix. We'll be using the Ethernet (LAN) interface, with no authentication
     cmd_prefix = 'ipmitool -I lan -H ' + shelf_manager + ' -t ' + str(target) + ' -b 0 -A NONE '
 
-    # Get the customized status, board activation, and board deactivation commands from the user's configurations
-    global status_cmd
-    status_cmd = cmd_prefix + test_configs["test"]["commands"]["status"]
+    return (cmd_prefix + test_configs["test"]["commands"]["status"],
+            cmd_prefix + test_configs["test"]["commands"]["activation"],
+            cmd_prefix + test_configs["test"]["commands"]["deactivation"])
 
-    activation_cmd = cmd_prefix + test_configs["test"]["commands"]["activation"]
-    deactivation_cmd = cmd_prefix + test_configs["test"]["commands"]["deactivation"]
 
-    # Run the test
-    run_test(activation_cmd, deactivation_cmd, test_configs)
+def _get_log_dir_path(test_configs):
+    """
+    Get the directory to save the logs into. If the user provides a logdir path, use it. Otherwise, use the default,
+    ./logs_{hostname}/
+    """
+    log_dir_path = test_configs["test"].get("custom_log_directory_path", None)
+    if not log_dir_path:
+        hostname = socket.gethostname()
+        log_dir_path = "./logs_" + hostname
+    return log_dir_path
 
-    logger.info("\n############ TEST ENDS #############\n\n")
-    logger.info(''.join(['-' * 30, '\n']))
+
+def _logging_pipeline(test_configs):
+    """
+    Get the context in which to run the test: with the logs written by a background thread unless the "queued" logging
+    setting is false.
+    """
+    if test_configs["test"].get("logging", {}).get("queued", True):
+        return queued_logging()
+    return contextlib.ExitStack()
+
+
+def _run_board_test(board, board_index, scheduler, test_configs, log_dir_path):
+    """
+    Run the test on one board of the shelf. This runs in the board's own process.
+
+    Parameters
+    ----------
+    board : dict
+        The board configuration, with the "slot" and "fpga_board_ip_address" keys
+    board_index : int
+        The position of the board in the shelf configuration
+    scheduler : ActivationScheduler
+        The scheduler coordinating the board activations across the shelf
+    test_configs : dict
+        The user settings to be applied to the test
+    log_dir_path : str
+        The directory to save the board's log file into
+    """
+    setup_board_logging(log_dir_path, "slot{0}".format(board["slot"]))
+    status_cmd, activation_cmd, deactivation_cmd = _build_ipmi_cmds(test_configs, board["slot"])
+
+    try:
+        with _logging_pipeline(test_configs):
+            run_test(activation_cmd, deactivation_cmd, test_configs, board_ip_address=board["fpga_board_ip_address"],
+                     before_activation=lambda: scheduler.wait_for_activation_turn(board_index), status_cmd=status_cmd,
+                     metrics_port_offset=board_index, workload_name=board.get("workload"))
+    except Exception as error:
+        logger.error("\nUnexpected exception while running the test. Exception type: {0}. Exception: {1}"
+                     .format(type(error), error))
+        traceback.print_exc()
+
+        # Run the status command to get diagnostic data
+        _run_cmd(status_cmd, sleep_secs=10, log_level_debug=True)
+        sys.exit(1)
+    finally:
+        scheduler.leave()
 
 
-def run_test(activation_cmd, deactivation_cmd, test_configs, retries_on_test_phase_failure=10):
+def run_test(activation_cmd, deactivation_cmd, test_configs, retries_on_test_phase_failure=10, board_ip_address=None,
+             before_activation=None, status_cmd=None, metrics_port_offset=0, workload_name=None):
     """
     Run the test after verifying that the board is active. If the board is not, the test will terminate immediately.
 
+    The test iterations run through the states of the board's BoardCycle, on an event loop: the board deactivation and
+    its verification, the board activation and its verification, the stress activities, and a cooldown.
+
     Parameters
     ----------
     activation_cmd : str
@@ -102,105 +273,377 @@ def run_test(activation_cmd, deactivation_cmd, test_configs, retries_on_test_pha
         The user settings to be applied to the test
     retries_on_test_phase_failure: int
         The number of retries the same command if it fails the first time.
+    board_ip_address : str
+        The IP address of the board. Defaults to the fpga_board_ip_address setting.
+    before_activation : callable
+        Called before each board activation command, e.g. to wait for the board's turn in the shelf
+    status_cmd : str
+        The command to get the board's "Hot Swap" sensor. If given, a board state transition is only complete once the
+        sensor reports the expected hot swap state.
+    metrics_port_offset : int
+        Added to the metrics port setting, so that each board of the shelf serves its metrics on its own port
+    workload_name : str
+        The name of the pyrogue workload to run in the "workload" stress mode. Defaults to the workload setting.
 
     Raises SystemError, RuntimeError
     """
-    # If the user indicates the test duration to be -1, the test will keep running until it encounters an unrecoverable
-    # failure. Otherwise, the test will stop after reaching the user's limit (number of test cycles to run)
-    test_duration = int(test_configs["test"]["cycles_to_run"])
-    if test_duration == -1:
-        logger.info("Looping the test indefinitely. Press <Ctrl-C> to terminate.")
-    else:
-        logger.info("Looping the test {0} times. Press <Ctrl-C> to terminate.".format(test_duration))
+    if not board_ip_address:
+        board_ip_address = test_configs["hardware"]["fpga_board_ip_address"]
+
+    metrics_server = _start_test_process(test_configs, metrics_port_offset=metrics_port_offset)
+    board_test = BoardTest(test_configs, board_ip_address, workload_name=workload_name)
+
+    async_before_activation = None
+    if before_activation:
+        async def async_before_activation():
+            await run_blocking(before_activation)
+
+    board_cycle = _create_board_cycle(test_configs, board_test, activation_cmd, deactivation_cmd,
+                                      status_cmd=status_cmd, retries=retries_on_test_phase_failure,
+                                      before_activation=async_before_activation)
+    try:
+        error, = run_boards([board_cycle])
+        if error:
+            raise error
+    finally:
+        board_test.close()
+        if metrics_server:
+            metrics_server.stop()
 
-    # Make sure the board is active before starting the test
-    global board_ip_address
-    board_ip_address = test_configs["hardware"]["fpga_board_ip_address"]
 
-    is_board_active = _detect_board_active(board_ip_address, expected_board_is_active=True)
-    if not is_board_active:
-        logger.error("Cannot start the test. The board has to be activated first.")
-        raise SystemError
+def _run_shelf_in_process(boards, test_configs, log_dir_path):
+    """
+    Run the test on all the boards of the shelf concurrently, each board with its own BoardCycle, all from one event
+    loop in this process.
+
+    Parameters
+    ----------
+    boards : list
+        The board configurations, each with the "slot" and "fpga_board_ip_address" keys
+    test_configs : dict
+        The user settings to be applied to the test
+    log_dir_path : str
+        The directory to save the boards' log files into
 
-    run_count = 0
+    Returns
+    -------
+    The slots of the boards whose test failed : list
+    """
+    setup_shelf_logging(log_dir_path, ["slot{0}".format(board["slot"]) for board in boards])
+
+    shelf_configs = test_configs["test"].get("shelf", {})
+    scheduler = AsyncActivationScheduler(len(boards), schedule=shelf_configs.get("activation_schedule", "simultaneous"),
+                                         stagger_secs=int(shelf_configs.get("stagger_secs", 5)))
+    metrics_server = _start_test_process(test_configs)
+
+    board_tests = []
+    board_cycles = []
+    status_cmds = []
+    for board_index, board in enumerate(boards):
+        status_cmd, activation_cmd, deactivation_cmd = _build_ipmi_cmds(test_configs, board["slot"])
+        board_test = BoardTest(test_configs, board["fpga_board_ip_address"], workload_name=board.get("workload"))
+        board_tests.append(board_test)
+        status_cmds.append(status_cmd)
+        board_cycles.append(_create_board_cycle(
+            test_configs, board_test, activation_cmd, deactivation_cmd, status_cmd=status_cmd,
+            name="slot{0}".format(board["slot"]),
+            before_activation=functools.partial(scheduler.wait_for_activation_turn, board_index)))
+
+    try:
+        with _logging_pipeline(test_configs):
+            errors = run_boards(board_cycles, scheduler=scheduler)
+    finally:
+        for board_test in board_tests:
+            board_test.close()
+        if metrics_server:
+            metrics_server.stop()
+
+    # Run the status command of the failed boards to get diagnostic data
+    for status_cmd, error in zip(status_cmds, errors):
+        if error:
+            _run_cmd(status_cmd, sleep_secs=0, log_level_debug=True)
+    return [board["slot"] for board, error in zip(boards, errors) if error]
+
+
+def _start_test_process(test_configs, metrics_port_offset=0):
+    """
+    Set up what the boards tested from this process share: the board prober, the IPMI sessions, the backends of the
+    selected stress commands, and the metrics endpoint.
+
+    Returns
+    -------
+    The metrics server, or None if no metrics port is set : MetricsServer
+    """
+    global board_prober
+    board_prober = BoardProber.from_configs(test_configs["test"].get("probe", {}))
+
+    global ipmi_sessions
+    ipmi_configs = test_configs["test"].get("ipmi", {})
+    if ipmi_configs.get("backend", "ipmitool") == "session":
+        ipmi_sessions = IpmiSessionPool(timeout_secs=float(ipmi_configs.get("timeout_secs", 1.0)),
+                                        retries=int(ipmi_configs.get("retries", 3)))
+
+    # Load only the backends of the selected stress commands
+    if test_configs["test"]["mode"]["run_pyrogue_stress_cmds"]:
+        _load_pyrogue_backend()
+    if test_configs["test"]["mode"]["run_cpsw_stress_cmds"]:
+        _load_cpsw_backend()
+
+    # Export the operation latencies of the boards
+    metrics_configs = test_configs["test"].get("metrics", {})
+    metrics_server = None
+    if metrics_configs.get("port"):
+        metrics_server = MetricsServer(int(metrics_configs["port"]) + metrics_port_offset)
+        metrics_server.start()
+    return metrics_server
+
+
+def _create_board_cycle(test_configs, board_test, activation_cmd, deactivation_cmd, status_cmd=None, retries=10,
+                        name=None, before_activation=None):
+    """
+    Create the state machine running the test iterations of a board, with the timeout of each state from the
+    "state_timeouts_secs" settings. The VERIFY_DOWN and VERIFY_UP states time out after
+    board_activation_toggle_sleep_secs by default.
+    """
     board_activation_toggle_sleep_secs = int(test_configs["test"]["board_activation_toggle_sleep_secs"])
-    sleep_after_stress_cmds_secs = int(test_configs["test"]["sleep_after_stress_cmds_secs"])
-    pyrogue_base = None
-
-    while True:
-        run_count += 1
-        if test_duration != -1 and run_count > test_duration:
-            break
-        logger.info("\n=== Starting Test Iteration: {0} ===\n".format(run_count))
-        retry_count = 0
-        # Running board deactivation test
-        while retry_count <= retries_on_test_phase_failure:
-            logger.info("\n--- BOARD DEACTIVATION ---")
-            _run_cmd(deactivation_cmd, board_activation_toggle_sleep_secs)
-            if not _detect_board_active(board_ip_address, expected_board_is_active=False):
-                if retry_count < retries_on_test_phase_failure:
-                    retry_count += 1
-                    logger.info("Retrying board deactivation. Attempt {0} out of {1}."
-                                .format(retry_count, retries_on_test_phase_failure))
-                else:
-                    logger.error("The board CANNOT be DEACTIVATED. Ending the test.")
-                    raise RuntimeError
-            else:
-                retry_count = 0
-                break
-
-        # Running board activation test
-        pyrogue_socket_retry = 0
-        while retry_count < retries_on_test_phase_failure and pyrogue_socket_retry < retries_on_test_phase_failure:
-            logger.info("\n--- BOARD ACTIVATION ---")
-            _run_cmd(activation_cmd, board_activation_toggle_sleep_secs)
-            if not _detect_board_active(board_ip_address, expected_board_is_active=True):
-                if retry_count < retries_on_test_phase_failure:
-                    retry_count += 1
-                    logger.info("Retrying board activation. Attempt {0} out of {1}."
-                                .format(retry_count, retries_on_test_phase_failure))
-                else:
-                    logger.error("The board CANNOT be ACTIVATED. Ending the test.")
-                    raise RuntimeError
-            else:
-                run_pyrogue_stress_cmds = test_configs["test"]["mode"]["run_pyrogue_stress_cmds"]
-                run_cpsw_stress_cmds = test_configs["test"]["mode"]["run_cpsw_stress_cmds"]
-
-                if run_pyrogue_stress_cmds:
-                    value_quantity_to_write_to_fpga = int(
-                        test_configs["test"]["pyrogue"]["value_quantity_to_write_to_fpga"])
-                    ddr_read_cycles = int(test_configs["test"]["pyrogue"]["ddr_read_cycles"])
-
-                    try:
-                        pyrogue_base = run_pyrogue_stress_activities(board_ip_address, pyrogue_base,
-                                                                     write_value_count=value_quantity_to_write_to_fpga,
-                                                                     ddr_read_cycles=ddr_read_cycles,
-                                                                     sleep_secs=sleep_after_stress_cmds_secs)
-                    except (RuntimeError, BlockingIOError) as pyrogue_error:
-                        if "Resource temporarily unavailable" in str(pyrogue_error):
-                            logger.info("Encountered 'Resource temporarily unavailable' error. Exception type: {0}. "
-                                        "Exception {1}.".format(type(pyrogue_error), pyrogue_error))
-                            traceback.print_exc()
-                            for h in logger.handlers:
-                                h.flush()
-                            if _detect_board_active(board_ip_address, expected_board_is_active=True):
-                                pyrogue_socket_retry += 1
-                                logger.info("Continuing the test. Increment retry count. Attempt {0} out of {1}."
-                                            .format(pyrogue_socket_retry, retries_on_test_phase_failure))
-                            else:
-                                raise pyrogue_error
-                        else:
-                            raise pyrogue_error
-                if run_cpsw_stress_cmds:
-                    yaml_filename = test_configs["test"]["cpsw"]["yaml_filename"]
-                    value_quantity_to_write_to_fpga = int(
-                        test_configs["test"]["cpsw"]["value_quantity_to_write_to_fpga"])
-
-                    run_cpsw_stress_activities(yaml_filename, value_quantity_to_write_to_fpga,
-                                               sleep_secs=sleep_after_stress_cmds_secs)
-
-                logger.info("\n\n=== Ending Test Iteration: {0} ===".format(run_count))
-                break
+    state_timeouts_secs = {VERIFY_DOWN: board_activation_toggle_sleep_secs,
+                           VERIFY_UP: board_activation_toggle_sleep_secs}
+    state_timeouts_secs.update({state: float(timeout_secs) for state, timeout_secs
+                                in test_configs["test"].get("state_timeouts_secs", {}).items() if timeout_secs})
+
+    return BoardCycle(board_test, board_test.board_ip_address, activation_cmd, deactivation_cmd, _execute_cmd,
+                      board_prober, status_cmd=status_cmd, name=name, cycles=int(test_configs["test"]["cycles_to_run"]),
+                      retries=retries,
+                      poll_interval_secs=float(test_configs["test"].get("board_state_poll_interval_secs", 1)),
+                      cooldown_secs=int(test_configs["test"]["sleep_after_stress_cmds_secs"]),
+                      state_timeouts_secs=state_timeouts_secs, before_activation=before_activation)
+
+
+class BoardTest:
+    """
+    The stress activities of one board, with the connections and the recorders they keep across the test iterations.
+    The BoardCycle of the board calls its methods from the executor threads of its event loop.
+    """
+    def __init__(self, test_configs, board_ip_address, workload_name=None):
+        """
+        Parameters
+        ----------
+        test_configs : dict
+            The user settings to be applied to the test
+        board_ip_address : str
+            The IP address of the board
+        workload_name : str
+            The name of the pyrogue workload to run in the "workload" stress mode. Defaults to the workload setting.
+        """
+        self.test_configs = test_configs
+        self.board_ip_address = board_ip_address
+        self.workload_name = workload_name
+        self.run_pyrogue_stress_cmds = test_configs["test"]["mode"]["run_pyrogue_stress_cmds"]
+        self.run_cpsw_stress_cmds = test_configs["test"]["mode"]["run_cpsw_stress_cmds"]
+        self.pyrogue_connection = None
+        self.cpsw_connection = None
+
+        log_dir_path = _get_log_dir_path(test_configs)
+        logging_configs = test_configs["test"].get("logging", {})
+        self.log_summary_interval_secs = float(logging_configs.get("summary_interval_secs", 10))
+        self.transaction_detail_path = None
+        if logging_configs.get("transaction_detail_file", False):
+            self.transaction_detail_path = os.path.join(log_dir_path, "transactions-{0}.bin".format(board_ip_address))
+
+        # Record the pyrogue transactions, to replay the traffic of a failing iteration
+        self.trace_recorder = None
+        trace_configs = test_configs["test"].get("pyrogue", {}).get("trace", {})
+        if self.run_pyrogue_stress_cmds and trace_configs.get("enabled", False):
+            self.trace_recorder = TraceRecorder(os.path.join(log_dir_path, "trace-{0}-{1}.bin".format(
+                board_ip_address, time.strftime("%Y%m%d-%H%M%S"))), max_bytes=trace_configs.get("max_bytes"))
+
+        self.latency_dump = None
+        if test_configs["test"].get("metrics", {}).get("dump_each_iteration", True):
+            self.latency_dump = LatencyDump(os.path.join(log_dir_path, "latency-{0}.jsonl".format(board_ip_address)),
+                                            board=board_ip_address)
+
+    def start_iteration(self, iteration):
+        if self.trace_recorder:
+            self.trace_recorder.mark(iteration)
+
+    def prepare(self):
+        """
+        Create the connections to the board, and build the pyrogue device tree, e.g. while the board boots.
+        """
+        if self.run_pyrogue_stress_cmds and not self.pyrogue_connection:
+            self.pyrogue_connection = _create_pyrogue_connection(self.test_configs, self.board_ip_address,
+                                                                 trace_recorder=self.trace_recorder)
+            self.pyrogue_connection.build()
+        if self.run_cpsw_stress_cmds and not self.cpsw_connection:
+            self.cpsw_connection = _create_cpsw_connection(self.test_configs)
+
+    def stress(self, iteration):
+        """
+        Run the selected stress activities. The BoardCycle waits for the cooldown after them.
+        """
+        if self.run_pyrogue_stress_cmds:
+            pyrogue_configs = self.test_configs["test"]["pyrogue"]
+            stress_mode = pyrogue_configs.get("stress_mode", "sequential")
+            log_dir_path = _get_log_dir_path(self.test_configs)
+            workload_configs = None
+            if stress_mode == "workload":
+                workload_configs = _get_workload_configs(self.test_configs, self.workload_name)
+
+            self.pyrogue_connection = run_pyrogue_stress_activities(
+                self.board_ip_address, self.pyrogue_connection,
+                write_value_count=int(pyrogue_configs["value_quantity_to_write_to_fpga"]),
+                ddr_read_cycles=int(pyrogue_configs["ddr_read_cycles"]), sleep_secs=0, stress_mode=stress_mode,
+                in_flight_depth=int(pyrogue_configs.get("in_flight_depth", 32)),
+                ddr_mode=pyrogue_configs.get("ddr_mode", "read_cycles"),
+                ddr_benchmark_configs=pyrogue_configs.get("ddr_benchmark", {}),
+                ddr_benchmark_path=os.path.join(log_dir_path, "ddr-benchmark-{0}.jsonl".format(self.board_ip_address)),
+                ddr_verify_configs=pyrogue_configs.get("ddr_verify", {}),
+                log_summary_interval_secs=self.log_summary_interval_secs,
+                transaction_detail_path=self.transaction_detail_path,
+                pause_polling=pyrogue_configs.get("polling", {}).get("pause_during_stress", False),
+                prbs_configs=pyrogue_configs.get("prbs", {}),
+                prbs_report_path=os.path.join(log_dir_path, "prbs-{0}.jsonl".format(self.board_ip_address)),
+                mixed_configs=pyrogue_configs.get("mixed", {}), open_loop_configs=pyrogue_configs.get("open_loop", {}),
+                open_loop_report_path=os.path.join(log_dir_path, "open-loop-{0}.jsonl".format(self.board_ip_address)),
+                workload_configs=workload_configs)
+        if self.run_cpsw_stress_cmds:
+            cpsw_configs = self.test_configs["test"]["cpsw"]
+            run_cpsw_stress_activities(self.cpsw_connection, int(cpsw_configs["value_quantity_to_write_to_fpga"]),
+                                       sleep_secs=0, stress_mode=cpsw_configs.get("stress_mode", "sequential"),
+                                       batched_configs=cpsw_configs.get("batched", {}), seed=iteration,
+                                       log_summary_interval_secs=self.log_summary_interval_secs,
+                                       transaction_detail_path=self.transaction_detail_path)
+
+    def is_retryable(self, error):
+        """
+        Tell whether a stress activity error is worth another board activation: the pyrogue socket errors, as long as
+        the board is still active.
+        """
+        if isinstance(error, (RuntimeError, BlockingIOError)) and "Resource temporarily unavailable" in str(error):
+            logger.info("Encountered 'Resource temporarily unavailable' error. Exception type: {0}. Exception {1}."
+                        .format(type(error), error))
+            traceback.print_exception(type(error), error, error.__traceback__)
+            for h in logger.handlers:
+                h.flush()
+            return True
+        return False
+
+    def end_iteration(self, iteration):
+        for state_name in ("inactive", "active"):
+            summary = get_metric_summary("time_to_{0}_secs".format(state_name))
+            if summary["count"]:
+                logger.info("Time for the board to become {0}: min/p50/max {1:.1f}/{2:.1f}/{3:.1f} seconds over {4} "
+                            "transitions".format(state_name.upper(), summary["min"], summary["p50"], summary["max"],
+                                                 summary["count"]))
+        summary = get_metric_summary("time_to_first_transaction_secs")
+        if summary["count"]:
+            logger.info("Time to the first pyrogue transaction after connecting: min/p50/max "
+                        "{0:.2f}/{1:.2f}/{2:.2f} seconds over {3} connections"
+                        .format(summary["min"], summary["p50"], summary["max"], summary["count"]))
+        if self.latency_dump:
+            self.latency_dump.dump(board_ip_address=self.board_ip_address, iteration=iteration)
+
+    def close(self):
+        if self.pyrogue_connection:
+            self.pyrogue_connection.close()
+        if self.trace_recorder:
+            self.trace_recorder.close()
+
+
+def _get_workload_configs(test_configs, workload_name=None):
+    """
+    Get a pyrogue workload from the "workloads" settings.
+
+    Parameters
+    ----------
+    test_configs : dict
+        The user settings to be applied to the test
+    workload_name : str
+        The name of the workload, e.g. from the board settings of a shelf. Defaults to the "workload" setting.
+
+    Returns
+    -------
+    The workload settings : dict
+
+    Raises ValueError
+    """
+    pyrogue_configs = test_configs["test"]["pyrogue"]
+    workload_name = workload_name or pyrogue_configs.get("workload", "default")
+    workloads = pyrogue_configs.get("workloads", {})
+    if workload_name not in workloads:
+        raise ValueError("Invalid workload '{0}'. Choose one of {1}.".format(workload_name, ", ".join(workloads)))
+    return workloads[workload_name]
+
+
+def _create_pyrogue_root(board_ip_address, devices=None, exclude_devices=(), prbs_offsets=None, trace_recorder=None):
+    """
+    Build the pyrogue Root of a board, connected over interleaved RSSI.
+
+    Parameters
+    ----------
+    board_ip_address : str
+        The IP address of the board
+    devices : list
+        The names of the devices to build in the FpgaTopLevel device tree, e.g. ["AxiVersion", "DDR"], or None to build
+        all of them
+    exclude_devices : list
+        The names of the devices not to build
+    prbs_offsets : dict
+        The AXI-Lite offset of each PRBS device the firmware is built with, e.g. {"SsiPrbsRx": 0x80030000}, or None
+    trace_recorder : TraceRecorder
+        The recorder of the SRPv3 transactions with the board, or None
+    """
+    base = pr.Root(name='AMCc', description='')
+    base.add(FpgaTopLevel(
+        commType='eth-rssi-interleaved',
+        ipAddr=board_ip_address,
+        pcieRssiLink=4,
+        devices=devices,
+        excludeDevices=exclude_devices,
+        prbsOffsets=prbs_offsets,
+        traceRecorder=trace_recorder
+    ))
+    return base
+
+
+def _create_pyrogue_connection(test_configs, board_ip_address, trace_recorder=None):
+    """
+    Create the persistent pyrogue connection to a board, from the "connection", "device_profile", "polling" and "prbs"
+    pyrogue settings, optionally recording its transactions with a trace recorder.
+    """
+    connection_configs = test_configs["test"]["pyrogue"].get("connection", {})
+    polling_configs = test_configs["test"]["pyrogue"].get("polling", {})
+    poller_factory = None
+    if polling_configs.get("mode", "pyrogue") == "coalesced":
+        poller_factory = functools.partial(
+            PollScheduler, max_transactions_per_sec=float(polling_configs.get("max_transactions_per_sec", 20)),
+            max_gap_bytes=int(polling_configs.get("max_gap_bytes", 64)))
+    device_profile = test_configs["test"]["pyrogue"].get("device_profile", {})
+    prbs_offsets = None
+    if test_configs["test"]["pyrogue"].get("stress_mode") == "line_rate":
+        prbs_offsets = {name: int(str(offset), 0)
+                        for name, offset in test_configs["test"]["pyrogue"].get("prbs", {}).get("offsets", {}).items()}
+    root_factory = functools.partial(_create_pyrogue_root, devices=device_profile.get("devices"),
+                                     exclude_devices=tuple(device_profile.get("exclude_devices", ())),
+                                     prbs_offsets=prbs_offsets, trace_recorder=trace_recorder)
+    trend_path = os.path.join(_get_log_dir_path(test_configs), "reconnect-trend-{0}.csv".format(board_ip_address))
+    return PyrogueConnection(board_ip_address, root_factory,
+                             initial_backoff_secs=float(connection_configs.get("initial_backoff_secs", 0.1)),
+                             max_backoff_secs=float(connection_configs.get("max_backoff_secs", 5.0)),
+                             connect_timeout_secs=float(connection_configs.get("connect_timeout_secs", 120)),
+                             trend_path=trend_path, poller_factory=poller_factory)
+
+
+def _create_cpsw_connection(test_configs):
+    """
+    Create the cached CPSW hierarchy of a board, from the "cpsw" settings and the "connection" pyrogue settings.
+    """
+    connection_configs = test_configs["test"].get("pyrogue", {}).get("connection", {})
+    return CpswConnection("cpsw_yaml/" + str(test_configs["test"]["cpsw"]["yaml_filename"]), Path.loadYamlFile,
+                          ScalVal.create,
+                          initial_backoff_secs=float(connection_configs.get("initial_backoff_secs", 0.1)),
+                          max_backoff_secs=float(connection_configs.get("max_backoff_secs", 5.0)),
+                          connect_timeout_secs=float(connection_configs.get("connect_timeout_secs", 120)))
 
 
 def _run_cmd(cmd, sleep_secs=30, log_level_debug=False):
@@ -215,95 +658,87 @@ def _run_cmd(cmd, sleep_secs=30, log_level_debug=False):
         The number of seconds to sleep after the command run is finished.
     log_level_debug : bool
         True if to force the log level to DEBUG; False if to keep the current log level
+
+    Returns
+    -------
+    The command's stdout : str
     """
     logger.info("## Running IPMI comand: ##")
     logger.info(cmd)
 
-    proc = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = proc.communicate()
-    return_code = proc.returncode
+    return_code, stdout_data, stderr_data = _execute_cmd(cmd)
 
     logger.info("Return Code: {0}\n".format(return_code))
 
     if log_level_debug:
         logger.setLevel(logging.DEBUG)
 
-    stdout_data = stdout.decode()
     if len(stdout_data):
         logger.debug("### stdout ###")
         logger.debug("{0}".format(stdout_data))
 
-    stderr_data = stderr.decode()
     if len(stderr_data):
         logger.debug("### stderr ###")
-        logger.debug("{0}".format(stderr.decode()))
+        logger.debug("{0}".format(stderr_data))
 
     _count_down_sleep_status(sleep_secs)
+    return stdout_data
 
 
-def _detect_board_active(board_ip_address, expected_board_is_active, ping_count=5):
+def _execute_cmd(cmd):
     """
-    Detect if the board is active or not, and compare the board's activeness with the expectation. The detection is
-    accomplished by pinging the board's IP address. If the ping command's return code is 0, the board is determined
-    to be active. Otherwise, the board is determined to be inactive.
+    Run a shell command and wait for it to finish. With the "session" IPMI backend, the ipmitool commands that the
+    persistent IPMI sessions support are run natively through them instead.
 
-    Parameters
-    ----------
-    board_ip_address : str
-        The IP address of the board
-    expected_board_is_active : bool
-        True if the board is expected to be active; False if not
-    ping_count : int
-        The number of pings to send
+    Returns
+    -------
+    The return code, stdout and stderr of the command : tuple
     """
-    if expected_board_is_active:
-        logger.info("\n\n--- Detecting if the board is active ---")
-    else:
-        logger.info("\n\n--- Detecting if the board is inactive ---")
+    start_time = time.perf_counter()
+    if ipmi_sessions:
+        result = ipmi_sessions.run(cmd)
+        if result:
+            record_latency("ipmi_command", time.perf_counter() - start_time)
+            return result.return_code, result.stdout, result.stderr
 
-    proc = Popen("ping " + board_ip_address + " -c " + str(ping_count), shell=True, stdout=PIPE, stderr=PIPE)
+    proc = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
     stdout, stderr = proc.communicate()
-    return_code = proc.returncode
-
-    status_data = stdout.decode()
-    error_data = stderr.decode()
-
-    if expected_board_is_active:
-        if return_code != 0:
-            logger.debug("The board is expected to be ACTIVE, but it does not respond to {0} pings.\n"
-                         "stdout: {1}\n\nstderr: {2}\n".format(ping_count, status_data, error_data))
-            return False
-        else:
-            logger.info("The board is ACTIVE, as expected.")
-    elif not expected_board_is_active:
-        if return_code == 0:
-            logger.debug("The board is expected to be INACTIVE, but it still responds after {0} pings.\n"
-                         "stdout: {1}\n\nstderr: {2}\n".format(ping_count, status_data, error_data))
-            return False
-        else:
-            logger.info("The board is INACTIVE, as expected.")
+    record_latency("ipmi_command", time.perf_counter() - start_time)
+    return proc.returncode, stdout.decode(), stderr.decode()
 
-    logger.debug("Board activeness detection is finished.\n")
-    return True
 
-
-class StreamToLogger:
-    """
-    Source: http://www.electricmonk.nl/log/2011/08/14/redirect-stdout-and-stderr-to-a-logger-in-python/
-    Fake file-like stream object that redirects writes to a logger instance.
+def _log_board_summary(axi_version):
     """
-    def __init__(self, logger, log_level=logging.INFO):
-        self.logger = logger
-        self.log_level = log_level
-        self.linebuf = ''
-
-    def write(self, buf):
-        for line in buf.rstrip().splitlines():
-            self.logger.log(self.log_level, line.rstrip())
+    Log the summary of the AxiVersion device, as printed by its printStatus(), from the values of its variables.
 
-
-def run_pyrogue_stress_activities(board_ip_address, pyrogue_base, write_value_count=20000, ddr_read_cycles=100,
-                                  sleep_secs=600):
+    Parameters
+    ----------
+    axi_version : pyrogue.Device
+        The AxiVersion device of the board
+    """
+    axi_version.UpTimeCnt.get()
+    axi_version.BuildStamp.get()
+
+    git_hash = axi_version.GitHash.get()
+    summary = (("FwVersion", hex(axi_version.FpgaVersion.get())),
+               ("UpTime", axi_version.UpTime.get()),
+               ("GitHash", hex(git_hash) if git_hash != 0 else "dirty (uncommitted code)"),
+               ("XilinxDnaId", hex(axi_version.DeviceDna.get())),
+               ("FwTarget", axi_version.ImageName.get()),
+               ("BuildEnv", axi_version.BuildEnv.get()),
+               ("BuildServer", axi_version.BuildServer.get()),
+               ("BuildDate", axi_version.BuildDate.get()),
+               ("Builder", axi_version.Builder.get()))
+    for name, value in summary:
+        logger.info("{0:<13}= {1}".format(name, value))
+
+
+def run_pyrogue_stress_activities(board_ip_address, pyrogue_connection, write_value_count=20000, ddr_read_cycles=100,
+                                  sleep_secs=600, stress_mode="sequential", in_flight_depth=32,
+                                  ddr_mode="read_cycles", ddr_benchmark_configs=None, ddr_benchmark_path=None,
+                                  ddr_verify_configs=None, log_summary_interval_secs=10, transaction_detail_path=None,
+                                  pause_polling=False, prbs_configs=None, prbs_report_path=None, mixed_configs=None,
+                                  open_loop_configs=None, open_loop_report_path=None, workload_configs=None):
     """
     Use pyrogue to stress the board by writing values to the FPGA and reading from DDR.
 
@@ -311,117 +746,264 @@ def run_pyrogue_stress_activities(board_ip_address, pyrogue_base, write_value_co
     ----------
     board_ip_address : str
         The IP address used to connect to the FPGA board
-    pyrogue_base: pr.Root
-        The root AMC device to run the pyrogue commands
+    pyrogue_connection : PyrogueConnection
+        The persistent pyrogue connection to the board
     write_value_count : int
         The number of values to write, default at 20,000
     ddr_read_cycles : int
         The number of times to perform a DDR read
     sleep_secs : int
         The amount of time to sleep after the value writes.
+    stress_mode : str
+        "sequential" to write and read one value at a time, "pipelined" to keep several write/read-verify
+        transactions in flight, "mixed" to run the register and DDR traffic concurrently, "open_loop" to ramp the
+        rate of an open-loop register and DDR load up to the knee of the latency curve, "line_rate" to run the
+        firmware PRBS traffic through the switch instead, or "workload" to run the declared register and DDR workload
+        instead of both the register writes and the DDR reads
+    in_flight_depth : int
+        The maximum number of transactions in flight in the "pipelined" stress mode
+    ddr_mode : str
+        "read_cycles" to read the same DDR block ddr_read_cycles times, "benchmark" to run the DDR throughput
+        benchmark instead, or "verify" to write a known data pattern to DDR and verify it
+    ddr_benchmark_configs : dict
+        The "ddr_benchmark" settings of the DDR benchmark
+    ddr_benchmark_path : str
+        The JSON lines file to append the DDR benchmark results to
+    ddr_verify_configs : dict
+        The "ddr_verify" settings of the DDR integrity check
+    log_summary_interval_secs : float
+        The time between two summary log records of the values read back in the "sequential" stress mode
+    transaction_detail_path : str
+        The binary file to append the detail of every write and read back to, or None
+    pause_polling : bool
+        True to pause the polling of the board's variables while the stress activities are measured
+    prbs_configs : dict
+        The "prbs" settings of the "line_rate" stress mode
+    prbs_report_path : str
+        The JSON lines file to append the line-rate test reports to
+    mixed_configs : dict
+        The "mixed" settings of the "mixed" stress mode
+    open_loop_configs : dict
+        The "open_loop" settings of the "open_loop" stress mode
+    open_loop_report_path : str
+        The JSON lines file to append the open-loop knee searches to
+    workload_configs : dict
+        The workload of the "workload" stress mode
 
     Returns
     ----------
-    The pyrogue base object to use for the next stress activity generations
-    """
-    # Set base
-    if not pyrogue_base:
-        logger.info("Creating a new base...")
-        base = pr.Root(name='AMCc', description='')
-        base.add(FpgaTopLevel(
-            commType='eth-rssi-interleaved',
-            ipAddr=board_ip_address,
-            pcieRssiLink=4
-        ))
-
-        pyrogue_base = base
-    else:
-        logger.info("Restarting the existing base...")
-        base = pyrogue_base
-        base.FpgaTopLevel.stream.start()
-
-    # Start the system
-    base.start(pollEn=1)
+    The pyrogue connection to use for the next stress activity generations
+    """
+    # Connect, building the device tree on first use only
+    base = pyrogue_connection.connect()
 
     logger.info("\n## BOARD SUMMARY ##\n")
 
-    # Capture the AxiVersion Summary to log
-    stdout_handler = sys.stdout
-    stderr_handler = sys.stderr
-
-    global_logger = logging.getLogger()
-    org_global_logging_level = global_logger.level
-
-    # Temporary bump up the global logging level to get the Summary printout
-    global_logger.setLevel(logging.INFO)
-    sys.stdout = StreamToLogger(global_logger, logging.INFO)
-    sys.stderr = StreamToLogger(global_logger, logging.ERROR)
-
-    base.FpgaTopLevel.AmcCarrierCore.AxiVersion.printStatus()
-
-    # Revert to the current log level and restore stdout and stderr handlers
-    global_logger.setLevel(org_global_logging_level)
-    sys.stdout = stdout_handler
-    sys.stderr = stderr_handler
-
-    logger.info("-- pyrogue: Start writing to and reading values from the board --")
-
-    for i in range(write_value_count):
-        logger.debug("-- pyrogue: Writing value: {0} to board".format(i))
-        base.FpgaTopLevel.AmcCarrierCore.AxiVersion.ScratchPad.set(i, write=True)
-
-        value = base.FpgaTopLevel.AmcCarrierCore.AxiVersion.ScratchPad.get()
-        logger.info("-- pyrogue: Reading value: {0} from board".format(value))
-
-        time.sleep(0.01)
-
-    for i in range(ddr_read_cycles):
-        logger.info("-- pyrogue: DDR read cycle {0}".format(i))
-        base.FpgaTopLevel.DDR._rawRead(offset=0x0, numWords=0x100000)
-
-        time.sleep(0.01)
-
-    # Close
-    logger.debug("Stopping base")
-    base.stop()
-
-    logger.debug("Stopping stream")
-    base.FpgaTopLevel.stream.stop()
+    _log_board_summary(base.FpgaTopLevel.AmcCarrierCore.AxiVersion)
+
+    # Keep the background polling out of the measured traffic. The next connection resumes it. A poller issuing raw
+    # transactions is always paused: a device reports the errors of its transactions together, so the errors of the
+    # poller and of the stress activities on the same device could not be told apart.
+    if pause_polling or pyrogue_connection.poller:
+        pyrogue_connection.pause_polling()
+
+    if stress_mode == "pipelined":
+        run_pipelined_scratchpad_stress(base.FpgaTopLevel.AmcCarrierCore.AxiVersion,
+                                        write_value_count=write_value_count, in_flight_depth=in_flight_depth)
+    elif stress_mode == "mixed":
+        mixed_configs = mixed_configs or {}
+        report = run_mixed_traffic(base.FpgaTopLevel.AmcCarrierCore.AxiVersion, base.FpgaTopLevel.DDR,
+                                   duration_secs=float(mixed_configs.get("duration_secs", 10)),
+                                   register_weight=float(mixed_configs.get("register_weight", 1)),
+                                   ddr_weight=float(mixed_configs.get("ddr_weight", 1)),
+                                   paced=mixed_configs.get("paced", True),
+                                   register_in_flight_depth=int(mixed_configs.get("register_in_flight_depth", 8)),
+                                   ddr_in_flight_depth=int(mixed_configs.get("ddr_in_flight_depth", 4)),
+                                   ddr_block_size=int(mixed_configs.get("ddr_block_size", 0x10000)))
+        errors = sum(summary["errors"] + summary["mismatches"] for summary in report["tdests"].values())
+        if errors:
+            raise RuntimeError("Mixed traffic failed with {0} transaction errors and read-back mismatches"
+                               .format(errors))
+    elif stress_mode == "workload":
+        start_time = time.perf_counter()
+        steps = compile_workload(base.FpgaTopLevel, workload_configs or {})
+        logger.debug("Compiled the workload in {0:.2f} seconds".format(time.perf_counter() - start_time))
+        report = run_workload(steps, repeat=int((workload_configs or {}).get("repeat", 1)))
+        if report["errors"] or report["mismatches"]:
+            raise RuntimeError("Workload failed with {0} transaction errors and {1} read-back mismatches"
+                               .format(report["errors"], report["mismatches"]))
+    elif stress_mode == "open_loop":
+        open_loop_configs = open_loop_configs or {}
+        errors = 0
+        for target in open_loop_configs.get("targets", ["register", "ddr"]):
+            if target == "register":
+                device = base.FpgaTopLevel.AmcCarrierCore.AxiVersion
+                operation = register_operations(device)
+            elif target == "ddr":
+                device = base.FpgaTopLevel.DDR
+                operation = ddr_operations(device, block_size=int(open_loop_configs.get("ddr_block_size", 4096)))
+            else:
+                raise ValueError("Invalid open-loop target '{0}'. Use 'register' or 'ddr'.".format(target))
+            report = find_latency_knee(
+                operation, device, start_ops_per_sec=float(open_loop_configs.get("start_ops_per_sec", 1000)),
+                rate_factor=float(open_loop_configs.get("rate_factor", 1.5)),
+                max_ops_per_sec=float(open_loop_configs.get("max_ops_per_sec", 100000)),
+                burst=int(open_loop_configs.get("burst", 32)), step_secs=float(open_loop_configs.get("step_secs", 5)),
+                in_flight_depth=int(open_loop_configs.get("in_flight_depth", 32)),
+                deadline_slack_secs=float(open_loop_configs.get("deadline_slack_secs", 0.001)),
+                knee_latency_factor=float(open_loop_configs.get("knee_latency_factor", 3)),
+                max_missed_deadline_rate=float(open_loop_configs.get("max_missed_deadline_rate", 0.01)))
+            if open_loop_report_path:
+                save_open_loop_report(report, open_loop_report_path, board_ip_address=board_ip_address, target=target)
+            errors += report["errors"]
+        if errors:
+            raise RuntimeError("Open-loop load failed with {0} transaction errors".format(errors))
+    elif stress_mode == "line_rate":
+        prbs_configs = prbs_configs or {}
+        top_level = base.FpgaTopLevel
+        if not hasattr(top_level, "SsiPrbsRx") or \
+                not (hasattr(top_level, "SsiPrbsRateGen") or hasattr(top_level, "SsiPrbsTx")):
+            raise ValueError("The line_rate stress mode needs the offsets of the SsiPrbsRx device, and of the "
+                             "SsiPrbsRateGen or SsiPrbsTx device, in the prbs settings")
+
+        # Ramp the rate with the rate generator if the firmware has one. The SsiPrbsTx always runs at full rate.
+        if hasattr(top_level, "SsiPrbsRateGen"):
+            generator, periods = top_level.SsiPrbsRateGen, prbs_configs.get("periods", [1000, 100, 10, 0])
+        else:
+            generator, periods = top_level.SsiPrbsTx, [None]
+        report = run_prbs_line_rate_test(top_level.SsiPrbsRx, generator,
+                                         packet_lengths=prbs_configs.get("packet_lengths", [256, 1024, 4096]),
+                                         periods=periods, step_secs=float(prbs_configs.get("step_secs", 10)),
+                                         sample_interval_secs=float(prbs_configs.get("sample_interval_secs", 0.01)),
+                                         max_bit_error_rate=float(prbs_configs.get("max_bit_error_rate", 1e-12)),
+                                         rx_clk_period_secs=float(prbs_configs.get("rx_clk_period_secs", 6.4e-9)))
+        if prbs_report_path:
+            save_prbs_report(report, prbs_report_path, board_ip_address=board_ip_address)
+        if not report["passed"]:
+            raise RuntimeError("PRBS line-rate test failed with {0} bit errors in {1} bits"
+                               .format(report["bit_errors"], report["bits_checked"]))
+    else:
+        logger.info("-- pyrogue: Start writing to and reading values from the board --")
+
+        is_debug = logger.isEnabledFor(logging.DEBUG)
+        with ReadbackLog(logger, "pyrogue", interval_secs=log_summary_interval_secs,
+                         detail_path=transaction_detail_path) as readback_log:
+            for i in range(write_value_count):
+                if is_debug:
+                    logger.debug("-- pyrogue: Writing value: {0} to board".format(i))
+                start_time = time.perf_counter()
+                base.FpgaTopLevel.AmcCarrierCore.AxiVersion.ScratchPad.set(i, write=True)
+                write_time = time.perf_counter()
+                record_latency("register_write", write_time - start_time)
+
+                value = base.FpgaTopLevel.AmcCarrierCore.AxiVersion.ScratchPad.get()
+                read_time = time.perf_counter()
+                record_latency("register_read", read_time - write_time)
+                readback_log.record(i, value, read_time - start_time)
+
+                time.sleep(0.01)
+
+    if stress_mode == "workload":
+        # The workload declares its own DDR traffic
+        pass
+    elif ddr_mode == "benchmark":
+        ddr_benchmark_configs = ddr_benchmark_configs or {}
+        results = run_ddr_benchmark(base.FpgaTopLevel.DDR,
+                                    block_sizes=ddr_benchmark_configs.get("block_sizes", DEFAULT_BLOCK_SIZES),
+                                    offsets_per_size=int(ddr_benchmark_configs.get("offsets_per_size", 16)),
+                                    reads_per_size=int(ddr_benchmark_configs.get("reads_per_size", 256)),
+                                    in_flight_depth=int(ddr_benchmark_configs.get("in_flight_depth", 8)))
+        if ddr_benchmark_path:
+            save_benchmark_results(results, ddr_benchmark_path, board_ip_address=board_ip_address)
+        if results["errors"]:
+            raise RuntimeError("DDR benchmark failed with {0} transaction errors".format(results["errors"]))
+    elif ddr_mode == "verify":
+        ddr_verify_configs = ddr_verify_configs or {}
+        summary = run_ddr_integrity_check(base.FpgaTopLevel.DDR,
+                                          pattern=ddr_verify_configs.get("pattern", "address"),
+                                          block_size=int(ddr_verify_configs.get("block_size", 0x400000)),
+                                          block_count=int(ddr_verify_configs.get("block_count", 16)),
+                                          in_flight_depth=int(ddr_verify_configs.get("in_flight_depth", 8)),
+                                          seed=int(ddr_verify_configs.get("seed", 1)))
+        if summary["mismatches"]:
+            raise RuntimeError("DDR integrity check failed with {0} mismatching words".format(summary["mismatches"]))
+    else:
+        # Read into the same buffer every cycle, instead of building a new list of 0x100000 ints. Keep all the
+        # transactions of the block in flight together, as a raw read of the whole block does.
+        ddr = base.FpgaTopLevel.DDR
+        ddr_read_buffer = bytearray(0x100000 * 4)
+        ddr_accessor = DdrAccessor(ddr, in_flight_depth=-(-len(ddr_read_buffer) // ddr._reqMaxAccess()))
+        for i in range(ddr_read_cycles):
+            logger.info("-- pyrogue: DDR read cycle {0}".format(i))
+            ddr_accessor.read_into(ddr_read_buffer, 0x0)
+
+            time.sleep(0.01)
+
+    # Keep the device tree, and stop the link until the board is power cycled
+    pyrogue_connection.suspend()
     logger.debug("Stopping finished.")
 
     logger.info("-- pyrogue: End writing to and reading values from the board --")
     _count_down_sleep_status(sleep_secs)
 
-    return pyrogue_base
+    return pyrogue_connection
 
 
-def run_cpsw_stress_activities(yaml_filename, write_value_count=20000, sleep_secs=600):
+def run_cpsw_stress_activities(cpsw_connection, write_value_count=20000, sleep_secs=600, stress_mode="sequential",
+                               batched_configs=None, seed=0, log_summary_interval_secs=10,
+                               transaction_detail_path=None):
     """
     Use CPSW to stress the board by writing values to and then reading these from the FPGA
 
     Parameters
     ----------
-    yaml_filename : str
-        The CPSW YAML file containing the read/write specifications
+    cpsw_connection : CpswConnection
+        The cached CPSW hierarchy of the board
     write_value_count : int
         The number of values to write, default at 20,000
     sleep_secs : int
         The amount of time to sleep after the value writes.
+    stress_mode : str
+        "sequential" to write and read one ScratchPad value at a time, or "batched" to write and read back batches of
+        words of an array, e.g. a DDR region
+    batched_configs : dict
+        The "batched" settings of the "batched" stress mode
+    seed : int
+        Added to the words of each batch in the "batched" stress mode
+    log_summary_interval_secs : float
+        The time between two summary log records of the values read back
+    transaction_detail_path : str
+        The binary file to append the detail of every write and read back to, or None
     """
-    top_dev = "NetIODev"
-    root = Path.loadYamlFile("cpsw_yaml/" + str(yaml_filename), top_dev)
-
-    scratch_pad = ScalVal.create(root.findByName("mmio/AmcCarrierCore/AxiVersion/ScratchPad"))
-
-    logger.info("-- CPSW: Start writing to and reading values from the board... --")
-    for i in range(write_value_count):
-        logger.debug("-- CPSW: Writing value: {0} to board".format(i))
-        scratch_pad.setVal(i)
-
-        value = scratch_pad.getVal()
-        logger.info("-- CPSW: Reading value: {0} from board".format(value))
-
-        time.sleep(0.01)
+    # Load the hierarchy on first use only, and wait for the board to answer
+    cpsw_connection.connect()
+
+    if stress_mode == "batched":
+        batched_configs = batched_configs or {}
+        run_cpsw_batched_stress(cpsw_connection.scal_val(batched_configs.get("path", "ddr/Words")),
+                                batch_words=int(batched_configs.get("batch_words", 1024)),
+                                batch_count=int(batched_configs.get("batch_count", 1000)), seed=seed)
+    else:
+        scratch_pad = cpsw_connection.scal_val("mmio/AmcCarrierCore/AxiVersion/ScratchPad")
+
+        logger.info("-- CPSW: Start writing to and reading values from the board... --")
+        is_debug = logger.isEnabledFor(logging.DEBUG)
+        with ReadbackLog(logger, "CPSW", interval_secs=log_summary_interval_secs,
+                         detail_path=transaction_detail_path) as readback_log:
+            for i in range(write_value_count):
+                if is_debug:
+                    logger.debug("-- CPSW: Writing value: {0} to board".format(i))
+                start_time = time.perf_counter()
+                scratch_pad.setVal(i)
+                write_time = time.perf_counter()
+                record_latency("register_write", write_time - start_time)
+
+                value = scratch_pad.getVal()
+                read_time = time.perf_counter()
+                record_latency("register_read", read_time - write_time)
+                readback_log.record(i, value, read_time - start_time)
+
+                time.sleep(0.01)
 
     logger.info("-- CPSW: End writing to and reading values from the board --")
     _count_down_sleep_status(sleep_secs)
@@ -454,6 +1036,8 @@ def _parse_arguments():
     parser.add_argument("config-file", help="The name of test configuration file.")
 
     parser.add_argument("--verbose-logging", action="store_true")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Log the import time of the test and of its selected backends by package, and exit.")
     parser.add_argument("--version", action="version", version=VERSION)
 
     args = parser.parse_args()
@@ -491,7 +1075,7 @@ if __name__ == "__main__":
             h.flush()
 
         # Run the status command to get diagnostic data
-        _run_cmd(status_cmd, sleep_secs=10, log_level_debug=True)
-        _detect_board_active(board_ip_address, expected_board_is_active=False)
+        if status_cmd:
+            _run_cmd(status_cmd, sleep_secs=10, log_level_debug=True)
 
         logger.info("Ending the test...")
@@ -0,0 +1,294 @@
+# Latency and throughput metrics for the stress activities
+
+import collections
+import contextvars
+import threading
+
+
+# The values recorded for each metric name during the test
+_recorded_values = collections.defaultdict(list)
+
+
+def percentile(sorted_values, fraction):
+    """
+    Get a percentile from a sorted list, using the nearest-rank method.
+
+    Parameters
+    ----------
+    sorted_values : list
+        The values, in ascending order
+    fraction : float
+        The percentile as a fraction, e.g. 0.99 for p99
+
+    Returns
+    -------
+    The value at the requested percentile, or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    rank = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+def summarize_values(values):
+    """
+    Summarize a list of values.
+
+    Returns
+    -------
+    The value count, and the min, p50, p99 and max values : dict
+    """
+    sorted_values = sorted(values)
+    count = len(sorted_values)
+    return {
+        "count": count,
+        "min": sorted_values[0] if count else None,
+        "p50": percentile(sorted_values, 0.50),
+        "p99": percentile(sorted_values, 0.99),
+        "max": sorted_values[-1] if count else None,
+    }
+
+
+def record_metric(name, value):
+    """
+    Record a value of a metric, e.g. the time a board took to reach a state.
+
+    Parameters
+    ----------
+    name : str
+        The metric name
+    value : float
+        The value to record
+    """
+    _recorded_values[name].append(value)
+
+
+def get_metric_summary(name):
+    """
+    Summarize all the values recorded for a metric.
+
+    Returns
+    -------
+    The value count, and the min, p50, p99 and max values : dict
+    """
+    return summarize_values(_recorded_values.get(name, []))
+
+
+def summarize_latencies(latencies, elapsed_secs):
+    """
+    Summarize a list of round-trip latencies collected over a measurement window.
+
+    Parameters
+    ----------
+    latencies : list
+        The round-trip latencies, in seconds
+    elapsed_secs : float
+        The wall-clock length of the measurement window, in seconds
+
+    Returns
+    -------
+    The transaction count, the achieved transactions/s, and the min, p50, p99 and max latencies in seconds : dict
+    """
+    sorted_latencies = sorted(latencies)
+    count = len(sorted_latencies)
+    return {
+        "count": count,
+        "transactions_per_sec": count / elapsed_secs if elapsed_secs > 0 else 0.0,
+        "min_secs": sorted_latencies[0] if count else None,
+        "p50_secs": percentile(sorted_latencies, 0.50),
+        "p99_secs": percentile(sorted_latencies, 0.99),
+        "max_secs": sorted_latencies[-1] if count else None,
+    }
+
+
+def format_latency_summary(summary):
+    """
+    Format a latency summary for the logs, with the latencies in microseconds.
+    """
+    if not summary["count"]:
+        return "no transactions completed"
+
+    return "{0} transactions, {1:.1f} transactions/s, latency min/p50/p99/max: {2:.1f}/{3:.1f}/{4:.1f}/{5:.1f} us"\
+        .format(summary["count"], summary["transactions_per_sec"], summary["min_secs"] * 1e6,
+                summary["p50_secs"] * 1e6, summary["p99_secs"] * 1e6, summary["max_secs"] * 1e6)
+
+
+def log2_histogram(values, unit=1e-6):
+    """
+    Count values into power-of-two buckets, e.g. latencies into 1, 2, 4, 8... microsecond buckets.
+
+    Parameters
+    ----------
+    values : list
+        The values to count
+    unit : float
+        The size of the smallest bucket, in the unit of the values
+
+    Returns
+    -------
+    The count of values in each bucket, keyed by the bucket's upper bound in units, in ascending order : dict
+    """
+    counts = collections.Counter()
+    for value in values:
+        upper_bound = 1
+        while value > upper_bound * unit:
+            upper_bound <<= 1
+        counts[upper_bound] += 1
+    return collections.OrderedDict(sorted(counts.items()))
+
+
+class LatencyHistogram:
+    """
+    An HDR-style histogram of latencies: log-linear buckets, SUB_BUCKET_COUNT linear sub-buckets per power of two of
+    nanoseconds, which bound the relative error of any percentile to 1 / SUB_BUCKET_COUNT (3%), over any range, in a
+    few hundred buckets at most. Recording a value is a few integer operations and a dict update.
+    """
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+    HALF_SUB_BUCKET_COUNT = SUB_BUCKET_COUNT >> 1
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.count = 0
+        self.sum_secs = 0.0
+        self.max_secs = 0.0
+
+    @classmethod
+    def bucket_index(cls, value_ns):
+        if value_ns < cls.SUB_BUCKET_COUNT:
+            return value_ns
+        exponent = value_ns.bit_length() - cls.SUB_BUCKET_BITS
+        return cls.SUB_BUCKET_COUNT + (exponent - 1) * cls.HALF_SUB_BUCKET_COUNT \
+            + (value_ns >> exponent) - cls.HALF_SUB_BUCKET_COUNT
+
+    @classmethod
+    def bucket_upper_bound_secs(cls, index):
+        """
+        The highest latency counted in a bucket, in seconds.
+        """
+        if index < cls.SUB_BUCKET_COUNT:
+            return index * 1e-9
+        exponent, sub_index = divmod(index - cls.SUB_BUCKET_COUNT, cls.HALF_SUB_BUCKET_COUNT)
+        exponent += 1
+        return (((cls.HALF_SUB_BUCKET_COUNT + sub_index + 1) << exponent) - 1) * 1e-9
+
+    def record(self, latency_secs):
+        self.counts[self.bucket_index(max(int(latency_secs * 1e9), 0))] += 1
+        self.count += 1
+        self.sum_secs += latency_secs
+        if latency_secs > self.max_secs:
+            self.max_secs = latency_secs
+
+    def percentile(self, fraction):
+        """
+        Get a latency percentile, e.g. 0.999 for p99.9, as the upper bound of its bucket in seconds, or None if
+        there are no latencies.
+        """
+        if not self.count:
+            return None
+        rank = max(int(round(fraction * self.count)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_upper_bound_secs(index), self.max_secs)
+        return self.max_secs
+
+    def cumulative_counts(self, upper_bounds_secs):
+        """
+        Count the latencies up to each upper bound, as the buckets of a Prometheus histogram.
+
+        Returns
+        -------
+        The count of latencies up to each upper bound, in the order of the bounds : list
+        """
+        cumulative = [0] * len(upper_bounds_secs)
+        for index, count in self.counts.items():
+            upper_bound_secs = self.bucket_upper_bound_secs(index)
+            for i, bound_secs in enumerate(upper_bounds_secs):
+                if upper_bound_secs <= bound_secs:
+                    cumulative[i] += count
+        return cumulative
+
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.counts = collections.Counter(self.counts)
+        histogram.count = self.count
+        histogram.sum_secs = self.sum_secs
+        histogram.max_secs = self.max_secs
+        return histogram
+
+    def subtract(self, previous):
+        """
+        Get the histogram of the latencies recorded since a previous copy of this histogram. Its max is the upper
+        bound of its highest bucket, as the exact max of the interval is not kept.
+        """
+        histogram = self.copy()
+        histogram.counts.subtract(previous.counts)
+        histogram.counts = +histogram.counts
+        histogram.count -= previous.count
+        histogram.sum_secs -= previous.sum_secs
+        histogram.max_secs = min(self.bucket_upper_bound_secs(max(histogram.counts)), self.max_secs) \
+            if histogram.counts else 0.0
+        return histogram
+
+    def summarize(self):
+        """
+        Returns
+        -------
+        The latency count, and the p50, p99, p99.9 and max latencies in seconds : dict
+        """
+        return {
+            "count": self.count,
+            "p50_secs": self.percentile(0.50),
+            "p99_secs": self.percentile(0.99),
+            "p999_secs": self.percentile(0.999),
+            "max_secs": self.max_secs if self.count else None,
+        }
+
+
+# The latency histograms of the test, keyed by (board, phase, operation)
+_latency_histograms = {}
+_latency_lock = threading.Lock()
+# The board and the test phase of the latencies, kept per context, so that the boards tested concurrently from the
+# tasks of one event loop each label their own latencies. A thread starts from an empty context, so the threads
+# recording latencies on behalf of a board are run in a copy of its context.
+_latency_labels = contextvars.ContextVar("latency_labels", default={"board": "", "phase": ""})
+
+
+def set_latency_labels(board=None, phase=None):
+    """
+    Set the board and the test phase that the latencies recorded next in the current context are labeled with, e.g.
+    the board IP address and "activation".
+    """
+    labels = dict(_latency_labels.get())
+    if board is not None:
+        labels["board"] = board
+    if phase is not None:
+        labels["phase"] = phase
+    _latency_labels.set(labels)
+
+
+def record_latency(operation, latency_secs):
+    """
+    Record the latency of an operation, e.g. "register_read", in the histogram of the current board and phase.
+    """
+    labels = _latency_labels.get()
+    key = (labels["board"], labels["phase"], operation)
+    with _latency_lock:
+        histogram = _latency_histograms.get(key)
+        if histogram is None:
+            histogram = _latency_histograms[key] = LatencyHistogram()
+        histogram.record(latency_secs)
+
+
+def snapshot_latency_histograms():
+    """
+    Copy the latency histograms.
+
+    Returns
+    -------
+    A copy of each latency histogram, keyed by (board, phase, operation) : dict
+    """
+    with _latency_lock:
+        return {key: histogram.copy() for key, histogram in _latency_histograms.items()}
@@ -0,0 +1,165 @@
+# Export of the latency histograms: a Prometheus /metrics endpoint, and a dump at the end of each test iteration
+
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import snapshot_latency_histograms
+
+
+# The "le" bucket boundaries of the exported histograms, in seconds: 1-2-5 steps from 10 us to 10 s
+PROMETHEUS_BUCKET_BOUNDS_SECS = [multiplier * 10 ** exponent for exponent in range(-5, 1)
+                                 for multiplier in (1, 2, 5)] + [10]
+
+METRIC_NAME = "switchtest_operation_latency_seconds"
+
+
+def _format_labels(board, phase, operation, **extra_labels):
+    labels = [("board", board), ("phase", phase), ("operation", operation)] + sorted(extra_labels.items())
+    return ",".join('{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for name, value in labels)
+
+
+def format_prometheus(histograms):
+    """
+    Format latency histograms in the Prometheus text exposition format.
+
+    Parameters
+    ----------
+    histograms : dict
+        The LatencyHistogram of each (board, phase, operation) key
+
+    Returns
+    -------
+    The exposition text : str
+    """
+    lines = ["# HELP {0} The latency of each board operation, by test phase.".format(METRIC_NAME),
+             "# TYPE {0} histogram".format(METRIC_NAME)]
+    for key, histogram in sorted(histograms.items()):
+        cumulative_counts = histogram.cumulative_counts(PROMETHEUS_BUCKET_BOUNDS_SECS)
+        for bound_secs, count in zip(PROMETHEUS_BUCKET_BOUNDS_SECS, cumulative_counts):
+            lines.append("{0}_bucket{{{1}}} {2}".format(METRIC_NAME,
+                                                        _format_labels(*key, le="{0:g}".format(bound_secs)), count))
+        lines.append("{0}_bucket{{{1}}} {2}".format(METRIC_NAME, _format_labels(*key, le="+Inf"), histogram.count))
+        lines.append("{0}_sum{{{1}}} {2!r}".format(METRIC_NAME, _format_labels(*key), histogram.sum_secs))
+        lines.append("{0}_count{{{1}}} {2}".format(METRIC_NAME, _format_labels(*key), histogram.count))
+
+    lines.append("# HELP {0}_max The maximum latency of each board operation, by test phase.".format(METRIC_NAME))
+    lines.append("# TYPE {0}_max gauge".format(METRIC_NAME))
+    for key, histogram in sorted(histograms.items()):
+        lines.append("{0}_max{{{1}}} {2!r}".format(METRIC_NAME, _format_labels(*key), histogram.max_secs))
+    return "\n".join(lines) + "\n"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = format_prometheus(snapshot_latency_histograms()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request from {0}: {1}".format(self.address_string(), format % args))
+
+
+class MetricsServer:
+    """
+    Serve the latency histograms of the test at http://<host>:<port>/metrics, in a background thread, for a Prometheus
+    server to scrape while the test runs.
+    """
+    def __init__(self, port, host=""):
+        """
+        Parameters
+        ----------
+        port : int
+            The TCP port to listen on, or 0 for any free port
+        host : str
+            The address to listen on. Defaults to all addresses.
+        """
+        self._server = _ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Serving the latency metrics at http://localhost:{0}/metrics".format(self.port))
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+class LatencyDump:
+    """
+    Log, and append to a JSON lines file, the latency percentiles of the operations recorded since the previous dump,
+    e.g. at the end of each test iteration.
+    """
+    def __init__(self, output_path=None, board=None):
+        """
+        Parameters
+        ----------
+        output_path : str
+            The JSON lines file to append each dump to, or None to only log the dumps
+        board : str
+            The board label of the latencies to dump, e.g. when several boards are tested in the same process, or
+            None to dump the latencies of every board
+        """
+        self.output_path = output_path
+        self.board = board
+        self._previous = {}
+
+    def dump(self, **labels):
+        """
+        Parameters
+        ----------
+        labels : dict
+            Added to the JSON record, e.g. the iteration number
+
+        Returns
+        -------
+        The latency summary of each operation since the previous dump, keyed by "board/phase/operation" : dict
+        """
+        histograms = snapshot_latency_histograms()
+        summaries = {}
+        for key, histogram in sorted(histograms.items()):
+            if self.board is not None and key[0] != self.board:
+                continue
+            previous = self._previous.get(key)
+            interval_histogram = histogram.subtract(previous) if previous else histogram
+            if not interval_histogram.count:
+                continue
+            summary = summaries["/".join(key)] = interval_histogram.summarize()
+            logger.info("Latency of {0} during {1}: {2} operations, p50/p99/p99.9/max {3:.3f}/{4:.3f}/{5:.3f}/{6:.3f} "
+                        "ms".format(key[2], key[1], summary["count"], summary["p50_secs"] * 1e3,
+                                    summary["p99_secs"] * 1e3, summary["p999_secs"] * 1e3,
+                                    summary["max_secs"] * 1e3))
+        self._previous = histograms
+
+        if self.output_path and summaries:
+            record = dict(labels, timestamp=time.time(), latencies=summaries)
+            with open(self.output_path, "a") as output_file:
+                output_file.write(json.dumps(record) + "\n")
+        return summaries
@@ -0,0 +1,231 @@
+# Concurrent register and DDR traffic over the interleaved RSSI link
+
+import contextvars
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import summarize_latencies, format_latency_summary, log2_histogram
+from transactions import TransactionWindow, pack_word, unpack_word
+from ddr_benchmark import sweep_offsets
+
+try:
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+# The tDest of the SRPv3 instance of each stream, on the interleaved RSSI link of TopLevel
+REGISTER_TDEST = 0x0
+DDR_TDEST = 0x4
+
+
+class TrafficPacer:
+    """
+    Keep the transactions issued by several concurrent streams at a fixed ratio. A stream may run ahead of its share
+    by up to slack transactions, and then waits for the other streams to catch up, so that a stream slowed down by
+    head-of-line blocking on the shared link slows the others down by the same ratio. The time each stream waits is
+    kept, to tell which stream holds the others back.
+    """
+    def __init__(self, weights, slack):
+        """
+        Parameters
+        ----------
+        weights : dict
+            The weight of each stream name, e.g. {"register": 4, "ddr": 1} to issue 4 register transactions per DDR
+            transaction
+        slack : float
+            The number of transactions a stream may run ahead of its share, or float("inf") not to pace the streams
+        """
+        self.weights = weights
+        self.slack = slack
+        self.issued = dict.fromkeys(weights, 0)
+        self.wait_secs = dict.fromkeys(weights, 0.0)
+        self._finished = set()
+        self._condition = threading.Condition()
+
+    def _progress(self, name):
+        return self.issued[name] / self.weights[name]
+
+    def acquire(self, name, deadline):
+        """
+        Wait until a stream may issue its next transaction.
+
+        Returns
+        -------
+        True if the stream may issue its next transaction; False if the deadline passed first : bool
+        """
+        with self._condition:
+            while True:
+                others = [self._progress(other) for other in self.weights
+                          if other != name and other not in self._finished]
+                now = time.perf_counter()
+                if now >= deadline:
+                    return False
+                if not others or self.issued[name] + 1 <= min(others) * self.weights[name] + self.slack:
+                    self.issued[name] += 1
+                    self._condition.notify_all()
+                    return True
+                self._condition.wait(deadline - now)
+                self.wait_secs[name] += time.perf_counter() - now
+
+    def finish(self, name):
+        with self._condition:
+            self._finished.add(name)
+            self._condition.notify_all()
+
+
+def _run_register_stream(axi_version, pacer, deadline, in_flight_depth, result):
+    window = TransactionWindow(axi_version, depth=in_flight_depth)
+    scratch_pad_offset = axi_version.ScratchPad.offset
+    mismatches = []
+
+    def _verify(transaction, error, expected):
+        if not error and unpack_word(transaction.data) != expected:
+            mismatches.append((expected, unpack_word(transaction.data)))
+
+    value = 0
+    try:
+        while pacer.acquire("register", deadline):
+            window.submit(scratch_pad_offset, pack_word(value), rim.Write, operation="register_write")
+            window.submit(scratch_pad_offset, bytearray(4), rim.Read,
+                          on_complete=lambda transaction, error, expected=value: _verify(transaction, error, expected),
+                          operation="register_read")
+            value = (value + 1) & 0xFFFFFFFF
+        window.drain()
+    finally:
+        pacer.finish("register")
+    result.update(latencies=window.latencies, errors=window.errors, mismatches=len(mismatches), bytes=8 * value,
+                  end_time=time.perf_counter())
+
+
+def _run_ddr_stream(ddr, pacer, deadline, in_flight_depth, block_size, result):
+    window = TransactionWindow(ddr, depth=in_flight_depth)
+    transaction_size = min(block_size, ddr._reqMaxAccess())
+    offsets = sweep_offsets(block_size, 16)
+
+    blocks = 0
+    try:
+        while pacer.acquire("ddr", deadline):
+            block_offset = offsets[blocks % len(offsets)]
+            for chunk_offset in range(0, block_size, transaction_size):
+                window.submit(block_offset + chunk_offset,
+                              bytearray(min(transaction_size, block_size - chunk_offset)), rim.Read,
+                              operation="ddr_read")
+            blocks += 1
+        window.drain()
+    finally:
+        pacer.finish("ddr")
+    result.update(latencies=window.latencies, errors=window.errors, mismatches=0, bytes=block_size * blocks,
+                  end_time=time.perf_counter())
+
+
+def jain_fairness_index(values):
+    """
+    Get Jain's fairness index of the throughput of several streams, each normalized by its weight: 1.0 when each
+    stream gets its share, down to 1 / the number of streams when one stream gets everything.
+    """
+    if not values or not any(values):
+        return None
+    return sum(values) ** 2 / (len(values) * sum(value ** 2 for value in values))
+
+
+def run_mixed_traffic(axi_version, ddr, duration_secs=10, register_weight=1, ddr_weight=1, paced=True,
+                      register_in_flight_depth=8, ddr_in_flight_depth=4, ddr_block_size=0x10000):
+    """
+    Drive the register traffic, on tDest 0x0, and the DDR traffic, on tDest 0x4, concurrently from two threads over
+    the one interleaved RSSI link, and measure the throughput and the latency of each tDest.
+
+    The register stream writes the ScratchPad and reads it back, verifying each value. The DDR stream reads blocks
+    spread across the DDR window. When paced, the streams issue their transactions at the ratio of their weights,
+    each register transaction counting as a write and read back, and each DDR transaction as a block read, and the
+    time each stream waits for the other tells which one the link holds back. When not paced, each stream runs as
+    fast as it can, and the fairness index tells how evenly the link shares its bandwidth, relative to the weights.
+
+    Parameters
+    ----------
+    axi_version : pr.Device
+        The AmcCarrierCore AxiVersion device
+    ddr : pr.Device
+        The FpgaTopLevel DDR device
+    duration_secs : float
+        How long to run the traffic
+    register_weight : float
+        The share of the register stream
+    ddr_weight : float
+        The share of the DDR stream
+    paced : bool
+        True to keep the streams at the ratio of their weights; False to let each stream run as fast as it can
+    register_in_flight_depth : int
+        The maximum number of register transactions in flight
+    ddr_in_flight_depth : int
+        The maximum number of DDR transactions in flight
+    ddr_block_size : int
+        The size of each DDR block read, in bytes
+
+    Returns
+    -------
+    The summary of each tDest, and the fairness index of their weighted throughput : dict
+
+    Raises ValueError
+    """
+    if register_weight <= 0 or ddr_weight <= 0:
+        raise ValueError("Invalid mixed traffic weights ({0}:{1}). Use positive weights."
+                         .format(register_weight, ddr_weight))
+
+    pacer = TrafficPacer({"register": register_weight, "ddr": ddr_weight},
+                         slack=max(register_in_flight_depth, ddr_in_flight_depth) if paced else float("inf"))
+    results = {"register": {}, "ddr": {}}
+
+    logger.info("-- pyrogue: Start the mixed register and DDR traffic, at a {0}:{1} ratio, for {2} seconds --"
+                .format(register_weight, ddr_weight, duration_secs))
+
+    start_time = time.perf_counter()
+    deadline = start_time + duration_secs
+    # Run each stream in a copy of the caller's context, to label its latencies with the caller's board
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, name="mixed-register",
+                         args=(_run_register_stream, axi_version, pacer, deadline, register_in_flight_depth,
+                               results["register"])),
+        threading.Thread(target=contextvars.copy_context().run, name="mixed-ddr",
+                         args=(_run_ddr_stream, ddr, pacer, deadline, ddr_in_flight_depth, ddr_block_size,
+                               results["ddr"])),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summaries = {}
+    for name, tdest, weight in (("register", REGISTER_TDEST, register_weight), ("ddr", DDR_TDEST, ddr_weight)):
+        result = results[name]
+        if "latencies" not in result:
+            raise RuntimeError("The {0} stream of the mixed traffic failed".format(name))
+        elapsed_secs = result["end_time"] - start_time
+        summary = summaries[name] = summarize_latencies(result["latencies"], elapsed_secs)
+        summary.update({
+            "tdest": tdest,
+            "weight": weight,
+            "issued": pacer.issued[name],
+            "paced_wait_secs": pacer.wait_secs[name],
+            "errors": result["errors"],
+            "mismatches": result["mismatches"],
+            "mb_per_sec": result["bytes"] / elapsed_secs / 1e6 if elapsed_secs > 0 else 0.0,
+            "latency_histogram_us": log2_histogram(result["latencies"]),
+        })
+        logger.info("-- pyrogue: Mixed traffic, tDest 0x{0:X} ({1}): {2:.1f} MB/s, {3}, {4} errors, {5} mismatches"
+                    .format(tdest, name, summary["mb_per_sec"], format_latency_summary(summary), summary["errors"],
+                            summary["mismatches"]))
+
+    fairness = jain_fairness_index([summary["issued"] / summary["weight"] for summary in summaries.values()])
+    logger.info("-- pyrogue: End the mixed traffic. Fairness index of the weighted throughput: {0} --"
+                .format("n/a" if fairness is None else "{0:.3f}".format(fairness)))
+
+    return {
+        "duration_secs": duration_secs,
+        "paced": paced,
+        "fairness_index": fairness,
+        "tdests": summaries,
+    }
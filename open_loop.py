@@ -0,0 +1,288 @@
+# Open-loop, rate-controlled register and DDR load, and the search for the knee of the latency curve
+
+import json
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import summarize_latencies, format_latency_summary
+from transactions import TransactionWindow, pack_word
+from ddr_benchmark import DDR_WINDOW_SIZE
+
+try:
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+# Waits shorter than this are spun instead of slept, as a sleep may overshoot by as much
+SPIN_SECS = 0.0005
+
+
+class TokenBucket:
+    """
+    The schedule of an open-loop load: tokens arrive at the target rate, starting from an empty bucket, and each
+    operation takes one, whether or not the earlier operations are complete. An operation is due when its token
+    arrives. A late generator issues the tokens waiting in the bucket back to back to catch up, but the bucket holds
+    up to burst tokens: the tokens overflowing it are dropped, and their operations are never issued.
+    """
+    def __init__(self, ops_per_sec, burst=1, start_time=0.0):
+        if ops_per_sec <= 0 or burst < 1:
+            raise ValueError("Invalid token bucket ({0} ops/s, burst {1}). Use a positive rate and a burst of at "
+                             "least 1.".format(ops_per_sec, burst))
+        self.ops_per_sec = ops_per_sec
+        self.burst = burst
+        self.start_time = start_time
+        self.taken = 0
+        self.dropped = 0
+
+    def due_time(self):
+        """
+        The time the next operation is due.
+        """
+        return self.start_time + (self.taken + self.dropped + 1) / self.ops_per_sec
+
+    def backlog(self, now):
+        """
+        The number of tokens waiting in the bucket at a time, i.e. the operations due but not issued yet.
+        """
+        return max(int((now - self.start_time) * self.ops_per_sec) - self.taken - self.dropped, 0)
+
+    def take(self, now):
+        """
+        Take the token of the next operation, dropping the tokens overflowing the bucket first.
+
+        Returns
+        -------
+        The time the operation was due : float
+        """
+        self.dropped += max(self.backlog(now) - self.burst, 0)
+        due_time = self.due_time()
+        self.taken += 1
+        return due_time
+
+
+def register_operations(axi_version):
+    """
+    Get the open-loop register operations: ScratchPad writes and reads, alternately.
+
+    Returns
+    -------
+    A function building the (offset, data, transaction type, operation name) of the operation of an index
+    """
+    offset = axi_version.ScratchPad.offset
+
+    def _operation(index):
+        if index % 2:
+            return offset, bytearray(4), rim.Read, "register_read"
+        return offset, pack_word(index // 2), rim.Write, "register_write"
+    return _operation
+
+
+def ddr_operations(ddr, block_size=4096, window_size=DDR_WINDOW_SIZE):
+    """
+    Get the open-loop DDR operations: reads of consecutive blocks, wrapping around the DDR window.
+
+    Returns
+    -------
+    A function building the (offset, data, transaction type, operation name) of the operation of an index
+    """
+    block_size = min(block_size, ddr._reqMaxAccess())
+    block_count = window_size // block_size
+
+    def _operation(index):
+        return (index % block_count) * block_size, bytearray(block_size), rim.Read, "ddr_read"
+    return _operation
+
+
+def run_open_loop_step(operation, device, ops_per_sec, burst=32, duration_secs=5, in_flight_depth=32,
+                       deadline_slack_secs=0.001):
+    """
+    Issue operations on the token bucket schedule of a target rate, for a fixed duration, without waiting for the
+    earlier operations to complete, but for the in-flight depth.
+
+    The latency of each operation is measured from the time it was due, not from the time it was issued, so that the
+    time spent waiting for the link to take the operation counts. An operation issued more than deadline_slack_secs
+    after it was due, or dropped from an overflowing token bucket, missed its deadline. The backlog is the number of
+    due operations still waiting after each issue.
+
+    Parameters
+    ----------
+    operation : callable
+        Builds the operation of an index, e.g. from register_operations
+    device : pr.Device
+        The device of the operations
+    ops_per_sec : float
+        The target rate
+    burst : int
+        The number of tokens the bucket holds, i.e. the operations a late generator may issue back to back
+    duration_secs : float
+        How long to issue operations
+    in_flight_depth : int
+        The maximum number of transactions in flight
+    deadline_slack_secs : float
+        How late an operation may be issued without missing its deadline
+
+    Returns
+    -------
+    The step summary: the target and achieved rates, the latency from the due time, the service latency from the issue
+    time, the missed deadline rate, the backlog, and the transaction errors : dict
+    """
+    window = TransactionWindow(device, depth=in_flight_depth)
+    latencies = []
+    missed = 0
+    max_backlog = 0
+    backlog_total = 0
+
+    def _complete(transaction, error, due_time):
+        latencies.append(time.perf_counter() - due_time)
+
+    start_time = time.perf_counter()
+    bucket = TokenBucket(ops_per_sec, burst=burst, start_time=start_time)
+    end_time = start_time + duration_secs
+    while bucket.due_time() < end_time:
+        # Retire the transactions in flight while the next one is not due yet, so that their latency is not
+        # inflated by waiting for the window to fill up
+        due_time = bucket.due_time()
+        while window.in_flight and time.perf_counter() < due_time:
+            window.retire_oldest()
+        wait_secs = due_time - time.perf_counter()
+        if wait_secs > SPIN_SECS:
+            time.sleep(wait_secs - SPIN_SECS)
+        while time.perf_counter() < due_time:
+            pass
+
+        now = time.perf_counter()
+        index = bucket.taken
+        due_time = bucket.take(now)
+        backlog = bucket.backlog(now)
+        max_backlog = max(max_backlog, backlog)
+        backlog_total += backlog
+        offset, data, txn_type, operation_name = operation(index)
+        window.submit(offset, data, txn_type,
+                      on_complete=lambda transaction, error, due_time=due_time: _complete(transaction, error, due_time),
+                      operation=operation_name)
+        if time.perf_counter() - due_time > deadline_slack_secs:
+            missed += 1
+    issued_secs = time.perf_counter() - start_time
+    window.drain()
+    elapsed_secs = time.perf_counter() - start_time
+
+    scheduled = bucket.taken + bucket.dropped
+    summary = summarize_latencies(latencies, elapsed_secs)
+    service_summary = summarize_latencies(window.latencies, elapsed_secs)
+    summary.update({
+        "target_ops_per_sec": ops_per_sec,
+        "achieved_ops_per_sec": bucket.taken / issued_secs if issued_secs > 0 else 0.0,
+        "burst": burst,
+        "issued": bucket.taken,
+        "dropped": bucket.dropped,
+        "missed_deadlines": missed,
+        "missed_deadline_rate": (missed + bucket.dropped) / scheduled if scheduled else 0.0,
+        "max_backlog": max_backlog,
+        "mean_backlog": backlog_total / bucket.taken if bucket.taken else 0.0,
+        "service_p50_secs": service_summary["p50_secs"],
+        "service_p99_secs": service_summary["p99_secs"],
+        "errors": window.errors,
+    })
+    return summary
+
+
+def find_latency_knee(operation, device, start_ops_per_sec=1000, rate_factor=1.5, max_ops_per_sec=100000, burst=32,
+                      step_secs=5, in_flight_depth=32, deadline_slack_secs=0.001, knee_latency_factor=3.0,
+                      max_missed_deadline_rate=0.01):
+    """
+    Ramp the target rate of the open-loop load step by step, and find the knee of the latency curve: the highest
+    rate before the p99 latency grows past knee_latency_factor times the p99 latency of the first step, more than
+    max_missed_deadline_rate of the operations miss their deadline, or the achieved rate falls short of the target.
+
+    Parameters
+    ----------
+    operation : callable
+        Builds the operation of an index, e.g. from register_operations
+    device : pr.Device
+        The device of the operations
+    start_ops_per_sec : float
+        The target rate of the first step
+    rate_factor : float
+        The factor between the target rates of two steps
+    max_ops_per_sec : float
+        The highest target rate to try
+    burst : int
+        The token bucket size
+    step_secs : float
+        How long to run each step
+    in_flight_depth : int
+        The maximum number of transactions in flight
+    deadline_slack_secs : float
+        How late an operation may be issued without missing its deadline
+    knee_latency_factor : float
+        The growth of the p99 latency over the first step's that marks the knee
+    max_missed_deadline_rate : float
+        The fraction of missed deadlines that marks the knee
+
+    Returns
+    -------
+    The summary of each step, and the knee rate, or None if the first step is already past the knee : dict
+    """
+    if rate_factor <= 1:
+        raise ValueError("Invalid rate factor ({0}). Use a factor greater than 1.".format(rate_factor))
+
+    steps = []
+    knee_ops_per_sec = None
+    baseline_p99_secs = None
+    ops_per_sec = start_ops_per_sec
+
+    logger.info("-- pyrogue: Start the open-loop knee search, from {0:.0f} to {1:.0f} ops/s --"
+                .format(start_ops_per_sec, max_ops_per_sec))
+    while ops_per_sec <= max_ops_per_sec:
+        step = run_open_loop_step(operation, device, ops_per_sec, burst=burst, duration_secs=step_secs,
+                                  in_flight_depth=in_flight_depth, deadline_slack_secs=deadline_slack_secs)
+        baseline_p99_secs = baseline_p99_secs or step["p99_secs"]
+        reasons = []
+        if step["p99_secs"] and baseline_p99_secs and step["p99_secs"] > knee_latency_factor * baseline_p99_secs:
+            reasons.append("p99 latency {0:.1f}x the first step's".format(step["p99_secs"] / baseline_p99_secs))
+        if step["missed_deadline_rate"] > max_missed_deadline_rate:
+            reasons.append("{0:.1%} missed deadlines".format(step["missed_deadline_rate"]))
+        if step["achieved_ops_per_sec"] < 0.95 * ops_per_sec:
+            reasons.append("{0:.0f} ops/s achieved".format(step["achieved_ops_per_sec"]))
+        step["past_knee"] = bool(reasons)
+        steps.append(step)
+
+        logger.info("-- pyrogue: Open loop at {0:.0f} ops/s: {1}, {2:.1%} missed deadlines, backlog max {3} mean "
+                    "{4:.1f}, {5} errors{6}".format(ops_per_sec, format_latency_summary(step),
+                                                    step["missed_deadline_rate"], step["max_backlog"],
+                                                    step["mean_backlog"], step["errors"],
+                                                    " -- past the knee: " + ", ".join(reasons) if reasons else ""))
+        if reasons:
+            break
+        knee_ops_per_sec = ops_per_sec
+        ops_per_sec *= rate_factor
+
+    logger.info("-- pyrogue: End the open-loop knee search. Knee at {0} --"
+                .format("n/a" if knee_ops_per_sec is None else "{0:.0f} ops/s".format(knee_ops_per_sec)))
+    return {
+        "knee_ops_per_sec": knee_ops_per_sec,
+        "errors": sum(step["errors"] for step in steps),
+        "steps": steps,
+    }
+
+
+def save_open_loop_report(report, output_path, **labels):
+    """
+    Append the knee search report to a JSON lines file, one line per search.
+
+    Parameters
+    ----------
+    report : dict
+        The knee search report
+    output_path : str
+        The path of the JSON lines file
+    labels : dict
+        Extra fields to identify the search, e.g. the board IP address
+    """
+    record = dict(labels, timestamp=time.time(), **report)
+    with open(output_path, "a") as output_file:
+        output_file.write(json.dumps(record) + "\n")
+    logger.info("Saved the open-loop knee search to {0}".format(output_path))
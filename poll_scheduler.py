@@ -0,0 +1,253 @@
+# Coalesced polling of the pyrogue variables declared with a pollInterval
+
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from transactions import TransactionWindow
+
+try:
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+# The polled variables of one device, read back with a single transaction
+PollRange = collections.namedtuple("PollRange", ["device", "offset", "size", "variables", "interval_secs"])
+
+
+def variable_span(variable):
+    """
+    Get the byte span of a remote variable, relative to its device, rounded out to 32-bit words.
+
+    Returns
+    -------
+    The first byte offset and the byte size of the variable : tuple
+    """
+    bit_offsets = variable.bitOffset if isinstance(variable.bitOffset, list) else [variable.bitOffset]
+    bit_sizes = variable.bitSize if isinstance(variable.bitSize, list) else [variable.bitSize]
+    end_bit = max(bit_offset + bit_size for bit_offset, bit_size in zip(bit_offsets, bit_sizes))
+    return variable.offset, -(-end_bit // 32) * 4
+
+
+def collect_polled_variables(device):
+    """
+    Collect the remote variables of a device tree that are declared with a pollInterval, grouped by device.
+
+    Returns
+    -------
+    The polled variables of each device, in tree order : OrderedDict
+    """
+    polled_variables = collections.OrderedDict()
+    for variable in device.variables.values():
+        if getattr(variable, "pollInterval", 0) and hasattr(variable, "bitOffset"):
+            polled_variables.setdefault(device, []).append(variable)
+    for child in device.devices.values():
+        polled_variables.update(collect_polled_variables(child))
+    return polled_variables
+
+
+def coalesce_variables(device, variables, max_transaction_size, max_gap_bytes=64):
+    """
+    Group the polled variables of a device into address-contiguous ranges, each read back with one transaction.
+
+    Parameters
+    ----------
+    device : pr.Device
+        The device of the variables
+    variables : list
+        The polled remote variables of the device
+    max_transaction_size : int
+        The maximum size of a transaction, in bytes
+    max_gap_bytes : int
+        The maximum number of unpolled bytes to read between two polled variables of the same range
+
+    Returns
+    -------
+    The ranges, in address order : list of PollRange
+    """
+    ranges = []
+    spans = sorted((variable_span(variable) + (variable,) for variable in variables), key=lambda span: span[0])
+    start, end, range_variables = None, None, []
+    for offset, size, variable in spans:
+        range_end = max(end, offset + size) if range_variables else None
+        if range_variables and offset - end <= max_gap_bytes and range_end - start <= max_transaction_size:
+            end = range_end
+            range_variables.append(variable)
+            continue
+        if range_variables:
+            ranges.append(_make_range(device, start, end, range_variables))
+        start, end, range_variables = offset, offset + size, [variable]
+    if range_variables:
+        ranges.append(_make_range(device, start, end, range_variables))
+    return ranges
+
+
+def _make_range(device, start, end, variables):
+    return PollRange(device, start, end - start, variables,
+                     min(float(variable.pollInterval) for variable in variables))
+
+
+def extract_value(data, range_offset, variable):
+    """
+    Extract the raw unsigned value of a variable from the little-endian bytes of the range it was read back with.
+    """
+    bit_offsets = variable.bitOffset if isinstance(variable.bitOffset, list) else [variable.bitOffset]
+    bit_sizes = variable.bitSize if isinstance(variable.bitSize, list) else [variable.bitSize]
+    words = int.from_bytes(bytes(data), "little") >> ((variable.offset - range_offset) * 8)
+    value, value_bits = 0, 0
+    for bit_offset, bit_size in zip(bit_offsets, bit_sizes):
+        value |= ((words >> bit_offset) & ((1 << bit_size) - 1)) << value_bits
+        value_bits += bit_size
+    return value
+
+
+class PollScheduler:
+    """
+    Poll the variables of a pyrogue tree declared with a pollInterval, in place of the per-variable polling of
+    pyrogue, which issues one transaction per variable alongside the stress traffic.
+
+    The polled variables of each device are coalesced into address-contiguous ranges, each read back with a single
+    raw transaction. A range is due at the shortest pollInterval of its variables, and at most
+    max_transactions_per_sec range reads are issued per second: the ranges that do not fit the budget wait, oldest
+    first, for the next poll cycle. The polling runs in a background thread, and can be paused, e.g. during the
+    measurement windows of the stress activities.
+
+    The scheduler only shapes the polling traffic. The values read back are kept as raw unsigned ints, by variable
+    path, in the values attribute, and are not pushed into the variables: the polled variables of the tree, e.g. the
+    RSSI counters and AxiVersion.UpTimeCnt, stop updating. The pyrogue Root has to be started with pollEn=False, so
+    that pyrogue does not poll the same variables again.
+    """
+    def __init__(self, root, max_transactions_per_sec=20, max_gap_bytes=64, cycle_secs=0.1):
+        """
+        Parameters
+        ----------
+        root : pr.Root
+            The pyrogue Root of the tree to poll
+        max_transactions_per_sec : float
+            The budget of range reads per second
+        max_gap_bytes : int
+            The maximum number of unpolled bytes to read between two polled variables of the same range
+        cycle_secs : float
+            The time between two poll cycles
+        """
+        self.max_transactions_per_sec = max_transactions_per_sec
+        self.cycle_secs = cycle_secs
+        self.ranges = []
+        self._windows = {}
+        for device, variables in collect_polled_variables(root).items():
+            self._windows[device] = TransactionWindow(device, depth=8)
+            self.ranges.extend(coalesce_variables(device, variables, device._reqMaxAccess(),
+                                                  max_gap_bytes=max_gap_bytes))
+        self.values = {}
+        self.transactions = 0
+        self.deferred = 0
+        self.errors = 0
+        self._last_read_times = [float("-inf")] * len(self.ranges)
+        self._tokens = float(max_transactions_per_sec)
+        self._cycle_lock = threading.Lock()
+        self._is_paused = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        variable_count = sum(len(poll_range.variables) for poll_range in self.ranges)
+        logger.info("Coalesced {0} polled variables into {1} range reads, with a budget of {2} reads per second"
+                    .format(variable_count, len(self.ranges), max_transactions_per_sec))
+        logger.warning("The coalesced polling does not update the polled variables of the pyrogue tree")
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), name="poll-scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def pause(self):
+        """
+        Pause the polling, waiting for the poll cycle in progress to finish.
+        """
+        self._is_paused.set()
+        with self._cycle_lock:
+            pass
+
+    def resume(self):
+        self._is_paused.clear()
+
+    @contextlib.contextmanager
+    def paused(self):
+        """
+        Pause the polling for the duration of a with block, e.g. a measurement window.
+        """
+        self.pause()
+        try:
+            yield
+        finally:
+            self.resume()
+
+    def poll_once(self, now=None):
+        """
+        Read back the ranges that are due, within the transaction budget.
+
+        Returns
+        -------
+        The number of ranges read back : int
+        """
+        now = time.monotonic() if now is None else now
+        due_indices = sorted((i for i, poll_range in enumerate(self.ranges)
+                              if now - self._last_read_times[i] >= poll_range.interval_secs),
+                             key=lambda i: self._last_read_times[i])
+        read_count = min(len(due_indices), int(self._tokens))
+        self.deferred += len(due_indices) - read_count
+        self._tokens -= read_count
+
+        errors = {device: window.errors for device, window in self._windows.items()}
+        reads = []
+        for i in due_indices[:read_count]:
+            poll_range = self.ranges[i]
+            data = bytearray(poll_range.size)
+            self._windows[poll_range.device].submit(poll_range.offset, data, rim.Read, operation="poll_read")
+            self._last_read_times[i] = now
+            reads.append((poll_range, data))
+        for window in self._windows.values():
+            window.drain()
+
+        # Keep the previous values of the devices with failed reads, as their read errors are not told apart
+        failed_devices = set(device for device, window in self._windows.items() if window.errors != errors[device])
+        for device in failed_devices:
+            self.errors += self._windows[device].errors - errors[device]
+            logger.debug("Polling {0} failed with {1} transaction errors"
+                         .format(device.path, self._windows[device].errors - errors[device]))
+        for poll_range, data in reads:
+            if poll_range.device not in failed_devices:
+                for variable in poll_range.variables:
+                    self.values[variable.path] = extract_value(data, poll_range.offset, variable)
+        self.transactions += read_count
+        return read_count
+
+    def _run(self):
+        last_time = time.monotonic()
+        while not self._stopping.wait(self.cycle_secs):
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - last_time) * self.max_transactions_per_sec,
+                               float(self.max_transactions_per_sec))
+            last_time = now
+            if self._is_paused.is_set():
+                continue
+            with self._cycle_lock:
+                if self._is_paused.is_set():
+                    continue
+                try:
+                    self.poll_once(now)
+                except Exception as error:
+                    self.errors += 1
+                    logger.debug("Poll cycle failed: {0}".format(error))
@@ -0,0 +1,261 @@
+# Line-rate switch stress with the firmware PRBS generator and checker
+
+import json
+import struct
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import summarize_values
+from transactions import TransactionWindow
+
+try:
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+# The SsiPrbsRx counters, as (offset, names of the consecutive 32-bit words from the offset), each range sampled with
+# a single raw read
+PRBS_RX_COUNTER_RANGES = (
+    (0x000, ("MissedPacketCnt", "LengthErrCnt", "EofeErrCnt", "DataBusErrCnt", "WordStrbErrCnt", "BitStrbErrCnt",
+             "RxFifoOverflowCnt", "RxFifoPauseCnt", "TxFifoOverflowCnt", "TxFifoPauseCnt")),
+    (0x1C0, ("Status", "PacketLength", "PacketRateRaw", "BitErrCnt", "WordErrCnt")),
+)
+
+# The counters that fail a step if they count anything. The bit errors are judged by the bit error rate instead.
+PRBS_ERROR_COUNTERS = ("MissedPacketCnt", "LengthErrCnt", "EofeErrCnt", "DataBusErrCnt", "WordStrbErrCnt",
+                       "BitStrbErrCnt", "RxFifoOverflowCnt", "WordErrCnt")
+
+# The counters that are not accumulated, but reported as sampled
+PRBS_GAUGES = ("Status", "PacketLength", "PacketRateRaw")
+
+
+def sample_prbs_counters(window):
+    """
+    Read the SsiPrbsRx counters, with one raw read per counter range.
+
+    Parameters
+    ----------
+    window : TransactionWindow
+        The transaction window of the SsiPrbsRx device
+
+    Returns
+    -------
+    The value of each counter : dict
+    """
+    buffers = []
+    for offset, names in PRBS_RX_COUNTER_RANGES:
+        buffers.append(bytearray(4 * len(names)))
+        window.submit(offset, buffers[-1], rim.Read, operation="prbs_sample")
+    errors = window.errors
+    window.drain()
+    if window.errors != errors:
+        raise RuntimeError("Reading the PRBS checker counters failed with {0} transaction errors"
+                           .format(window.errors - errors))
+
+    counters = {}
+    for (_, names), data in zip(PRBS_RX_COUNTER_RANGES, buffers):
+        counters.update(zip(names, struct.unpack("<{0}I".format(len(names)), data)))
+    return counters
+
+
+def accumulate_counters(totals, previous, current):
+    """
+    Add the increments of the 32-bit counters between two samples to running totals, so that the totals survive the
+    counter rollovers.
+    """
+    for name, value in current.items():
+        if name not in PRBS_GAUGES:
+            totals[name] = totals.get(name, 0) + ((value - previous.get(name, 0)) & 0xFFFFFFFF)
+
+
+def bit_error_rate(bit_errors, bits_checked):
+    """
+    Get the bit error rate, and its upper bound at a 95% confidence level.
+
+    With no bit errors, the upper bound is 3 / bits_checked (the "rule of three"), e.g. 3e-12 after 1e12 error-free
+    bits. With bit errors, it is the measured rate.
+
+    Returns
+    -------
+    The bit error rate and its upper bound, or None if no bits were checked : tuple
+    """
+    if not bits_checked:
+        return None, None
+    rate = bit_errors / bits_checked
+    return rate, rate if bit_errors else 3.0 / bits_checked
+
+
+def run_prbs_step(rx, generator, packet_length, period=None, step_secs=10, sample_interval_secs=0.01,
+                  rx_clk_period_secs=6.4e-9):
+    """
+    Run the PRBS traffic at one packet length and rate, sampling the checker counters while it runs.
+
+    Parameters
+    ----------
+    rx : pr.Device
+        The SsiPrbsRx checker
+    generator : pr.Device
+        The SsiPrbsRateGen or SsiPrbsTx generator
+    packet_length : int
+        The packet length, in words of the PRBS word size
+    period : int
+        The SsiPrbsRateGen period between two packets, in clock cycles, or None with an SsiPrbsTx generator
+    step_secs : float
+        How long to run the traffic
+    sample_interval_secs : float
+        The time between two samples of the checker counters
+    rx_clk_period_secs : float
+        The clock period of the checker, to convert PacketRateRaw into a packet rate
+
+    Returns
+    -------
+    The step report: the traffic settings, the counter totals, the bits checked, the bit error rate, and the sampled
+    bit rate : dict
+    """
+    word_bits = int(rx.WordSize.get()) or 32
+    window = TransactionWindow(rx, depth=len(PRBS_RX_COUNTER_RANGES))
+
+    generator.TxEn.set(False)
+    generator.PacketLength.set(packet_length)
+    if period is not None:
+        generator.Period.set(period)
+        generator.StatReset()
+    rx.CountReset()
+
+    # The SsiPrbsTx generator has no counter reset, so count the packets sent from a sample taken before the traffic
+    packet_counter = generator.FrameCount if period is not None else generator.EventCount
+    first_packet_count = int(packet_counter.get())
+    previous = sample_prbs_counters(window)
+    totals = {}
+    bit_rates_mbps = []
+    start_time = time.perf_counter()
+    generator.TxEn.set(True)
+    while time.perf_counter() - start_time < step_secs:
+        time.sleep(sample_interval_secs)
+        counters = sample_prbs_counters(window)
+        accumulate_counters(totals, previous, counters)
+        previous = counters
+        if counters["PacketRateRaw"] and counters["PacketLength"]:
+            bit_rates_mbps.append(counters["PacketLength"] * word_bits
+                                  / ((counters["PacketRateRaw"] + 1) * rx_clk_period_secs) / 1e6)
+    generator.TxEn.set(False)
+    elapsed_secs = time.perf_counter() - start_time
+
+    # Let the packets in flight through the switch reach the checker
+    time.sleep(max(sample_interval_secs, 0.1))
+    accumulate_counters(totals, previous, sample_prbs_counters(window))
+
+    packets_sent = (int(packet_counter.get()) - first_packet_count) & 0xFFFFFFFF
+    packets_checked = max(packets_sent - totals["MissedPacketCnt"], 0)
+    bits_checked = packets_checked * packet_length * word_bits
+    rate, rate_upper_bound = bit_error_rate(totals["BitErrCnt"], bits_checked)
+
+    return {
+        "packet_length": packet_length,
+        "period": period,
+        "elapsed_secs": elapsed_secs,
+        "word_bits": word_bits,
+        "packets_sent": packets_sent,
+        "bits_checked": bits_checked,
+        "bit_errors": totals["BitErrCnt"],
+        "bit_error_rate": rate,
+        "bit_error_rate_upper_bound": rate_upper_bound,
+        "counters": totals,
+        "samples": len(bit_rates_mbps),
+        "bit_rate_mbps": summarize_values(bit_rates_mbps),
+    }
+
+
+def run_prbs_line_rate_test(rx, generator, packet_lengths=(256, 1024, 4096), periods=(None,), step_secs=10,
+                            sample_interval_secs=0.01, max_bit_error_rate=1e-12, rx_clk_period_secs=6.4e-9):
+    """
+    Stress the switch at line rate: ramp the packet rate and size of the firmware PRBS generator, while the firmware
+    PRBS checker counts the packets missed and the bit errors, e.g. of a generator on the other side of the switch.
+    The host only configures the generator and samples the checker counters, so that the traffic is not limited by
+    the host.
+
+    Parameters
+    ----------
+    rx : pr.Device
+        The SsiPrbsRx checker
+    generator : pr.Device
+        The SsiPrbsRateGen or SsiPrbsTx generator
+    packet_lengths : list
+        The packet lengths to ramp through, in words of the PRBS word size
+    periods : list
+        The SsiPrbsRateGen periods between two packets to ramp through, in clock cycles, from the slowest rate to the
+        fastest. Use [None] with an SsiPrbsTx generator, which always runs at its maximum rate.
+    step_secs : float
+        How long to run each packet length and period
+    sample_interval_secs : float
+        The time between two samples of the checker counters
+    max_bit_error_rate : float
+        The highest bit error rate of a passing step
+    rx_clk_period_secs : float
+        The clock period of the checker
+
+    Returns
+    -------
+    The line-rate test report, with the report of each step, and whether all the steps passed : dict
+    """
+    steps = []
+    logger.info("-- pyrogue: Start the PRBS line-rate test, {0} packet lengths x {1} rates, {2} seconds each --"
+                .format(len(packet_lengths), len(periods), step_secs))
+
+    for packet_length in packet_lengths:
+        for period in periods:
+            step = run_prbs_step(rx, generator, packet_length, period=period, step_secs=step_secs,
+                                 sample_interval_secs=sample_interval_secs, rx_clk_period_secs=rx_clk_period_secs)
+            failed_counters = [name for name in PRBS_ERROR_COUNTERS if step["counters"].get(name)]
+            step["passed"] = bool(step["bits_checked"]) and not failed_counters \
+                and step["bit_error_rate"] <= max_bit_error_rate
+            steps.append(step)
+
+            logger.info("-- pyrogue: PRBS {0}-word packets, period {1}: {2} packets, {3:.1f} Mb/s p50, {4} bit errors "
+                        "in {5:.3g} bits, BER {6:.3g} (< {7:.3g} at 95% CL) -- {8}"
+                        .format(packet_length, period, step["packets_sent"], step["bit_rate_mbps"]["p50"] or 0.0,
+                                step["bit_errors"], step["bits_checked"], step["bit_error_rate"] or 0.0,
+                                step["bit_error_rate_upper_bound"] or 0.0, "PASS" if step["passed"] else "FAIL"))
+            if failed_counters:
+                logger.error("-- pyrogue: PRBS checker errors: {0}"
+                             .format(", ".join("{0}={1}".format(name, step["counters"][name])
+                                               for name in failed_counters)))
+
+    bits_checked = sum(step["bits_checked"] for step in steps)
+    bit_errors = sum(step["bit_errors"] for step in steps)
+    rate, rate_upper_bound = bit_error_rate(bit_errors, bits_checked)
+    report = {
+        "passed": all(step["passed"] for step in steps),
+        "bits_checked": bits_checked,
+        "bit_errors": bit_errors,
+        "bit_error_rate": rate,
+        "bit_error_rate_upper_bound": rate_upper_bound,
+        "max_bit_error_rate": max_bit_error_rate,
+        "steps": steps,
+    }
+    logger.info("-- pyrogue: End the PRBS line-rate test. {0}: {1} bit errors in {2:.3g} bits, BER upper bound {3:.3g} "
+                "--".format("PASS" if report["passed"] else "FAIL", bit_errors, bits_checked,
+                            rate_upper_bound or 0.0))
+    return report
+
+
+def save_prbs_report(report, output_path, **labels):
+    """
+    Append the line-rate test report to a JSON lines file, one line per test run.
+
+    Parameters
+    ----------
+    report : dict
+        The line-rate test report
+    output_path : str
+        The path of the JSON lines file
+    labels : dict
+        Extra fields to identify the run, e.g. the board IP address
+    """
+    record = dict(labels, timestamp=time.time(), **report)
+    with open(output_path, "a") as output_file:
+        output_file.write(json.dumps(record) + "\n")
+    logger.info("Saved the PRBS line-rate report to {0}".format(output_path))
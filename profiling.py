@@ -0,0 +1,256 @@
+# Startup profiling: import-time breakdown and cold-start benchmark of the test
+
+import argparse
+import collections
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+from metrics import summarize_values
+
+
+# A line of the -X importtime report: "import time: <self us> | <cumulative us> | <indented module name>"
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$")
+
+# The directory of the test scripts, where the imports are run from
+TEST_DIR_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# The statements importing the test and each of its backends, as loaded by main.py
+STARTUP_IMPORTS = collections.OrderedDict([
+    ("main", "import main"),
+    ("pyrogue", "import pyrogue, FpgaTopLevel, pyrogue_stress, ddr_benchmark, ddr_integrity"),
+    ("cpsw", "import pycpsw"),
+])
+
+DEFAULT_COLD_START_CMD = [sys.executable, os.path.join(TEST_DIR_PATH, "main.py"), "--version"]
+
+
+def measure_import_times(statement):
+    """
+    Run an import statement in a fresh interpreter, and collect the time taken to import each module.
+
+    Parameters
+    ----------
+    statement : str
+        The Python statement to run, e.g. "import pyrogue"
+
+    Returns
+    -------
+    The import time of each module, as (module name, self microseconds, cumulative microseconds, nesting level)
+    tuples in import order : list
+
+    Raises ImportError
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, cwd=TEST_DIR_PATH)
+    import_times = []
+    other_lines = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            import_times.append((match.group(4), int(match.group(1)), int(match.group(2)),
+                                 (len(match.group(3)) - 1) // 2))
+        elif not line.startswith("import time:"):
+            other_lines.append(line)
+
+    if result.returncode:
+        raise ImportError("'{0}' failed: {1}".format(statement, "\n".join(other_lines[-3:])))
+    return import_times
+
+
+def summarize_import_times(import_times):
+    """
+    Sum the import times by top-level package.
+
+    Returns
+    -------
+    The self import time of each top-level package in microseconds, and the total, in descending order : tuple
+    """
+    package_times = collections.Counter()
+    for module_name, self_us, _, _ in import_times:
+        package_times[module_name.split(".")[0]] += self_us
+    return package_times.most_common(), sum(package_times.values())
+
+
+def profile_startup(statements=STARTUP_IMPORTS, top_count=15):
+    """
+    Log the import-time breakdown of the test and of each of its backends, by top-level package.
+
+    Parameters
+    ----------
+    statements : dict
+        The import statement of each part of the test to profile
+    top_count : int
+        The number of slowest packages to list for each part
+    """
+    for name, statement in statements.items():
+        try:
+            package_times, total_us = summarize_import_times(measure_import_times(statement))
+        except ImportError as error:
+            logger.info("{0}: cannot be imported. {1}".format(name, error))
+            continue
+
+        logger.info("{0}: {1:.1f} ms to import".format(name, total_us / 1000))
+        for package_name, self_us in package_times[:top_count]:
+            logger.info("    {0:>9.1f} ms  {1:5.1f}%  {2}".format(self_us / 1000, 100.0 * self_us / total_us,
+                                                                  package_name))
+
+
+def benchmark_cold_start(cmd=DEFAULT_COLD_START_CMD, runs=10):
+    """
+    Run a command in a fresh interpreter several times, and measure its wall-clock time.
+
+    Returns
+    -------
+    The run count, and the min, p50, p99 and max times in seconds : dict
+    """
+    elapsed_secs = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed_secs.append(time.perf_counter() - start_time)
+    return summarize_values(elapsed_secs)
+
+
+def compare_to_baseline(summary, baseline_path, threshold=0.2):
+    """
+    Compare a cold-start benchmark to a saved baseline. The baseline is saved instead if there is none yet.
+
+    Parameters
+    ----------
+    summary : dict
+        The cold-start benchmark summary
+    baseline_path : str
+        The JSON file holding the baseline summary
+    threshold : float
+        The fraction by which the p50 time may exceed the baseline's
+
+    Returns
+    -------
+    True if there is no regression; False if not : bool
+    """
+    if not os.path.exists(baseline_path):
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(summary, baseline_file, indent=2)
+        logger.info("Saved the cold-start baseline to {0}".format(baseline_path))
+        return True
+
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    limit_secs = baseline["p50"] * (1 + threshold)
+    if summary["p50"] > limit_secs:
+        logger.error("Cold start REGRESSED: p50 {0:.3f} s, over {1:.3f} s (baseline p50 {2:.3f} s + {3:.0%})"
+                     .format(summary["p50"], limit_secs, baseline["p50"], threshold))
+        return False
+    logger.info("Cold start OK: p50 {0:.3f} s, baseline p50 {1:.3f} s".format(summary["p50"], baseline["p50"]))
+    return True
+
+
+def _count_tree_nodes(device):
+    """
+    Count the devices and the variables of a pyrogue device tree.
+
+    Returns
+    -------
+    The device count and the variable count : tuple
+    """
+    device_count, variable_count = 1, len(device.variables)
+    for child in device.devices.values():
+        child_device_count, child_variable_count = _count_tree_nodes(child)
+        device_count += child_device_count
+        variable_count += child_variable_count
+    return device_count, variable_count
+
+
+def benchmark_tree_build(devices=None, exclude_devices=(), runs=3):
+    """
+    Build the FpgaTopLevel device tree of the test several times, on a simulated memory interface, and measure the
+    build time and the memory the tree holds. pyrogue is imported beforehand, so that only the build is measured.
+
+    Parameters
+    ----------
+    devices : list
+        The names of the devices to build, or None to build all of them
+    exclude_devices : list
+        The names of the devices not to build
+    runs : int
+        The number of trees to build
+
+    Returns
+    -------
+    The build time summary in seconds, the memory held by a tree and the peak memory while building it in bytes, and
+    the device and variable counts of the tree : dict
+    """
+    import pyrogue as pr
+    from FpgaTopLevel import FpgaTopLevel
+
+    elapsed_secs = []
+    tracemalloc.start()
+    try:
+        for _ in range(runs):
+            tracemalloc.clear_traces()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            start_time = time.perf_counter()
+            root = pr.Root(name='AMCc', description='')
+            root.add(FpgaTopLevel(simGui=True, devices=devices, excludeDevices=exclude_devices))
+            elapsed_secs.append(time.perf_counter() - start_time)
+            held_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            device_count, variable_count = _count_tree_nodes(root)
+            del root
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "build_secs": summarize_values(elapsed_secs),
+        "held_bytes": held_bytes,
+        "peak_bytes": peak_bytes,
+        "devices": device_count,
+        "variables": variable_count,
+    }
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Profile the startup of the test.")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Benchmark the cold start of 'main.py --version' instead of profiling the imports.")
+    parser.add_argument("--tree-build", action="store_true",
+                        help="Benchmark the build time and memory of the FpgaTopLevel device tree instead.")
+    parser.add_argument("--devices", nargs="*", default=None,
+                        help="The names of the devices of the device tree to build. Defaults to all of them.")
+    parser.add_argument("--exclude-devices", nargs="*", default=(),
+                        help="The names of the devices of the device tree not to build.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--baseline", help="The JSON file to compare the cold-start benchmark to, or to save it to.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="The allowed fractional increase of the p50 cold-start time over the baseline.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+
+    if args.tree_build:
+        results = benchmark_tree_build(devices=args.devices, exclude_devices=tuple(args.exclude_devices),
+                                       runs=args.runs)
+        logger.info("Device tree of {0} devices and {1} variables: built in min/p50/max {2:.3f}/{3:.3f}/{4:.3f} s, "
+                    "holding {5:.1f} MB (peak {6:.1f} MB)"
+                    .format(results["devices"], results["variables"], results["build_secs"]["min"],
+                            results["build_secs"]["p50"], results["build_secs"]["max"], results["held_bytes"] / 1e6,
+                            results["peak_bytes"] / 1e6))
+    elif args.benchmark:
+        summary = benchmark_cold_start(runs=args.runs)
+        logger.info("Cold start over {0} runs: min/p50/max {1:.3f}/{2:.3f}/{3:.3f} s"
+                    .format(summary["count"], summary["min"], summary["p50"], summary["max"]))
+        if args.baseline and not compare_to_baseline(summary, args.baseline, threshold=args.threshold):
+            sys.exit(1)
+    else:
+        profile_startup()
@@ -0,0 +1,204 @@
+# A persistent pyrogue connection to a board, surviving the board power cycles of the test
+
+import csv
+import os
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import record_metric, record_latency
+
+
+class PyrogueConnection:
+    """
+    Keep one pyrogue Root, with its whole device tree, across the test iterations.
+
+    The tree is built once, on the first connection, or ahead of it with build(), e.g. while the board boots. While the
+    board is power cycled, the connection is suspended: the polling is paused and the RSSI link of the interleaved
+    UdpRssiPack is stopped, but the tree is kept. On the next connection, the RSSI link is restarted and probed with a
+    register read, retrying with a bounded exponential backoff until the board answers.
+
+    The time from the start of each connection to the first successful register read is recorded as the
+    "time_to_first_transaction_secs" metric, and optionally appended to a CSV trend file. It measures how fast the
+    switch and the board's port recover from the power cycle.
+
+    With a poller_factory, the Root is started without the pyrogue polling, and the poller built from it, e.g. a
+    PollScheduler, polls the variables instead.
+    """
+    def __init__(self, board_ip_address, root_factory, initial_backoff_secs=0.1, max_backoff_secs=5.0,
+                 connect_timeout_secs=120, trend_path=None, poller_factory=None):
+        """
+        Parameters
+        ----------
+        board_ip_address : str
+            The IP address of the board
+        root_factory : callable
+            Called as root_factory(board_ip_address) to build the pyrogue Root, with an FpgaTopLevel device
+        initial_backoff_secs : float
+            The delay before the first connection retry
+        max_backoff_secs : float
+            The maximum delay between two connection retries
+        connect_timeout_secs : float
+            How long to retry before giving up on a connection
+        trend_path : str
+            The CSV file to append the time to first transaction of every connection to, or None
+        poller_factory : callable
+            Called as poller_factory(root) to build the poller of the variables, with start, stop, pause and resume
+            methods, or None to use the pyrogue polling
+        """
+        self.board_ip_address = board_ip_address
+        self.root_factory = root_factory
+        self.initial_backoff_secs = initial_backoff_secs
+        self.max_backoff_secs = max_backoff_secs
+        self.connect_timeout_secs = connect_timeout_secs
+        self.trend_path = trend_path
+        self.poller_factory = poller_factory
+        self.root = None
+        self.poller = None
+        self._is_started = False
+        self._is_suspended = False
+
+    @property
+    def stream(self):
+        return self.root.FpgaTopLevel.stream
+
+    def build(self):
+        """
+        Build the pyrogue Root, without starting it, e.g. while the board is still booting. The first connection
+        builds it otherwise.
+
+        Returns
+        -------
+        The pyrogue Root : pr.Root
+        """
+        if self.root is None:
+            logger.info("Creating a new base...")
+            self.root = self.root_factory(self.board_ip_address)
+        return self.root
+
+    def connect(self):
+        """
+        Build the pyrogue Root on first use, or resume the suspended RSSI link, and wait for the first successful
+        register read.
+
+        Returns
+        -------
+        The pyrogue Root : pr.Root
+
+        Raises RuntimeError
+        """
+        start_time = time.time()
+        if not self._is_started:
+            self.build()
+            self.root.start(pollEn=self.poller_factory is None)
+            self._is_started = True
+            attempts = self._wait_for_first_transaction(start_time, restart_link=False)
+            if self.poller_factory:
+                self.poller = self.poller_factory(self.root)
+                self.poller.start()
+        else:
+            logger.info("Reconnecting the existing base...")
+            attempts = self._wait_for_first_transaction(start_time, restart_link=self._is_suspended)
+
+        self._is_suspended = False
+        self._set_polling(True)
+
+        elapsed_secs = time.time() - start_time
+        record_metric("time_to_first_transaction_secs", elapsed_secs)
+        record_latency("reconnect", elapsed_secs)
+        logger.info("The first transaction with the board succeeded {0:.2f} seconds after connecting, after {1} "
+                    "attempts.".format(elapsed_secs, attempts))
+        if self.trend_path:
+            self._append_trend(start_time, elapsed_secs, attempts)
+        return self.root
+
+    def _wait_for_first_transaction(self, start_time, restart_link):
+        """
+        Restart the RSSI link if needed, and retry a register read with a bounded exponential backoff until it
+        succeeds.
+
+        Returns
+        -------
+        The number of attempts : int
+        """
+        backoff_secs = self.initial_backoff_secs
+        attempts = 0
+        while True:
+            attempts += 1
+            if restart_link:
+                self.stream.start()
+
+            try:
+                self.root.FpgaTopLevel.AmcCarrierCore.AxiVersion.ScratchPad.get()
+                return attempts
+            except Exception as error:
+                elapsed_secs = time.time() - start_time
+                if elapsed_secs + backoff_secs > self.connect_timeout_secs:
+                    raise RuntimeError("Cannot reach the board at {0} after {1} attempts over {2:.1f} seconds: {3}"
+                                       .format(self.board_ip_address, attempts, elapsed_secs, error))
+                logger.debug("The board at {0} is not answering yet ({1}). Retrying in {2:.2f} seconds."
+                             .format(self.board_ip_address, error, backoff_secs))
+
+            # Reset the link before the next attempt
+            self.stream.stop()
+            restart_link = True
+            time.sleep(backoff_secs)
+            backoff_secs = min(backoff_secs * 2, self.max_backoff_secs)
+
+    def pause_polling(self):
+        """
+        Pause the polling until the next connection, e.g. for the measurement windows of the stress activities.
+        """
+        if self._is_started:
+            self._set_polling(False)
+
+    def suspend(self):
+        """
+        Pause the polling and stop the RSSI link while the board is power cycled, keeping the device tree.
+        """
+        if not self._is_started or self._is_suspended:
+            return
+        self._set_polling(False)
+        logger.debug("Stopping stream")
+        self.stream.stop()
+        self._is_suspended = True
+
+    def close(self):
+        """
+        Stop the pyrogue Root for good.
+        """
+        if self.root is None:
+            return
+        if self.poller:
+            self.poller.stop()
+            self.poller = None
+        if self._is_started:
+            logger.debug("Stopping base")
+            self.root.stop()
+        if not self._is_suspended:
+            logger.debug("Stopping stream")
+            self.stream.stop()
+        self.root = None
+        self._is_started = False
+
+    def _set_polling(self, enabled):
+        if self.poller:
+            if enabled:
+                self.poller.resume()
+            else:
+                self.poller.pause()
+            return
+
+        # The PollEn variable of pyrogue Roots, where available
+        poll_enable = getattr(self.root, "PollEn", None)
+        if poll_enable is not None:
+            poll_enable.set(enabled)
+
+    def _append_trend(self, start_time, elapsed_secs, attempts):
+        is_new_file = not os.path.exists(self.trend_path)
+        with open(self.trend_path, "a") as trend_file:
+            writer = csv.writer(trend_file)
+            if is_new_file:
+                writer.writerow(["timestamp", "board_ip_address", "time_to_first_transaction_secs", "attempts"])
+            writer.writerow([round(start_time, 3), self.board_ip_address, round(elapsed_secs, 3), attempts])
@@ -0,0 +1,71 @@
+# Pipelined pyrogue stress engines
+
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import summarize_latencies, format_latency_summary
+from transactions import TransactionWindow, pack_word, unpack_word
+
+try:
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+def run_pipelined_scratchpad_stress(axi_version, write_value_count=20000, in_flight_depth=32):
+    """
+    Write values to the ScratchPad register and read each one back, keeping several SRPv3 transactions in flight
+    instead of waiting for each one to complete.
+
+    Parameters
+    ----------
+    axi_version : pr.Device
+        The AxiVersion device holding the ScratchPad register
+    write_value_count : int
+        The number of values to write and verify
+    in_flight_depth : int
+        The maximum number of SRPv3 transactions in flight
+
+    Returns
+    -------
+    The latency summary of the write and read transactions : dict
+
+    Raises RuntimeError
+    """
+    scratch_pad_offset = axi_version.ScratchPad.offset
+    window = TransactionWindow(axi_version, depth=in_flight_depth)
+    mismatches = []
+
+    def _verify(transaction, error, expected):
+        if error:
+            logger.error("-- pyrogue: ScratchPad read-back of value {0} failed: {1}".format(expected, error))
+            return
+        value = unpack_word(transaction.data)
+        if value != expected:
+            mismatches.append((expected, value))
+            logger.error("-- pyrogue: ScratchPad read-back mismatch. Expected: {0}, read: {1}".format(expected, value))
+
+    logger.info("-- pyrogue: Start pipelined writing to and reading values from the board, {0} transactions in flight "
+                "--".format(in_flight_depth))
+
+    start_time = time.perf_counter()
+    for i in range(write_value_count):
+        window.submit(scratch_pad_offset, pack_word(i), rim.Write, operation="register_write")
+        window.submit(scratch_pad_offset, bytearray(4), rim.Read,
+                      on_complete=lambda transaction, error, expected=i: _verify(transaction, error, expected),
+                      operation="register_read")
+    window.drain()
+    elapsed_secs = time.perf_counter() - start_time
+
+    summary = summarize_latencies(window.latencies, elapsed_secs)
+    summary["errors"] = window.errors
+    summary["mismatches"] = len(mismatches)
+    logger.info("-- pyrogue: ScratchPad stress: {0}, {1} errors, {2} mismatches"
+                .format(format_latency_summary(summary), window.errors, len(mismatches)))
+
+    if window.errors or mismatches:
+        raise RuntimeError("ScratchPad stress failed with {0} transaction errors and {1} read-back mismatches"
+                           .format(window.errors, len(mismatches)))
+    return summary
@@ -0,0 +1,39 @@
+# The RSSI (Reliable SSI) headers, as exchanged with the RSSI servers of an FPGA board over UDP
+
+import struct
+
+
+# RSSI header flags
+RSSI_SYN = 0x80
+RSSI_ACK = 0x40
+RSSI_RST = 0x10
+RSSI_NUL = 0x08
+RSSI_BUSY = 0x01
+
+RSSI_HEADER_SIZE = 8
+RSSI_SYN_HEADER_SIZE = 24
+
+
+def rssi_checksum(header):
+    """
+    The 16-bit ones' complement checksum of an RSSI header, over all its 16-bit words but the checksum itself.
+    """
+    total = sum(struct.unpack(">{0}H".format((len(header) - 2) // 2), bytes(header[:-2])))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def pack_rssi_header(flags, sequence, acknowledge, syn_parameters=b""):
+    """
+    Build an RSSI header. SYN headers carry the 16 bytes of the connection parameters.
+    """
+    header = bytearray(RSSI_SYN_HEADER_SIZE if flags & RSSI_SYN else RSSI_HEADER_SIZE)
+    header[0] = flags
+    header[1] = len(header)
+    header[2] = sequence & 0xFF
+    header[3] = acknowledge & 0xFF
+    if flags & RSSI_SYN:
+        header[4:22] = syn_parameters[:18].ljust(18, b"\0")
+    struct.pack_into(">H", header, len(header) - 2, rssi_checksum(header))
+    return header
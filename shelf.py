@@ -0,0 +1,164 @@
+# Running the board test concurrently on several boards of an ATCA shelf
+
+import multiprocessing
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from switchtest_logging import logging, log_formatter, console_handler, LOG_FORMAT, BoardFilter, BoardFormatter
+logger = logging.getLogger(__name__)
+
+
+ACTIVATION_SCHEDULES = ("simultaneous", "staggered")
+
+
+class ActivationScheduler:
+    """
+    Coordinate the board activations across the board test processes of a shelf.
+
+    Every board waits for all the others to be ready before activating. With the "simultaneous" schedule, all the
+    boards then activate at once. With the "staggered" schedule, each board then waits for its turn, stagger_secs apart
+    in slot order.
+
+    If a board test ends early, the scheduler stops synchronizing, and the remaining boards activate on their own
+    schedule so that they never wait for a board that will not come.
+    """
+    def __init__(self, board_count, schedule="simultaneous", stagger_secs=5, sync_timeout_secs=900):
+        """
+        Parameters
+        ----------
+        board_count : int
+            The number of boards taking part in the test
+        schedule : str
+            "simultaneous" or "staggered"
+        stagger_secs : int
+            The delay between two consecutive board activations in the "staggered" schedule
+        sync_timeout_secs : int
+            The maximum time to wait for the other boards to be ready to activate
+        """
+        if schedule not in ACTIVATION_SCHEDULES:
+            raise ValueError("Invalid activation schedule ({0}). Choose one of {1}."
+                             .format(schedule, ", ".join(ACTIVATION_SCHEDULES)))
+
+        self.schedule = schedule
+        self.stagger_secs = stagger_secs
+        self.sync_timeout_secs = sync_timeout_secs
+        self._barrier = multiprocessing.Barrier(board_count)
+
+    def wait_for_activation_turn(self, board_index):
+        """
+        Block until it is this board's turn to be activated.
+
+        Parameters
+        ----------
+        board_index : int
+            The position of the board in the shelf configuration
+        """
+        try:
+            self._barrier.wait(timeout=self.sync_timeout_secs)
+        except threading.BrokenBarrierError:
+            logger.warning("Board activations are no longer synchronized across the shelf.")
+            return
+
+        if self.schedule == "staggered" and board_index:
+            time.sleep(board_index * self.stagger_secs)
+
+    def leave(self):
+        """
+        Stop synchronizing the board activations, e.g. when a board test has ended.
+        """
+        self._barrier.abort()
+
+
+def setup_board_logging(log_dir_path, board_name):
+    """
+    Send the logs of a board test process to its own rotating log file, and tag its console output.
+
+    Parameters
+    ----------
+    log_dir_path : str
+        The directory to save the log file into
+    board_name : str
+        The name of the board, used to name the log file and tag the console output
+    """
+    global_logger = logging.getLogger()
+    for handler in list(global_logger.handlers):
+        if isinstance(handler, RotatingFileHandler):
+            global_logger.removeHandler(handler)
+
+    rotating_log_handler = RotatingFileHandler(os.path.join(log_dir_path, "switch-test-{0}.log".format(board_name)),
+                                               maxBytes=2000000, backupCount=60)
+    rotating_log_handler.setFormatter(log_formatter)
+    global_logger.addHandler(rotating_log_handler)
+
+    console_handler.setFormatter(logging.Formatter("[{0}] %(message)s".format(board_name)))
+
+
+def setup_shelf_logging(log_dir_path, board_names):
+    """
+    Tag the logs of the boards tested from this process with their board names, and also send the logs of each board
+    to its own rotating log file.
+
+    Parameters
+    ----------
+    log_dir_path : str
+        The directory to save the log files into
+    board_names : list
+        The names of the boards, used to name their log files and tag their logs
+    """
+    global_logger = logging.getLogger()
+    for handler in global_logger.handlers:
+        if handler is console_handler:
+            handler.setFormatter(BoardFormatter("%(message)s"))
+        elif isinstance(handler, RotatingFileHandler):
+            handler.setFormatter(BoardFormatter(LOG_FORMAT))
+
+    for board_name in board_names:
+        rotating_log_handler = RotatingFileHandler(
+            os.path.join(log_dir_path, "switch-test-{0}.log".format(board_name)), maxBytes=2000000, backupCount=60)
+        rotating_log_handler.setFormatter(log_formatter)
+        rotating_log_handler.addFilter(BoardFilter(board_name))
+        global_logger.addHandler(rotating_log_handler)
+
+
+def run_shelf(boards, board_runner, runner_args=(), schedule="simultaneous", stagger_secs=5):
+    """
+    Run the board test on all the boards concurrently, one process per board, and wait for all of them to end.
+
+    Parameters
+    ----------
+    boards : list
+        The board configurations, each with the "slot" and "fpga_board_ip_address" keys
+    board_runner : callable
+        The board test, called in each board process as board_runner(board, board_index, scheduler, *runner_args)
+    runner_args : tuple
+        The extra arguments to pass to the board test
+    schedule : str
+        "simultaneous" or "staggered" board activations
+    stagger_secs : int
+        The delay between two consecutive board activations in the "staggered" schedule
+
+    Returns
+    -------
+    The process exit code of each board test, in the board order : list
+    """
+    scheduler = ActivationScheduler(len(boards), schedule=schedule, stagger_secs=stagger_secs)
+
+    processes = []
+    for board_index, board in enumerate(boards):
+        process = multiprocessing.Process(target=board_runner, name="slot{0}".format(board["slot"]),
+                                          args=(board, board_index, scheduler) + tuple(runner_args))
+        process.start()
+        logger.info("Started the test of the board in slot {0} ({1}), pid {2}"
+                    .format(board["slot"], board["fpga_board_ip_address"], process.pid))
+        processes.append(process)
+
+    start_time = time.time()
+    exit_codes = []
+    for board, process in zip(boards, processes):
+        process.join()
+        exit_codes.append(process.exitcode)
+        logger.info("The test of the board in slot {0} ended with exit code {1} after {2:.0f} seconds"
+                    .format(board["slot"], process.exitcode, time.time() - start_time))
+    return exit_codes
@@ -17,6 +17,11 @@ from AmcCarrierCore import *
 # Modules from AppMps
 from AppMps.AppMps import *
 
+def isDeviceSelected(name, devices=None, excludeDevices=()):
+    # A device profile builds the devices named in devices (all of them if None),
+    # except the ones named in excludeDevices
+    return (devices is None or name in devices) and (name not in excludeDevices)
+
 class AmcCarrierCore(pr.Device):
     def __init__(   self, 
             name                = "AmcCarrierCore", 
@@ -25,35 +30,47 @@ class AmcCarrierCore(pr.Device):
             rssiInterlaved      = False,            
             enableBsa           = True,
             enableMps           = True,
+            devices             = None,
+            excludeDevices      = (),
             expand	            = False,
             **kwargs):
         super().__init__(name=name, description=description, expand=expand, **kwargs)  
 
+        # Only build the devices of the device profile: each device holds up to thousands of variables and blocks
+        def selected(name):
+            return isDeviceSelected(name, devices, excludeDevices)
+
         ##############################
         # Variables
         ##############################                        
-        self.add(axi.AxiVersion(            
-            offset       =  0x00000000, 
-            expand       =  False
-        ))
-
-        self.add(xilinx.AxiSysMonUltraScale(   
-            offset       =  0x01000000, 
-            expand       =  False
-        ))
+        if selected("AxiVersion"):
+            self.add(axi.AxiVersion(            
+                offset       =  0x00000000, 
+                expand       =  False
+            ))
+
+        if selected("AxiSysMonUltraScale"):
+            self.add(xilinx.AxiSysMonUltraScale(   
+                offset       =  0x01000000, 
+                expand       =  False
+            ))
         
-        self.add(micron.AxiMicronN25Q(
-            name         = "MicronN25Q",
-            offset       = 0x2000000,
-            addrMode     = True,                                    
-            expand       = False,                                    
-            hidden       = True,                                    
-        ))        
-
-        self.add(microchip.AxiSy56040(    
-            offset       =  0x03000000, 
-            expand       =  False,
-            description  = "\n\
+        if selected("MicronN25Q"):
+            self.add(micron.AxiMicronN25Q(
+                name         = "MicronN25Q",
+                offset       = 0x2000000,
+                addrMode     = True,                                    
+                # The digest cache is keyed by the AxiVersion DNA, so it is disabled when AxiVersion is not built
+                boardSerial  = (lambda: self.AxiVersion.DeviceDna.get()) if selected("AxiVersion") else None,
+                expand       = False,                                    
+                hidden       = True,                                    
+            ))        
+
+        if selected("AxiSy56040"):
+            self.add(microchip.AxiSy56040(    
+                offset       =  0x03000000, 
+                expand       =  False,
+                description  = "\n\
                 Timing Crossbar:  https://confluence.slac.stanford.edu/x/m4H7D   \n\
                 -----------------------------------------------------------------\n\
                 OutputConfig[0] = 0x0: Connects RTM_TIMING_OUT0 to RTM_TIMING_IN0\n\
@@ -76,101 +93,115 @@ class AmcCarrierCore(pr.Device):
                 OutputConfig[3] = 0x2: Connects Backplane DIST1 to BP_TIMING_IN\n\
                 OutputConfig[3] = 0x3: Connects Backplane DIST1 to RTM_TIMING_IN1\n\
                 -----------------------------------------------------------------\n"\
-            ))
+                ))
                             
-        self.add(ti.AxiCdcm6208(     
-            offset       =  0x05000000, 
-            expand       =  False,
-        ))
-
-        self.add(AmcCarrierBsi(   
-            offset       =  0x07000000, 
-            expand       =  False,
-        ))
-
-        self.add(AmcCarrierTiming(
-            offset       =  0x08000000, 
-            expand       =  False,
-        ))
-
-        self.add(AmcCarrierBsa(   
-            offset       =  0x09000000, 
-            enableBsa    =  enableBsa,
-            expand       =  False,
-        ))
+        if selected("AxiCdcm6208"):
+            self.add(ti.AxiCdcm6208(     
+                offset       =  0x05000000, 
+                expand       =  False,
+            ))
+
+        if selected("AmcCarrierBsi"):
+            self.add(AmcCarrierBsi(   
+                offset       =  0x07000000, 
+                expand       =  False,
+            ))
+
+        if selected("AmcCarrierTiming"):
+            self.add(AmcCarrierTiming(
+                offset       =  0x08000000, 
+                expand       =  False,
+            ))
+
+        if selected("AmcCarrierBsa"):
+            self.add(AmcCarrierBsa(   
+                offset       =  0x09000000, 
+                enableBsa    =  enableBsa,
+                expand       =  False,
+            ))
                             
-        self.add(udp.UdpEngineClient(
-            name         = "BpUdpCltApp",
-            offset       =  0x0A000000,
-            description  = "Backplane UDP Client for Application ASYNC Messaging",
-            expand       =  False,
-        ))
-
-        self.add(udp.UdpEngineServer(
-            name         = "BpUdpSrvXvc",
-            offset       =  0x0A000800,
-            description  = "Backplane UDP Server: Xilinx XVC",
-            expand       =  False,
-        ))
+        if selected("BpUdpCltApp"):
+            self.add(udp.UdpEngineClient(
+                name         = "BpUdpCltApp",
+                offset       =  0x0A000000,
+                description  = "Backplane UDP Client for Application ASYNC Messaging",
+                expand       =  False,
+            ))
+
+        if selected("BpUdpSrvXvc"):
+            self.add(udp.UdpEngineServer(
+                name         = "BpUdpSrvXvc",
+                offset       =  0x0A000800,
+                description  = "Backplane UDP Server: Xilinx XVC",
+                expand       =  False,
+            ))
         
-        self.add(udp.UdpEngineServer(
-            name         = "BpUdpSrvFsbl",
-            offset       =  0x0A000808,
-            description  = "Backplane UDP Server: FSBL Legacy SRPv0 register access",
-            expand       =  False,
-        )) 
-
-        self.add(udp.UdpEngineServer(
-            name         = "BpUdpSrvRssi[0]",
-            offset       =  0x0A000810,
-            description  = "Backplane UDP Server: Legacy Non-interleaved RSSI for Register access and ASYNC messages",
-            expand       =  False,
-        )) 
-
-        self.add(udp.UdpEngineServer(
-            name         = "BpUdpSrvRssi[1]",
-            offset       =  0x0A000818,
-            description  = "Backplane UDP Server: Legacy Non-interleaved RSSI for bulk data transfer",
-            expand       =  False,
-        ))         
+        if selected("BpUdpSrvFsbl"):
+            self.add(udp.UdpEngineServer(
+                name         = "BpUdpSrvFsbl",
+                offset       =  0x0A000808,
+                description  = "Backplane UDP Server: FSBL Legacy SRPv0 register access",
+                expand       =  False,
+            )) 
+
+        if selected("BpUdpSrvRssi[0]"):
+            self.add(udp.UdpEngineServer(
+                name         = "BpUdpSrvRssi[0]",
+                offset       =  0x0A000810,
+                description  = "Backplane UDP Server: Legacy Non-interleaved RSSI for Register access and ASYNC messages",
+                expand       =  False,
+            )) 
+
+        if selected("BpUdpSrvRssi[1]"):
+            self.add(udp.UdpEngineServer(
+                name         = "BpUdpSrvRssi[1]",
+                offset       =  0x0A000818,
+                description  = "Backplane UDP Server: Legacy Non-interleaved RSSI for bulk data transfer",
+                expand       =  False,
+            ))         
         
-        self.add(udp.UdpEngineServer(
-            name         = "BpUdpSrvRssi[2]",
-            offset       =  0x0A000830,
-            description  = "Backplane UDP Server: Interleaved RSSI",
-            expand       =  False,
-        ))             
+        if selected("BpUdpSrvRssi[2]"):
+            self.add(udp.UdpEngineServer(
+                name         = "BpUdpSrvRssi[2]",
+                offset       =  0x0A000830,
+                description  = "Backplane UDP Server: Interleaved RSSI",
+                expand       =  False,
+            ))             
         
-        self.add(udp.UdpEngineServer(
-            name         = "BpUdpSrvApp",
-            offset       =  0x0A000820,
-            description  = "Backplane UDP Server for Application ASYNC Messaging",
-            expand       =  False,
-        ))  
-
-        self.add(udp.UdpEngineServer(
-            name         = "BpUdpSrvTiming",
-            offset       =  0x0A000828,
-            description  = "Backplane UDP Server for Timing ASYNC Messaging",
-            expand       =  False,
-        ))          
+        if selected("BpUdpSrvApp"):
+            self.add(udp.UdpEngineServer(
+                name         = "BpUdpSrvApp",
+                offset       =  0x0A000820,
+                description  = "Backplane UDP Server for Application ASYNC Messaging",
+                expand       =  False,
+            ))  
+
+        if selected("BpUdpSrvTiming"):
+            self.add(udp.UdpEngineServer(
+                name         = "BpUdpSrvTiming",
+                offset       =  0x0A000828,
+                description  = "Backplane UDP Server for Timing ASYNC Messaging",
+                expand       =  False,
+            ))          
         
         for i in range(2):
+            if selected("SwRssiServer[%i]" % (i)):
+                self.add(rssi.RssiCore(
+                    name         = "SwRssiServer[%i]" % (i),
+                    offset       =  0x0A010000 + (i * 0x1000),
+                    description  = "SwRssiServer Server: %i" % (i),                                
+                    expand       =  False,                                    
+                ))       
+            
+        if selected("SwRssiServer[2]"):
             self.add(rssi.RssiCore(
-                name         = "SwRssiServer[%i]" % (i),
-                offset       =  0x0A010000 + (i * 0x1000),
-                description  = "SwRssiServer Server: %i" % (i),                                
+                name         = "SwRssiServer[2]",
+                offset       =  0x0A020000,
+                description  = "SwRssiServer Server",                                
                 expand       =  False,                                    
-            ))       
-            
-        self.add(rssi.RssiCore(
-            name         = "SwRssiServer[2]",
-            offset       =  0x0A020000,
-            description  = "SwRssiServer Server",                                
-            expand       =  False,                                    
-        ))            
-
-        if (enableMps):
+            ))            
+
+        if (enableMps and selected("AppMps")):
             self.add(AppMps(      
                 offset =  0x0C000000, 
                 expand =  False
@@ -202,9 +233,10 @@ class AmcCarrierCore(pr.Device):
         # Retire any in-flight transactions before starting
         self._root.checkBlocks(recurse=True)
         
-        for i in range(2):
-            v = getattr(self.AmcCarrierBsa, 'BsaWaveformEngine[%i]'%i)
-            v.WaveformEngineBuffers.Initialize()
+        if "AmcCarrierBsa" in self.devices:
+            for i in range(2):
+                v = getattr(self.AmcCarrierBsa, 'BsaWaveformEngine[%i]'%i)
+                v.WaveformEngineBuffers.Initialize()
         
         self.checkBlocks(recurse=True)
         
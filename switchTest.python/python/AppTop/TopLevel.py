@@ -22,6 +22,7 @@ import pyrogue.interfaces.simulation
 import pyrogue.protocols
 import pyrogue.utilities.fileio
 import rogue.hardware.axi
+import surf.protocols.ssi as ssi
 
 from AmcCarrierCore import *
 from AppTop import *
@@ -47,6 +48,13 @@ class TopLevel(pr.Device):
             # General Parameters
             enableBsa       = False,
             enableMps       = False,
+            # Device Profile Parameters
+            devices         = None,
+            excludeDevices  = (),
+            # PRBS Parameters
+            prbsOffsets     = None,
+            # Transaction Trace Parameters
+            traceRecorder   = None,
             **kwargs):
         super().__init__(name=name, description=description, **kwargs)
 
@@ -63,6 +71,7 @@ class TopLevel(pr.Device):
         if (simGui):
             # Create simulation srp interface
             srp=pyrogue.interfaces.simulation.MemEmulate()
+            srpDdr=pyrogue.interfaces.simulation.MemEmulate()
         else:
         
             ################################################################################################################
@@ -96,6 +105,11 @@ class TopLevel(pr.Device):
                 srp = rogue.protocols.srp.SrpV3()
                 pr.streamConnectBiDir( srp, rudp.application(dest=0x0) )
 
+                # Record the SRPv3 requests and responses
+                if traceRecorder is not None:
+                    pr.streamTap( srp, traceRecorder.tap(0x0, False) )
+                    pr.streamTap( rudp.application(dest=0x0), traceRecorder.tap(0x0, True) )
+
                 # Create stream interface
                 self.stream = pr.protocols.UdpRssiPack( name='rudpData', host=ipAddr, port=8194, packVer = 1)       
             
@@ -116,6 +130,12 @@ class TopLevel(pr.Device):
                 srpDdr = rogue.protocols.srp.SrpV3()
                 pr.streamConnectBiDir( srpDdr, rudp.application(dest=0x4) )
 
+                # Record the SRPv3 requests and responses of both tDests
+                if traceRecorder is not None:
+                    for tDest, srpTdest in ((0x0, srp), (0x4, srpDdr)):
+                        pr.streamTap( srpTdest, traceRecorder.tap(tDest, False) )
+                        pr.streamTap( rudp.application(dest=tDest), traceRecorder.tap(tDest, True) )
+
             elif ( commType == 'pcie-fsbl' ):
             
                 # Connect the SRPv0 to tDest = 0x0
@@ -168,15 +188,21 @@ class TopLevel(pr.Device):
             else:
                 raise ValueError("Invalid type (%s)" % (commType) )
 
-        # Add devices
-        self.add(AmcCarrierCore(
-            memBase           = srp,
-            offset            = 0x00000000,
-            rssiInterlaved    = rssiInterlaved,
-            rssiNotInterlaved = rssiNotInterlaved,
-            enableBsa         = enableBsa,
-            enableMps         = enableMps,
-        ))
+        # Add devices, only building the subtrees of the device profile. devices lists the names of
+        # the devices to build (e.g. ["AxiVersion", "DDR"]), all of them if None, and excludeDevices
+        # the ones not to build. AmcCarrierCore is kept as the container of its selected devices, and
+        # naming it builds all of them.
+        if isDeviceSelected("AmcCarrierCore", None, excludeDevices):
+            self.add(AmcCarrierCore(
+                memBase           = srp,
+                offset            = 0x00000000,
+                rssiInterlaved    = rssiInterlaved,
+                rssiNotInterlaved = rssiNotInterlaved,
+                enableBsa         = enableBsa,
+                enableMps         = enableMps,
+                devices           = None if (devices is None or "AmcCarrierCore" in devices) else devices,
+                excludeDevices    = excludeDevices,
+            ))
 #        self.add(AppTop(
 #            memBase      = srp,
 #            offset       = 0x80000000,
@@ -188,12 +214,29 @@ class TopLevel(pr.Device):
 #            modeSigGen   = modeSigGen,
 #        ))
 
-        self.add(pr.Device(
-            name              = 'DDR',
-            memBase           = srpDdr,
-            offset            = 0x00000000,
-            size              = 0x10000000,
-        ))
+        if isDeviceSelected("DDR", devices, excludeDevices):
+            self.add(pr.Device(
+                name              = 'DDR',
+                memBase           = srpDdr,
+                offset            = 0x00000000,
+                size              = 0x10000000,
+            ))
+
+        # Add the PRBS generator and checker devices that the firmware is built with. prbsOffsets maps
+        # the device names, "SsiPrbsTx", "SsiPrbsRateGen" and "SsiPrbsRx", to their AXI-Lite offsets.
+        prbsDevices = {
+            "SsiPrbsTx"      : ssi.SsiPrbsTx,
+            "SsiPrbsRateGen" : ssi.SsiPrbsRateGen,
+            "SsiPrbsRx"      : ssi.SsiPrbsRx,
+        }
+        for name, offset in (prbsOffsets or {}).items():
+            if isDeviceSelected(name, None, excludeDevices):
+                self.add(prbsDevices[name](
+                    name    = name,
+                    memBase = srp,
+                    offset  = offset,
+                    expand  = False,
+                ))
 
         # Define SW trigger command
         @self.command(description="Software Trigger for DAQ MUX",)
@@ -230,8 +273,9 @@ class TopLevel(pr.Device):
 
         # Calculate the BsaWaveformEngine buffer sizes
         size    = [[0,0,0,0],[0,0,0,0]]
+        hasBsa = ("AmcCarrierCore" in self.devices) and ("AmcCarrierBsa" in self.AmcCarrierCore.devices)
         for i in range(2):
-            if ((self._numRxLanes[i] > 0) or (self._numTxLanes[i] > 0)):
+            if hasBsa and ((self._numRxLanes[i] > 0) or (self._numTxLanes[i] > 0)):
                 for j in range(4):
                     waveBuff = self.AmcCarrierCore.AmcCarrierBsa.BsaWaveformEngine[i].WaveformEngineBuffers
                     if ( (waveBuff.Enabled[j].get() > 0) and (waveBuff.EndAddr[j].get() > waveBuff.StartAddr[j].get()) ):
@@ -25,6 +25,10 @@ class FpgaTopLevel(app.TopLevel):
         commType        = "eth-rssi-interleaved",
         ipAddr          = "10.0.1.101",
         pcieRssiLink    = 0,        
+        devices         = None,
+        excludeDevices  = (),
+        prbsOffsets     = None,
+        traceRecorder   = None,
     ):
         super().__init__(
             simGui          = simGui,
@@ -38,5 +42,9 @@ class FpgaTopLevel(app.TopLevel):
             modeSigGen      = [True,False],# True = 32-bit RAM, True =16-bit RAM
             enableBsa       = False,       # BSA not built in FW
             enableMps       = False,       # MPS not built in FW
+            devices         = devices,
+            excludeDevices  = excludeDevices,
+            prbsOffsets     = prbsOffsets,
+            traceRecorder   = traceRecorder,
         )
         
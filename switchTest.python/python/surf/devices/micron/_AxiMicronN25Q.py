@@ -18,16 +18,26 @@
 #-----------------------------------------------------------------------------
 
 import pyrogue as pr
+import rogue.interfaces.memory as rim
 from surf.misc._mcsreader import *
+from surf.misc._promdigest import *
+import numpy as np
 import click
 import time
 import datetime
 
+# 256 bytes per page
+PAGE_SIZE = 0x100
+
+# 64kB per sector
+ERASE_SIZE = 0x10000
+
 class AxiMicronN25Q(pr.Device):
     def __init__(self,
             name        = "AxiMicronN25Q",
             description = "AXI-Lite Micron N25Q and Micron MT25Q PROM",
             addrMode    = False, # False = 24-bit Address mode, True = 32-bit Address Mode
+            boardSerial = None,  # Callable returning the board serial number, to key the digest cache
             **kwargs):
         super().__init__(
             name        = name, 
@@ -38,6 +48,7 @@ class AxiMicronN25Q(pr.Device):
         self._mcs      = McsReader()
         self._addrMode = addrMode
         self._progDone = False
+        self._boardSerial = boardSerial
         
         ##############################
         # Variables
@@ -52,6 +63,20 @@ class AxiMicronN25Q(pr.Device):
             mode         = "RW",
         ))              
         
+        self.add(pr.LocalVariable(
+            name         = "DifferentialProgramming",
+            description  = "Only erase and write the sectors that differ from the PROM",
+            mode         = "RW",
+            value        = False,
+        ))
+        
+        self.add(pr.LocalVariable(
+            name         = "DigestCachePath",
+            description  = "Sector digest cache file, to skip the readback of the sectors known to be unchanged. Empty to disable.",
+            mode         = "RW",
+            value        = "",
+        ))
+        
         ##############################
         # Constants
         ##############################
@@ -123,14 +148,27 @@ class AxiMicronN25Q(pr.Device):
             # Open the MCS file
             self._mcs.open(arg)
             
+            # Find the sectors to reprogram
+            if self.DifferentialProgramming.get():
+                sectors = self.changedSectors()
+                click.secho('Reprogramming {} out of {} sectors'.format(len(sectors), -(-self._mcs.size // ERASE_SIZE)), fg='green')
+            else:
+                sectors = None
+            
+            # Forget the digests until the new image is verified
+            self.clearDigestCache()
+            
             # Erase the PROM
-            self.eraseProm()
+            self.eraseProm(sectors)
             
             # Write to the PROM
-            self.writeProm()
+            self.writeProm(sectors)
             
             # Verify the PROM
-            self.verifyProm()
+            self.verifyProm(sectors)
+            
+            # Save the digests of the programmed image
+            self.updateDigestCache()
             
             # End time measurement for profiling
             end = time.time()
@@ -151,11 +189,18 @@ class AxiMicronN25Q(pr.Device):
                 , bg='green',
             )
 
-    def eraseProm(self): 
+    def eraseProm(self, sectors=None): 
+        # Only erase the given sectors, if any
+        if sectors is not None:
+            with click.progressbar(
+                iterable = sectors,
+                label    = click.style('Erasing PROM:  ', fg='green'),
+            ) as bar:
+                for address in bar:
+                    self.eraseCmd(address)
+            return
         # Set the starting address index
         address    = self._mcs.startAddr
-        # 64kB per sector
-        ERASE_SIZE = 0x10000
         # Setup the status bar
         with click.progressbar(
             iterable = range(int((self._mcs.size)/ERASE_SIZE)),
@@ -170,103 +215,117 @@ class AxiMicronN25Q(pr.Device):
         if ( address<self._mcs.endAddr ):
             self.eraseCmd(address)
 
-    def writeProm(self):
-        # Initialize the variables
-        wordCnt = 0
-        byteCnt = 0
-        # Create a burst data array
-        dataArray = [0] * 64  
+    def pageWords(self):
+        # Pack the image into 256-byte pages of 64 32-bit words, first byte in the MSB, padded with ones
+        pageCnt = -(-self._mcs.size // PAGE_SIZE)
+        padded  = np.full(pageCnt*PAGE_SIZE, 0xFF, dtype=np.uint8)
+        padded[:self._mcs.size] = self._mcs.image
+        return padded.view('>u4').astype(np.uint32).reshape(pageCnt, PAGE_SIZE//4)
+
+    def pagesInSectors(self, sectors):
+        # Get the indices of the image pages in the given sectors, or of all the pages
+        pageCnt = -(-self._mcs.size // PAGE_SIZE)
+        pageIdx = np.arange(pageCnt)
+        if sectors is None:
+            return pageIdx
+        pageSector = self._mcs.startAddr + (pageIdx*PAGE_SIZE) // ERASE_SIZE * ERASE_SIZE
+        return pageIdx[np.isin(pageSector, sectors)]
+
+    def changedSectors(self):
+        # Compare each sector of the image to the PROM, through the digest cache where possible
+        cache  = PromDigestCache(self.DigestCachePath.get()) if self.DigestCachePath.get() else None
+        serial = self._boardSerial() if (cache and self._boardSerial) else None
+        sectors = []
+        with click.progressbar(
+            iterable = imageSectors(self._mcs, ERASE_SIZE),
+            label    = click.style('Reading PROM:  ', fg='green'),
+        ) as bar:
+            for address, data in bar:
+                digest = sectorDigest(data)
+                cached = cache.get(serial, address) if serial is not None else None
+                if cached is None:
+                    cached = sectorDigest(self.readSector(address))
+                if cached != digest:
+                    sectors.append(address)
+        return sectors
+
+    def readSector(self, address):
+        # Read a sector back, one page burst at a time
+        words = []
+        for page in range(ERASE_SIZE // PAGE_SIZE):
+            self.readCmd(address + page*PAGE_SIZE)
+            words.extend(self.getDataReg())
+        return np.asarray(words, dtype=np.uint32).astype('>u4').view(np.uint8)
+
+    def clearDigestCache(self):
+        if not (self.DigestCachePath.get() and self._boardSerial):
+            return
+        cache = PromDigestCache(self.DigestCachePath.get())
+        cache.forget(self._boardSerial())
+        cache.save()
+
+    def updateDigestCache(self):
+        if not (self.DigestCachePath.get() and self._boardSerial):
+            return
+        cache = PromDigestCache(self.DigestCachePath.get())
+        cache.update(self._boardSerial(), {address: sectorDigest(data) for address, data in imageSectors(self._mcs, ERASE_SIZE)})
+        cache.save()
+
+    def writeProm(self, sectors=None):
+        # Pack the whole image up front
+        pages = self.pageWords()
+        # Erased pages already hold all ones, so only program the others
+        pageIdx    = self.pagesInSectors(sectors)
+        programIdx = pageIdx[(pages[pageIdx] != 0xFFFFFFFF).any(axis=1)]
         # Setup the status bar
         with click.progressbar(
             length   = self._mcs.size,
             label    = click.style('Writing PROM:  ', fg='green'),
         ) as bar:        
-            for i in range(self._mcs.size): 
-                # Check for first byte of burst transfer
-                if ( (i&0xFFF) == 0):
-                    # Throttle down printf rate
-                    bar.update(0xFFF)
-                # Get the start bursting address
-                if ( (byteCnt==0) and (wordCnt==0) ):
-                    addr = int(self._mcs.entry[i][0])
-                # Pack the bytes into a 32-bit word
-                if ( byteCnt==0 ):
-                    wrd = (int(self._mcs.entry[i][1]) & 0xFF) << (8*(3-byteCnt))
-                else:
-                    wrd |= (int(self._mcs.entry[i][1]) & 0xFF) << (8*(3-byteCnt))
-                # Increment the counter
-                byteCnt += 1    
-                # Check the byte counter
-                if ( byteCnt==4 ):
-                    byteCnt = 0
-                    dataArray[wordCnt] = wrd
-                    wordCnt += 1
-                    if ( wordCnt==64 ):
-                        wordCnt = 0
-                        self.setDataReg(dataArray)
-                        self.writeCmd(addr)
-            # Check for leftover data
-            if (wordCnt != 0):
-                while(wordCnt != 0):
-                    # Pack the bytes into a 32-bit word
-                    if ( byteCnt==0 ):
-                        wrd = (0xFF) << (8*(3-byteCnt))
-                    else:
-                        wrd |= (0xFF) << (8*(3-byteCnt))
-                    # Increment the counter
-                    byteCnt += 1    
-                    # Check the byte counter
-                    if ( byteCnt==4 ):
-                        byteCnt = 0
-                        dataArray[wordCnt] = wrd
-                        wordCnt += 1
-                        if ( wordCnt==64 ):
-                            wordCnt = 0
-                            self.setDataReg(dataArray)
-                            self.writeCmd(addr)
-                            break
+            for i, page in enumerate(programIdx):
+                # Throttle down printf rate
+                if ( (i&0xF) == 0):
+                    bar.update(int(page)*PAGE_SIZE - bar.pos)
+                # Post the page upload, and wait for the previous page program to finish
+                # before checking it: the upload is in flight with the first flag status
+                # read, instead of costing a round trip of its own. A failed upload fails
+                # the programming before the page is programmed with stale data.
+                txnId = self.postDataReg(pages[page])
+                self.waitForFlashReady()
+                self.waitDataReg(txnId)
+                self.writeCmd(self._mcs.startAddr + int(page)*PAGE_SIZE, waitReady=False)
             # Close the status bar
             bar.update(self._mcs.size)
             
-    def verifyProm(self): 
+    def verifyProm(self, sectors=None): 
         # Wait for last transaction to finish
         self.waitForFlashReady()
-        # Initialize the variables
-        wordCnt = 0
-        byteCnt = 0
+        # Pack the whole image up front
+        pages = self.pageWords()
+        pageIdx = self.pagesInSectors(sectors)
         # Setup the status bar
         with click.progressbar(
             length  = self._mcs.size,
             label   = click.style('Verifying PROM:', fg='green'),
         ) as bar:
-            for i in range(self._mcs.size):
-                # Check for first byte of burst transfer
-                if ( (i&0xFFF) == 0):
-                    # Throttle down printf rate
-                    bar.update(0xFFF)      
-                # Get the start bursting address
-                if ( (byteCnt==0) and (wordCnt==0) ):
-                    # Start address of a burst transfer
-                    self.readCmd(int(self._mcs.entry[i][0])) 
-                    # Get the data
-                    dataArray = self.getDataReg()
-                # Get the data/addr for MCS file
-                data = int(self._mcs.entry[i][1])
-                addr = int(self._mcs.entry[i][0])
-                # Get the prom data from data array
-                prom = ((dataArray[wordCnt] >> 8*(3-byteCnt)) & 0xFF)
-                # Compare PROM to file
-                if (data != prom):
-                    click.secho(("\nAddr = 0x%x: MCS = 0x%x != PROM = 0x%x" % (addr,data,prom)), fg='red')
+            for page in pageIdx:
+                page = int(page)
+                # Throttle down printf rate
+                if ( (page&0xF) == 0):
+                    bar.update(page*PAGE_SIZE - bar.pos)
+                # Read the whole burst, and compare it to the file
+                addr = self._mcs.startAddr + page*PAGE_SIZE
+                self.readCmd(addr) 
+                prom = np.asarray(self.getDataReg(), dtype=np.uint32)
+                mismatch = np.flatnonzero(prom != pages[page])
+                if len(mismatch):
+                    # Report the first mismatching byte
+                    wordIdx  = int(mismatch[0])
+                    mcsBytes  = pages[page][wordIdx:wordIdx+1].astype('>u4').view(np.uint8)
+                    promBytes = prom[wordIdx:wordIdx+1].astype('>u4').view(np.uint8)
+                    byteIdx  = int(np.flatnonzero(mcsBytes != promBytes)[0])
+                    click.secho(("\nAddr = 0x%x: MCS = 0x%x != PROM = 0x%x" % (addr + 4*wordIdx + byteIdx,mcsBytes[byteIdx],promBytes[byteIdx])), fg='red')
                     raise McsException('verifyProm() Failed\n\n')
-                # Increment the counter
-                byteCnt += 1    
-                # Check the byte counter
-                if ( byteCnt==4 ):
-                    byteCnt = 0
-                    wordCnt += 1
-                    if ( wordCnt==64 ):
-                        wordCnt = 0
             # Close the status bar
             bar.update(self._mcs.size)  
 
@@ -277,12 +336,12 @@ class AxiMicronN25Q(pr.Device):
         else:
             self.setCmd(self.WRITE_MASK|self.ERASE_CMD|0x3)
 
-    def writeCmd(self, address): 
+    def writeCmd(self, address, waitReady=True): 
         self.setAddrReg(address) 
         if (self._addrMode):  
-            self.setCmd(self.WRITE_MASK|self.WRITE_CMD|0x104)
+            self.setCmd(self.WRITE_MASK|self.WRITE_CMD|0x104, waitReady)
         else:
-            self.setCmd(self.WRITE_MASK|self.WRITE_CMD|0x103)
+            self.setCmd(self.WRITE_MASK|self.WRITE_CMD|0x103, waitReady)
 
     def readCmd(self, address):
         self.setAddrReg(address) 
@@ -342,9 +401,11 @@ class AxiMicronN25Q(pr.Device):
             self.setCmd(self.WRITE_MASK|self.WRITE_NONVOLATILE_CONFIG|0x2)
             self.setCmd(self.WRITE_MASK|self.WRITE_VOLATILE_CONFIG|0x2)
             
-    def setCmd(self,value):     
+    def setCmd(self,value,waitReady=True):     
         if ( value&self.WRITE_MASK ):
-            self.waitForFlashReady()
+            # The caller may have waited for the flash already
+            if waitReady:
+                self.waitForFlashReady()
             self.setCmdReg(self.WRITE_MASK|self.WRITE_ENABLE_CMD)
             self.setCmdReg(value) 
         else:
@@ -383,3 +444,17 @@ class AxiMicronN25Q(pr.Device):
 
     def getDataReg(self):
         return (self._rawRead(offset=0x200,numWords=64))
+
+    def postDataReg(self,words):
+        # Issue the data register write without waiting for it to complete
+        data = bytearray(np.asarray(words, dtype='<u4').tobytes())
+        return self._reqTransaction(self.offset+0x200,data,len(data),0,rim.Write)
+
+    def waitDataReg(self,txnId):
+        # Wait for a posted data register write, and check its error
+        self._waitTransaction(txnId)
+        error = self._getError()
+        if error:
+            self._clearError()
+            click.secho(("\nData register upload failed: %s" % error), fg='red')
+            raise McsException('writeProm() Failed\n\n')
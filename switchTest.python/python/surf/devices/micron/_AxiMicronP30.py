@@ -19,14 +19,24 @@
 
 import pyrogue as pr
 from surf.misc._mcsreader import *
+from surf.misc._promdigest import *
+import numpy as np
 import click
 import time
 import datetime
 
+# 256 16-bit words (512 bytes) per burst
+BURST_SIZE = 0x200
+
+# Differential programming compares the PROM in 64-kword (128kB) main blocks, which
+# span whole 16-kword parameter blocks as well
+SECTOR_SIZE = 0x20000
+
 class AxiMicronP30(pr.Device):
     def __init__(self,       
             name        = "AxiMicronP30",
             description = "AXI-Lite Micron P30 PROM",
+            boardSerial = None,  # Callable returning the board serial number, to key the digest cache
             **kwargs):
         super().__init__(
             name        = name, 
@@ -36,6 +46,7 @@ class AxiMicronP30(pr.Device):
         
         self._mcs = McsReader()        
         self._progDone = False 
+        self._boardSerial = boardSerial
         
         ##############################
         # Variables
@@ -49,6 +60,20 @@ class AxiMicronP30(pr.Device):
             base         = pr.UInt,
             mode         = "RW"))
             
+        self.add(pr.LocalVariable(
+            name         = "DifferentialProgramming",
+            description  = "Only erase and write the blocks that differ from the PROM",
+            mode         = "RW",
+            value        = False,
+        ))
+        
+        self.add(pr.LocalVariable(
+            name         = "DigestCachePath",
+            description  = "Block digest cache file, to skip the readback of the blocks known to be unchanged. Empty to disable.",
+            mode         = "RW",
+            value        = "",
+        ))
+            
         @self.command(value='',description="Load the .MCS into PROM",)
         def LoadMcsFile(arg):
             
@@ -67,14 +92,27 @@ class AxiMicronP30(pr.Device):
             # print(f' startAddr: {hex(self._mcs.startAddr)}')
             # print(f' endAddr: {hex(self._mcs.endAddr)}')            
             
+            # Find the blocks to reprogram
+            if self.DifferentialProgramming.get():
+                sectors = self.changedSectors()
+                click.secho('Reprogramming {} out of {} blocks'.format(len(sectors), -(-self._mcs.size // SECTOR_SIZE)), fg='green')
+            else:
+                sectors = None
+            
+            # Forget the digests until the new image is verified
+            self.clearDigestCache()
+            
             # Erase the PROM
-            self.eraseProm()
+            self.eraseProm(sectors)
             
             # Write to the PROM
-            self.writeProm()
+            self.writeProm(sectors)
             
             # Verify the PROM
-            self.verifyProm()
+            self.verifyProm(sectors)
+            
+            # Save the digests of the programmed image
+            self.updateDigestCache()
             
             # End time measurement for profiling
             end = time.time()
@@ -95,7 +133,18 @@ class AxiMicronP30(pr.Device):
                 , bg='green',
             )
    
-    def eraseProm(self):
+    def eraseProm(self, sectors=None):
+        # Only erase the given blocks, if any
+        if sectors is not None:
+            with click.progressbar(
+                iterable = sectors,
+                label    = click.style('Erasing PROM:  ', fg='green'),
+            ) as bar:
+                for address in bar:
+                    # Erase every 16-kword block of the main block
+                    for offset in range(0, SECTOR_SIZE, 0x8000):
+                        self._eraseCmd((address + offset) >> 1)
+            return
         # Set the starting address index
         address    = self._mcs.startAddr >> 1        
         # Assume the smallest block size of 16-kword/block
@@ -138,9 +187,68 @@ class AxiMicronP30(pr.Device):
         # Lock the Block
         self._writeToFlash(address,0x60,0x01)
         
-    def writeProm(self):
-        # Create a burst data array
-        dataArray = [0] * 256
+    def burstWords(self):
+        # Pack the image into bursts of 256 16-bit words, first byte in the LSB, padded with ones
+        burstCnt = -(-self._mcs.size // BURST_SIZE)
+        padded   = np.full(burstCnt*BURST_SIZE, 0xFF, dtype=np.uint8)
+        padded[:self._mcs.size] = self._mcs.image
+        return padded.view('<u2').astype(np.uint32).reshape(burstCnt, BURST_SIZE//2)
+
+    def burstsInSectors(self, sectors):
+        # Get the indices of the image bursts in the given blocks, or of all the bursts
+        burstIdx = np.arange(-(-self._mcs.size // BURST_SIZE))
+        if sectors is None:
+            return burstIdx
+        burstSector = self._mcs.startAddr + (burstIdx*BURST_SIZE) // SECTOR_SIZE * SECTOR_SIZE
+        return burstIdx[np.isin(burstSector, sectors)]
+
+    def changedSectors(self):
+        # Compare each block of the image to the PROM, through the digest cache where possible
+        cache  = PromDigestCache(self.DigestCachePath.get()) if self.DigestCachePath.get() else None
+        serial = self._boardSerial() if (cache and self._boardSerial) else None
+        sectors = []
+        # Set the data bus 
+        self._rawWrite(offset=0x0, data=0xFFFFFFFF)
+        # Set the block transfer size
+        self._rawWrite(offset=0x80, data=0xFF)
+        with click.progressbar(
+            iterable = imageSectors(self._mcs, SECTOR_SIZE),
+            label    = click.style('Reading PROM:  ', fg='green'),
+        ) as bar:
+            for address, data in bar:
+                digest = sectorDigest(data)
+                cached = cache.get(serial, address) if serial is not None else None
+                if cached is None:
+                    cached = sectorDigest(self.readSector(address))
+                if cached != digest:
+                    sectors.append(address)
+        return sectors
+
+    def readSector(self, address):
+        # Read a block back, one burst at a time
+        words = []
+        for burst in range(SECTOR_SIZE // BURST_SIZE):
+            self._rawWrite(offset=0x84, data=0x80000000|((address + burst*BURST_SIZE)>>1))
+            words.extend(self._rawRead(offset=0x400,numWords=256))
+        return np.asarray(words, dtype=np.uint32).astype('<u2').view(np.uint8)
+
+    def clearDigestCache(self):
+        if not (self.DigestCachePath.get() and self._boardSerial):
+            return
+        cache = PromDigestCache(self.DigestCachePath.get())
+        cache.forget(self._boardSerial())
+        cache.save()
+
+    def updateDigestCache(self):
+        if not (self.DigestCachePath.get() and self._boardSerial):
+            return
+        cache = PromDigestCache(self.DigestCachePath.get())
+        cache.update(self._boardSerial(), {address: sectorDigest(data) for address, data in imageSectors(self._mcs, SECTOR_SIZE)})
+        cache.save()
+
+    def writeProm(self, sectors=None):
+        # Pack the whole image up front
+        bursts = self.burstWords()
         # Set the block transfer size
         self._rawWrite(0x80,0xFF)        
         # Setup the status bar
@@ -148,41 +256,22 @@ class AxiMicronP30(pr.Device):
             length   = self._mcs.size,
             label    = click.style('Writing PROM:  ', fg='green'),
         ) as bar:        
-            for i in range(self._mcs.size):        
-                if ( (i&0x1) == 0):
-                    # Check for first byte of burst transfer
-                    if ( (i&0x1FF) == 0):
-                        # Throttle down printf rate
-                        bar.update(0x1FF)            
-                        # Get the start bursting address
-                        addr = int(self._mcs.entry[i][0])>>1 # 16-bit word addressing at the PROM
-                        # Reset the counter
-                        cnt = 0
-                    # Get the data from MCS file
-                    dataArray[cnt] = int(self._mcs.entry[i][1]) & 0xFF
-                else:
-                    # Get the data from MCS file
-                    dataArray[cnt] |= (int(self._mcs.entry[i][1])   << 8)
-                    cnt += 1
-                    # Check for the last byte
-                    if ( cnt == 256 ):
-                        # Write burst data
-                        self._rawWrite(offset=0x400, data=dataArray)
-                        # Start a burst transfer
-                        self._rawWrite(offset=0x84, data=0x7FFFFFFF&addr)                           
-            # Check for leftover data
-            if (cnt != 256):
-                # Fill the rest of the data array with ones
-                for i in range(cnt, 256):
-                    dataArray[i] = 0xFFFF
+            for burst in self.burstsInSectors(sectors):
+                burst = int(burst)
+                # Throttle down printf rate
+                if ( (burst&0x7) == 0):
+                    bar.update(burst*BURST_SIZE - bar.pos)
                 # Write burst data
-                self._rawWrite(offset=0x400, data=dataArray)
+                self._rawWrite(offset=0x400, data=bursts[burst].tolist())
                 # Start a burst transfer
-                self._rawWrite(offset=0x84, data=0x7FFFFFFF&addr)                  
+                addr = (self._mcs.startAddr + burst*BURST_SIZE)>>1 # 16-bit word addressing at the PROM
+                self._rawWrite(offset=0x84, data=0x7FFFFFFF&addr)                           
             # Close the status bar
             bar.update(self._mcs.size)  
 
-    def verifyProm(self):     
+    def verifyProm(self, sectors=None):     
+        # Pack the whole image up front
+        bursts = self.burstWords()
         # Set the data bus 
         self._rawWrite(offset=0x0, data=0xFFFFFFFF)
         # Set the block transfer size
@@ -192,28 +281,21 @@ class AxiMicronP30(pr.Device):
             length  = self._mcs.size,
             label   = click.style('Verifying PROM:', fg='green'),           
         ) as bar:
-            for i in range(self._mcs.size):
-                if ( (i&0x1) == 0):
-                    # Get the data and address from MCS file
-                    addr = int(self._mcs.entry[i][0])>>1 # 16-bit word addressing at the PROM
-                    data = int(self._mcs.entry[i][1]) & 0xFF             
-                    # Check for burst transfer
-                    if ( (i&0x1FF) == 0):
-                        # Throttle down printf rate
-                        bar.update(0x1FF)
-                        # Start a burst transfer
-                        self._rawWrite(offset=0x84, data=0x80000000|addr)
-                        # Get the data
-                        dataArray = self._rawRead(offset=0x400,numWords=256)  
-                else:
-                    # Get the data for MCS file
-                    data |= (int(self._mcs.entry[i][1])  << 8)
-                    # Get the prom data from data array
-                    prom = dataArray[(i&0x1FF)>>1]
-                    # Compare PROM to file
-                    if (data != prom):
-                        click.secho(("\nAddr = 0x%x: MCS = 0x%x != PROM = 0x%x" % (addr,data,prom)), fg='red')
-                        raise McsException('verifyProm() Failed\n\n')
+            for burst in self.burstsInSectors(sectors):
+                burst = int(burst)
+                # Throttle down printf rate
+                if ( (burst&0x7) == 0):
+                    bar.update(burst*BURST_SIZE - bar.pos)
+                # Start a burst transfer
+                addr = (self._mcs.startAddr + burst*BURST_SIZE)>>1 # 16-bit word addressing at the PROM
+                self._rawWrite(offset=0x84, data=0x80000000|addr)
+                # Get the data, and compare the whole burst to the file
+                prom = np.asarray(self._rawRead(offset=0x400,numWords=256), dtype=np.uint32)
+                mismatch = np.flatnonzero(prom != bursts[burst])
+                if len(mismatch):
+                    wordIdx = int(mismatch[0])
+                    click.secho(("\nAddr = 0x%x: MCS = 0x%x != PROM = 0x%x" % (addr + wordIdx,bursts[burst][wordIdx],prom[wordIdx])), fg='red')
+                    raise McsException('verifyProm() Failed\n\n')
             # Close the status bar
             bar.update(self._mcs.size)  
         
@@ -10,3 +10,4 @@
 ##############################################################################
 from surf.misc._GenericMemory import *
 from surf.misc._mcsreader import *
+from surf.misc._promdigest import *
@@ -19,30 +19,52 @@
 #-----------------------------------------------------------------------------
 
 import numpy as np
-import functools
 import click 
 import gzip
+import mmap
 import os
 import fnmatch
 
 class McsException(Exception):
     pass
 
+# Number of file bytes decoded per vectorized batch
+BATCH_SIZE = 0x800000
+
+# Maximum number of bytes in a record: byte count, 2 address bytes, record type, 16 data bytes and checksum
+MAX_RECORD_BYTES = 21
+
+# ASCII hex digit to nibble lookup table, with 0xFF for non-hex characters
+HEX_TABLE = np.full(256, 0xFF, dtype=np.uint8)
+for _i, _c in enumerate(b'0123456789ABCDEF'):
+    HEX_TABLE[_c] = _i
+for _i, _c in enumerate(b'abcdef'):
+    HEX_TABLE[_c] = 10 + _i
+
 class McsReader():
 
     def __init__(self,name="McsReader"):
-        self.entry     = []
+        self.image     = np.empty(0, dtype=np.uint8)
         self.startAddr = 0
         self.endAddr   = 0
         self.size      = 0
-        
+        self._entry    = None
+
+    @property
+    def entry(self):
+        # [address, data] pairs of the image, for backward compatibility. Built on first use only.
+        if self._entry is None:
+            self._entry = np.empty((self.size, 2), dtype=np.int32)
+            self._entry[:,0] = np.arange(self.startAddr, self.startAddr + self.size, dtype=np.int64)
+            self._entry[:,1] = self.image
+        return self._entry
+
     def open(self, filename):   
-        self.entry     = []
+        self.image     = np.empty(0, dtype=np.uint8)
         self.startAddr = 0
         self.endAddr   = 0
         self.size      = 0
-        baseAddr       = 0
-        dataList       = []
+        self._entry    = None
 
         # Check for non-compressed .MCS file
         if fnmatch.fnmatch(filename, '*.mcs'):
@@ -52,99 +74,171 @@ class McsReader():
         else:
             click.secho('\nUnsupported file extension detected', fg='red')
             raise McsException('McsReader.open(): failed')  
-            
-        # Find the length of the file
-        f = gzip.open(filename, "rb") if (gzipEn) else open(filename, "r")
-        length = 0
-        for line in iter(f):
-            length += 1
-        f.close()  
-        # Setup the status bar
+
+        # The image is filled with the erased PROM value (0xFF) wherever the file has no data
+        self._buffer   = np.full(0, 0xFF, dtype=np.uint8)
+        self._baseAddr = 0
+        self._lineIdx  = 0
+        self._endAddr  = None
+
+        # Setup the status bar, in units of file bytes
+        length = os.path.getsize(filename)
         with click.progressbar(
             length = length,
             label  = click.style('Reading .MCS:  ', fg='green'),
-        ) as bar:            
-            # Open the file
-            with ( gzip.open(filename, "rb") if (gzipEn) else open(filename, 'r') ) as f:            
-                for i, line in enumerate(f):
-                    # Readout a line
-                    line = line.strip()
-                    
-                    # Check if GZIP and convert to standard string
-                    if (gzipEn):
-                        line = str(line)[2:]
-                        line = str(line)[:-1]
-                    
-                    # Throttle down printf rate
-                    if ( (i&0xFFF) == 0):
-                        bar.update(0xFFF)                      
-                        
-                    # Check for "start code"
-                    if line[0] != ':':
-                        click.secho( ('\nMissing start code. Line[%d]: {:%s}' % (i,line)), fg='red')
-                        raise McsException('McsReader.open(): failed')                         
-                    else:
-                    
-                        strings = [line[j:j+2] for j in range(1, len(line), 2)]
-                        bytes = [int(s, 16) for s in strings]
-
-                        s = functools.reduce(lambda x,y: x+y, bytes[:-1]) & 0xFF
-                        c = (bytes[-1]*-1) & 0xFF
-                        
-                        if s != c:                            
-                            click.secho('\nBad checksum on line: {:s}. Sum: {:x}, checksum: {:x}'.format(line, s, c), fg='red')
-                            raise McsException('McsReader.open(): failed') 
-
-                        # Parse out the bytes
-                        byteCount = bytes[0]
-                        addr = int(bytes[1])<<8 | int(bytes[2])
-                        recordType = bytes[3]
-                       
-                        if byteCount > 16:
-                            click.secho('\nInvalid byte count: {:d}'.format(byteCount), fg='red')
-                            raise McsException('McsReader.open(): failed') 
-
-                        elif recordType == 0: # Data RecordType           
-                            
-                            if byteCount == 0:
-                                click.secho('\nInvalid byte count: {:d} for recordType: {d}'.format(byteCount, recordType), fg='red')
-                                raise McsException('McsReader.open(): failed') 
-                            for j in range(byteCount):
-                                # Put the address and data into a list
-                                address = baseAddr + addr + j
-                                data    = bytes[j+4]
-                                dataList.append([address, data])
-                            
-                            # Save the last address
-                            self.endAddr = address
-                            
-                        elif recordType == 1: # End Of File RecordType 
-                            break
-
-                        elif recordType == 4: #Extended Linear Address RecordType
-                            # Check for an invalid byte count
-                            if byteCount != 2:
-                                click.secho('\nMcsReader.open():Byte count: {:d} must be 2 for ELA records'.format(byteCount), fg='red')
-                                raise McsException('McsReader.open(): failed')  
-                            # Check for an invalid address header
-                            elif addr != 0:
-                                click.secho('\nAddr: {:x} must be 0 for ELA records'.format(addr), fg='red')
-                                raise McsException('McsReader.open(): failed')  
-                            # Update the base address 
-                            baseAddr = int(strings[4]+strings[5], 16)* (2**16)
-                            # Check for first address index (which is always the first line)
-                            if (i==0):
-                                self.startAddr = baseAddr
-                        else: # Undefined RecordType
-                            click.secho('\nInvalid record type: {:d}'.format(recordType), fg='red')
-                            raise McsException('McsReader.open(): failed')    
-                            
+        ) as bar:
+            # Stream the file through in batches, in a single pass
+            leftover = b''
+            done     = False
+            for chunk, position in self._readChunks(filename, gzipEn):
+                data = leftover + chunk
+                cut  = data.rfind(b'\n') + 1
+                leftover = data[cut:]
+                done = self._parseBatch(data[:cut])
+                bar.update(position - bar.pos)
+                if done:
+                    break
+            if not done and leftover.strip():
+                self._parseBatch(leftover + b'\n')
             # Close the status bar
-            bar.update(length)          
-            
+            bar.update(length)
+
+        if self._endAddr is not None:
+            self.endAddr = self._endAddr
+
         # Calculate the total size (in units of bytes)                
-        self.size = (self.endAddr - self.startAddr) + 1
-        
-        # Convert to numpy array
-        self.entry = np.array(dataList,dtype=np.int32)
-   
+        self.size  = (self.endAddr - self.startAddr) + 1
+        self.image = self._buffer[:self.size].copy() if self._endAddr is not None else np.empty(0, dtype=np.uint8)
+        del self._buffer
+
+    def _readChunks(self, filename, gzipEn):
+        # Yield the file in chunks, with the number of file bytes read so far
+        if gzipEn:
+            with gzip.open(filename, 'rb') as f:
+                while True:
+                    chunk = f.read(BATCH_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk, f.fileobj.tell()
+        elif os.path.getsize(filename) > 0:
+            with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for start in range(0, len(m), BATCH_SIZE):
+                    yield m[start:start+BATCH_SIZE], min(start + BATCH_SIZE, len(m))
+
+    def _error(self, message, lineIdx=None, line=None):
+        if line is not None:
+            message += ' Line[%d]: {:%s}' % (lineIdx, line.decode('ascii', 'replace'))
+        click.secho('\n' + message, fg='red')
+        raise McsException('McsReader.open(): failed')
+
+    def _parseBatch(self, text):
+        # Parse a batch of complete lines. Returns True once the End Of File record has been parsed.
+        buf    = np.frombuffer(text, dtype=np.uint8)
+        ends   = np.flatnonzero(buf == 0x0A)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+
+        # Strip the line endings and skip blank lines
+        stops = ends.copy()
+        stops[(stops > starts) & (buf[stops - 1] == 0x0D)] -= 1
+        keep   = stops > starts
+        starts = starts[keep]
+        stops  = stops[keep]
+        lengths = stops - starts
+        lineCnt = len(starts)
+        if lineCnt == 0:
+            return False
+
+        def line(idx):
+            return bytes(buf[starts[idx]:stops[idx]])
+
+        # Decode the records of each line length in one go
+        records   = np.zeros((lineCnt, MAX_RECORD_BYTES), dtype=np.uint8)
+        byteCnts  = np.zeros(lineCnt, dtype=np.int64)
+        badStart  = np.zeros(lineCnt, dtype=bool)
+        badHex    = np.zeros(lineCnt, dtype=bool)
+        for length in np.unique(lengths):
+            idx   = np.flatnonzero(lengths == length)
+            chars = buf[starts[idx,None] + np.arange(length)]
+            badStart[idx] = chars[:,0] != ord(':')
+            nibbles = HEX_TABLE[chars[:,1:]]
+            if (length % 2 == 0) or (length > 1 + 2*MAX_RECORD_BYTES) or (length < 11):
+                badHex[idx] = True
+                continue
+            badHex[idx] = (nibbles == 0xFF).any(axis=1)
+            records[idx,:(length-1)//2] = (nibbles[:,0::2] << 4) | nibbles[:,1::2]
+            byteCnts[idx] = (length-1)//2
+
+        byteCount  = records[:,0].astype(np.int64)
+        addr       = (records[:,1].astype(np.int64) << 8) | records[:,2]
+        recordType = records[:,3]
+        badSum     = (records.sum(axis=1, dtype=np.uint32) & 0xFF) != 0
+        badCount   = (byteCount > 16) | (byteCount != byteCnts - 5)
+        isData     = recordType == 0
+        isEla      = recordType == 4
+        badType    = ~(isData | isEla | (recordType == 1))
+        badData    = isData & (byteCount == 0)
+        badEla     = isEla & ((byteCount != 2) | (addr != 0))
+
+        # Only the lines up to the first End Of File record count
+        bad    = badStart | badHex | badSum | badCount | badType | badData | badEla
+        isEof  = (recordType == 1) & ~bad
+        eofIdx = np.flatnonzero(isEof)
+        done   = len(eofIdx) > 0
+        lastIdx = eofIdx[0] if done else lineCnt
+
+        badIdx = np.flatnonzero(bad[:lastIdx])
+        if len(badIdx):
+            i = badIdx[0]
+            lineIdx = self._lineIdx + i
+            if badStart[i]:
+                self._error('Missing start code.', lineIdx, line(i))
+            elif badHex[i]:
+                self._error('Invalid hex record.', lineIdx, line(i))
+            elif badSum[i]:
+                s = int(records[i].sum() - records[i,byteCnts[i]-1]) & 0xFF
+                c = (int(records[i,byteCnts[i]-1])*-1) & 0xFF
+                self._error('Bad checksum on line: {:s}. Sum: {:x}, checksum: {:x}'.format(line(i).decode('ascii', 'replace'), s, c))
+            elif badCount[i] or badData[i]:
+                self._error('Invalid byte count: {:d} for recordType: {:d}'.format(int(byteCount[i]), int(recordType[i])), lineIdx, line(i))
+            elif badEla[i]:
+                self._error('McsReader.open(): Invalid ELA record, byte count: {:d}, addr: {:x}'.format(int(byteCount[i]), int(addr[i])), lineIdx, line(i))
+            else:
+                self._error('Invalid record type: {:d}'.format(int(recordType[i])), lineIdx, line(i))
+
+        records    = records[:lastIdx]
+        byteCount  = byteCount[:lastIdx]
+        addr       = addr[:lastIdx]
+        isData     = isData[:lastIdx]
+        isEla      = isEla[:lastIdx]
+
+        # Resolve the Extended Linear Address of each line
+        elaBase  = (records[:,4].astype(np.int64) << 24) | (records[:,5].astype(np.int64) << 16)
+        lastEla  = np.maximum.accumulate(np.where(isEla, np.arange(len(records)), -1)) if len(records) else np.empty(0, dtype=np.int64)
+        baseAddr = np.where(lastEla >= 0, elaBase[np.maximum(lastEla, 0)], self._baseAddr)
+        if isEla.any():
+            self._baseAddr = int(elaBase[np.flatnonzero(isEla)[-1]])
+
+        # Check for first address index (which is always the first line)
+        if self._lineIdx == 0 and len(records) and isEla[0]:
+            self.startAddr = int(elaBase[0])
+
+        # Place the data bytes into the image
+        dataIdx = np.flatnonzero(isData)
+        if len(dataIdx):
+            recAddr   = baseAddr[dataIdx] + addr[dataIdx]
+            mask      = np.arange(16) < byteCount[dataIdx,None]
+            addresses = (recAddr[:,None] + np.arange(16))[mask] - self.startAddr
+            values    = records[dataIdx,4:20][mask]
+            if addresses.min() < 0:
+                self._error('Data address 0x{:x} is below the start address 0x{:x}'.format(int(addresses.min()) + self.startAddr, self.startAddr))
+            top = int(addresses.max()) + 1
+            if top > len(self._buffer):
+                grown = np.full(max(top, 2*len(self._buffer)), 0xFF, dtype=np.uint8)
+                grown[:len(self._buffer)] = self._buffer
+                self._buffer = grown
+            self._buffer[addresses] = values
+            # Save the last address
+            self._endAddr = max(self._endAddr or 0, top - 1 + self.startAddr)
+
+        self._lineIdx += lineCnt
+        return done
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#-----------------------------------------------------------------------------
+# Title      : PyRogue PROM sector digests
+#-----------------------------------------------------------------------------
+# File       : _promdigest.py
+#-----------------------------------------------------------------------------
+# Description:
+# Per-sector digests of PROM images, to only reprogram the sectors that change
+#-----------------------------------------------------------------------------
+# This file is part of 'SLAC Firmware Standard Library'.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of 'SLAC Firmware Standard Library', including this file,
+# may be copied, modified, propagated, or distributed except according to
+# the terms contained in the LICENSE.txt file.
+#-----------------------------------------------------------------------------
+
+import numpy as np
+import hashlib
+import json
+import os
+
+def sectorDigest(data):
+    return hashlib.sha256(bytes(data)).hexdigest()
+
+def imageSectors(mcs, sectorSize):
+    # Split an McsReader image into sectors, padded with ones up to the sector boundary.
+    # Returns a list of (sector byte address, sector data)
+    sectorCnt = -(-mcs.size // sectorSize)
+    padded    = np.full(sectorCnt*sectorSize, 0xFF, dtype=np.uint8)
+    padded[:mcs.size] = mcs.image
+    return [(mcs.startAddr + i*sectorSize, padded[i*sectorSize:(i+1)*sectorSize]) for i in range(sectorCnt)]
+
+class PromDigestCache():
+    """
+    The digests of the sectors last programmed into the PROM of each board, saved to a JSON file and keyed by the
+    board serial number (e.g. the AxiVersion DeviceDna). A sector whose cached digest matches the new image is
+    not even read back. The cache is only as good as the assumption that nothing else reprograms the board.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._boards = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._boards = json.load(f)
+
+    def get(self, serial, address):
+        return self._boards.get(str(serial), {}).get('{:#x}'.format(address))
+
+    def update(self, serial, digests):
+        # digests: {sector byte address: digest}
+        board = self._boards.setdefault(str(serial), {})
+        for address, digest in digests.items():
+            board['{:#x}'.format(address)] = digest
+
+    def forget(self, serial):
+        self._boards.pop(str(serial), None)
+
+    def save(self):
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(self._boards, f, indent=1, sort_keys=True)
+        os.replace(tmpPath, self.path)
@@ -1,7 +1,15 @@
-
+import contextlib
+import contextvars
 import logging
+import logging.handlers
+import queue
+import struct
+import time
+
+from metrics import summarize_values
 
-log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+log_formatter = logging.Formatter(LOG_FORMAT)
 logger = logging.getLogger()
 
 # Set the starting logging level high so that this test won't be polluted with all the pyrogue debug and info log
@@ -12,4 +20,180 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(logging.Formatter("%(message)s"))
 logger.addHandler(console_handler)
 
+_board_name = contextvars.ContextVar("board_name", default=None)
+_default_record_factory = logging.getLogRecordFactory()
+
+
+def set_board_name(name):
+    """
+    Set the name of the board, e.g. its slot, that the records logged next in the current context come from, when
+    several boards are tested from the same process. The threads started with a copy of the context inherit it.
+    """
+    _board_name.set(name)
+
+
+def _board_record_factory(*args, **kwargs):
+    record = _default_record_factory(*args, **kwargs)
+    record.board_name = _board_name.get()
+    return record
+
+
+logging.setLogRecordFactory(_board_record_factory)
+
+
+class BoardFormatter(logging.Formatter):
+    """
+    Tag the message of each record with the name of the board that logged it, if any.
+    """
+    def formatMessage(self, record):
+        if getattr(record, "board_name", None):
+            record.message = "[{0}] {1}".format(record.board_name, record.message)
+        return super().formatMessage(record)
+
+
+class BoardFilter(logging.Filter):
+    """
+    Only pass the records logged by one board.
+    """
+    def __init__(self, board_name):
+        super().__init__()
+        self.board_name = board_name
+
+    def filter(self, record):
+        return getattr(record, "board_name", None) == self.board_name
+
+
+@contextlib.contextmanager
+def queued_logging():
+    """
+    Move the handlers of the global logger behind a queue, so that logging only enqueues the records, and a background
+    thread formats and writes them. The handlers are restored, with every queued record written, on exit.
+    """
+    global_logger = logging.getLogger()
+    handlers = list(global_logger.handlers)
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    for handler in handlers:
+        global_logger.removeHandler(handler)
+    global_logger.addHandler(queue_handler)
+    listener.start()
+    try:
+        yield listener
+    finally:
+        global_logger.removeHandler(queue_handler)
+        listener.stop()
+        for handler in handlers:
+            global_logger.addHandler(handler)
+
+
+class ReadbackLog:
+    """
+    Log the values read back in a stress loop as periodic summary records, instead of one record per value.
+
+    Each value is logged at the DEBUG level only, if that level is enabled when the log is created, and every
+    mismatching value at the ERROR level. Every interval_secs, a summary record gives the count of values read back,
+    the count of mismatches, and the min/p50/p99/max round-trip latency over the interval. Optionally, the detail of
+    every transaction is appended to a binary side file, as little-endian records of (timestamp: float64, index:
+    uint32, expected: uint32, value: uint32, latency_us: float32).
+
+    Use it as a context manager, to close the detail file even if the stress loop fails.
+    """
+    DETAIL_RECORD = struct.Struct("<dIIIf")
+
+    # The number of detail records to buffer before writing them
+    DETAIL_BATCH_SIZE = 4096
+
+    def __init__(self, log, label, interval_secs=10, detail_path=None):
+        """
+        Parameters
+        ----------
+        log : logging.Logger
+            The logger to log the records to
+        label : str
+            The name of the stress activity, e.g. "pyrogue"
+        interval_secs : float
+            The time between two summary records
+        detail_path : str
+            The binary file to append the detail of every transaction to, or None
+        """
+        self.log = log
+        self.label = label
+        self.interval_secs = interval_secs
+        self.count = 0
+        self.mismatches = 0
+        self._is_debug = log.isEnabledFor(logging.DEBUG)
+
+        self._detail_file = open(detail_path, "ab") if detail_path else None
+        self._detail_buffer = bytearray()
+        self._reset_interval()
+
+    def _reset_interval(self):
+        self._interval_start_time = time.time()
+        self._interval_count = 0
+        self._interval_mismatches = 0
+        self._interval_latencies = []
+
+    def record(self, expected, value, latency_secs):
+        """
+        Record a value read back.
+
+        Parameters
+        ----------
+        expected : int
+            The value written
+        value : int
+            The value read back
+        latency_secs : float
+            The round-trip time of the write and read
+        """
+        if self._is_debug:
+            self.log.debug("-- {0}: Reading value: {1} from board".format(self.label, value))
+        if value != expected:
+            self.mismatches += 1
+            self._interval_mismatches += 1
+            self.log.error("-- {0}: Read-back mismatch. Expected: {1}, read: {2}".format(self.label, expected, value))
+
+        now = time.time()
+        if self._detail_file:
+            self._detail_buffer += self.DETAIL_RECORD.pack(now, self.count & 0xFFFFFFFF, expected & 0xFFFFFFFF,
+                                                           value & 0xFFFFFFFF, latency_secs * 1e6)
+            if len(self._detail_buffer) >= self.DETAIL_BATCH_SIZE * self.DETAIL_RECORD.size:
+                self._flush_detail()
+
+        self.count += 1
+        self._interval_count += 1
+        self._interval_latencies.append(latency_secs)
+        if now - self._interval_start_time >= self.interval_secs:
+            self._log_summary()
+
+    def _log_summary(self):
+        if self._interval_count:
+            latency = summarize_values(self._interval_latencies)
+            self.log.info("-- {0}: Read back {1} values ({2} in total), {3} mismatches, latency min/p50/p99/max: "
+                          "{4:.1f}/{5:.1f}/{6:.1f}/{7:.1f} us"
+                          .format(self.label, self._interval_count, self.count, self._interval_mismatches,
+                                  latency["min"] * 1e6, latency["p50"] * 1e6, latency["p99"] * 1e6,
+                                  latency["max"] * 1e6))
+        self._reset_interval()
+
+    def _flush_detail(self):
+        self._detail_file.write(self._detail_buffer)
+        self._detail_buffer = bytearray()
+
+    def close(self):
+        """
+        Log the summary of the last interval, and close the detail file.
+        """
+        self._log_summary()
+        if self._detail_file:
+            self._flush_detail()
+            self._detail_file.close()
+            self._detail_file = None
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
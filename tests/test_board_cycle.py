@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from board_cycle import ACTIVATING, BoardCycle, run_boards
+
+
+class _FakeProber:
+    def __init__(self):
+        self.is_active = True
+
+    async def probe(self, board_ip_address):
+        return self.is_active
+
+
+class _FakeBoardTest:
+    def start_iteration(self, iteration):
+        pass
+
+    def prepare(self):
+        pass
+
+    def stress(self, iteration):
+        pass
+
+    def end_iteration(self, iteration):
+        pass
+
+    def is_retryable(self, error):
+        return False
+
+
+def test_activation_turn_wait_is_not_bounded_by_the_activating_timeout():
+    prober = _FakeProber()
+    activation_times = []
+    start_time = time.perf_counter()
+
+    def execute_cmd(cmd):
+        prober.is_active = cmd == "activate"
+        if prober.is_active:
+            activation_times.append(time.perf_counter() - start_time)
+        return 0, "", ""
+
+    async def before_activation():
+        await asyncio.sleep(0.5)
+
+    board_cycle = BoardCycle(_FakeBoardTest(), "10.0.0.1", "activate", "deactivate", execute_cmd, prober,
+                             retries=0, poll_interval_secs=0.01, state_timeouts_secs={ACTIVATING: 0.1},
+                             before_activation=before_activation)
+    assert run_boards([board_cycle]) == [None]
+    assert len(activation_times) == 1
+    assert activation_times[0] >= 0.5
@@ -0,0 +1,166 @@
+import socket
+import struct
+
+import pytest
+
+from board_emulator import BoardEmulator, LinkImpairments, Packetizer, DDR_SIZE, SRP_FOOTER, SRP_HEADER, \
+    SRP_NON_POSTED_READ, SRP_NON_POSTED_WRITE, SRP_STATUS_DECODE_ERROR, SRP_VERSION, TDEST_DDR, TDEST_REGISTERS
+from rssi import pack_rssi_header, RSSI_ACK, RSSI_SYN
+
+
+# The connection parameters of the client's SYN: version and checksum flags, 32 outstanding segments, a 1400-byte
+# maximum segment size, the timeouts, the maximum retransmissions and cumulative acknowledgements, the timeout unit,
+# and the connection id
+CLIENT_SYN_PARAMETERS = struct.pack(">BBHHHHBBBBI", 0x08, 32, 1400, 10, 5, 300, 5, 3, 0, 3, 0x1234)
+
+CLIENT_SEGMENT_SIZE = 1392
+
+
+class _RssiSrpClient:
+    """
+    A minimal SRPv3 client over the packetizer over RSSI, issuing one transaction at a time, and retransmitting the
+    segments of its request until the response arrives.
+    """
+    def __init__(self, address, packetizer_version, tdest, timeout_secs=0.1, max_retransmissions=200):
+        self.address = address
+        self.tdest = tdest
+        self.timeout_secs = timeout_secs
+        self.max_retransmissions = max_retransmissions
+        self.packetizer = Packetizer(packetizer_version)
+        self.sequence = 10
+        self.acknowledge = 0
+        self.transaction_id = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.settimeout(timeout_secs)
+        self._connect()
+
+    def close(self):
+        self.socket.close()
+
+    def _connect(self):
+        for _ in range(self.max_retransmissions):
+            self.socket.sendto(pack_rssi_header(RSSI_SYN, self.sequence, 0, CLIENT_SYN_PARAMETERS), self.address)
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+            if data[0] & RSSI_SYN:
+                self.acknowledge = data[2]
+                self.socket.sendto(pack_rssi_header(RSSI_ACK, self.sequence, self.acknowledge), self.address)
+                return
+        raise TimeoutError("No SYN-ACK from {0}".format(self.address))
+
+    def transact(self, opcode, address, size, data=b""):
+        """
+        Issue an SRPv3 request, and wait for its response.
+
+        Returns
+        -------
+        The data of the response, and the status of its footer : tuple
+        """
+        self.transaction_id += 1
+        frame = SRP_HEADER.pack(SRP_VERSION | opcode << 8, self.transaction_id, address & 0xFFFFFFFF, address >> 32,
+                                size - 1) + data
+        segments = []
+        for payload in self.packetizer.split(self.tdest, frame, CLIENT_SEGMENT_SIZE):
+            self.sequence = (self.sequence + 1) & 0xFF
+            segments.append(pack_rssi_header(RSSI_ACK, self.sequence, self.acknowledge) + payload)
+        for segment in segments:
+            self.socket.sendto(segment, self.address)
+
+        retransmissions = 0
+        response = None
+        while response is None:
+            try:
+                datagram = self.socket.recv(65536)
+            except socket.timeout:
+                retransmissions += 1
+                if retransmissions > self.max_retransmissions:
+                    raise TimeoutError("No response to the SRPv3 transaction {0}".format(self.transaction_id))
+                for segment in segments:
+                    self.socket.sendto(segment, self.address)
+                continue
+
+            header_size = datagram[1]
+            if len(datagram) <= header_size:
+                continue
+            if datagram[2] == (self.acknowledge + 1) & 0xFF:
+                self.acknowledge = datagram[2]
+                response = self.packetizer.push(datagram[header_size:])
+            # Acknowledge the segments received in order, and again the last one on a retransmission
+            self.socket.sendto(pack_rssi_header(RSSI_ACK, self.sequence, self.acknowledge), self.address)
+
+        _, response_frame = response
+        status = SRP_FOOTER.unpack_from(response_frame, len(response_frame) - SRP_FOOTER.size)[0]
+        return response_frame[SRP_HEADER.size:-SRP_FOOTER.size], status
+
+
+def _start_emulator(impairments=None):
+    emulator = BoardEmulator("127.0.0.1", impairments=impairments, ports=(0, 0, 0))
+    emulator.start()
+    return emulator
+
+
+@pytest.fixture
+def emulator():
+    emulator = _start_emulator()
+    yield emulator
+    emulator.stop()
+
+
+def _interleaved_client(emulator, tdest):
+    return _RssiSrpClient(emulator.addresses[2], 2, tdest)
+
+
+def test_register_write_read_round_trip(emulator):
+    client = _interleaved_client(emulator, TDEST_REGISTERS)
+    try:
+        for value in (0x12345678, 0xDEADBEEF, 0):
+            _, status = client.transact(SRP_NON_POSTED_WRITE, 0x4, 4, struct.pack("<I", value))
+            assert status == 0
+            data, status = client.transact(SRP_NON_POSTED_READ, 0x4, 4)
+            assert status == 0
+            assert struct.unpack("<I", data)[0] == value
+    finally:
+        client.close()
+
+
+def test_ddr_round_trip(emulator):
+    client = _interleaved_client(emulator, TDEST_DDR)
+    block = bytes(range(256)) * 64
+    try:
+        _, status = client.transact(SRP_NON_POSTED_WRITE, 0x1000, len(block), block)
+        assert status == 0
+        data, status = client.transact(SRP_NON_POSTED_READ, 0x1000, len(block))
+        assert status == 0
+        assert data == block
+    finally:
+        client.close()
+    assert bytes(emulator.ddr.read(0x1000, len(block))) == block
+
+
+def test_out_of_range_access_returns_an_error_footer(emulator):
+    client = _interleaved_client(emulator, TDEST_DDR)
+    try:
+        data, status = client.transact(SRP_NON_POSTED_READ, DDR_SIZE - 2, 4)
+    finally:
+        client.close()
+    assert status == SRP_STATUS_DECODE_ERROR
+    assert len(data) == 4
+
+
+def test_lost_segments_are_retransmitted():
+    emulator = _start_emulator(LinkImpairments(loss_rate=0.2, seed=1))
+    try:
+        client = _interleaved_client(emulator, TDEST_REGISTERS)
+        try:
+            for value in range(20):
+                client.transact(SRP_NON_POSTED_WRITE, 0x8, 4, struct.pack("<I", value))
+                data, status = client.transact(SRP_NON_POSTED_READ, 0x8, 4)
+                assert status == 0
+                assert struct.unpack("<I", data)[0] == value
+        finally:
+            client.close()
+        assert sum(server.retransmit_count for server in emulator.servers) > 0
+    finally:
+        emulator.stop()
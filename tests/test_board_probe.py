@@ -0,0 +1,77 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from board_emulator import BoardEmulator
+from board_probe import BoardProber, UdpEchoServerProtocol
+
+
+def _udp_ports(emulator):
+    return [port for _, port in emulator.addresses]
+
+
+@pytest.fixture
+def emulator():
+    emulator = BoardEmulator("127.0.0.1", ports=(0, 0, 0))
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+def test_rssi_probe_finds_an_emulated_board_alive(emulator):
+    prober = BoardProber(timeout_secs=0.5, attempts=2, udp_ports=_udp_ports(emulator), use_icmp=False)
+    assert prober.is_alive("127.0.0.1")
+
+
+def test_rssi_probe_resets_its_connection(emulator):
+    prober = BoardProber(timeout_secs=0.5, attempts=2, udp_ports=_udp_ports(emulator), use_icmp=False)
+    assert prober.is_alive("127.0.0.1")
+    deadline = time.perf_counter() + 1
+    while any(server._connections for server in emulator.servers) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert all(not server._connections for server in emulator.servers)
+
+
+def test_rssi_probe_finds_a_powered_off_board_unresponsive(emulator):
+    emulator.set_powered(False)
+    prober = BoardProber(timeout_secs=0.2, attempts=2, interval_secs=0.05, udp_ports=_udp_ports(emulator),
+                         use_icmp=False)
+    assert not prober.is_alive("127.0.0.1")
+
+
+def test_rssi_probe_finds_a_udp_echo_stand_in_alive():
+    async def _probe():
+        loop = asyncio.get_event_loop()
+        transport, _ = await loop.create_datagram_endpoint(UdpEchoServerProtocol, local_addr=("127.0.0.1", 0))
+        try:
+            prober = BoardProber(timeout_secs=0.5, attempts=2, udp_ports=[transport.get_extra_info("sockname")[1]],
+                                 use_icmp=False)
+            return await prober.probe("127.0.0.1")
+        finally:
+            transport.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(_probe())
+    finally:
+        loop.close()
+
+
+def test_rssi_probe_finds_a_silent_port_unresponsive():
+    # A bound socket that never answers, as an RSSI server discarding the probe
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as silent_socket:
+        silent_socket.bind(("127.0.0.1", 0))
+        prober = BoardProber(timeout_secs=0.2, attempts=2, interval_secs=0.05,
+                             udp_ports=[silent_socket.getsockname()[1]], use_icmp=False)
+        assert not prober.is_alive("127.0.0.1")
+
+
+def test_rssi_probe_finds_a_closed_port_alive():
+    # An ICMP port unreachable shows that the host's network stack is up
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as closed_socket:
+        closed_socket.bind(("127.0.0.1", 0))
+        closed_port = closed_socket.getsockname()[1]
+    prober = BoardProber(timeout_secs=0.5, attempts=2, udp_ports=[closed_port], use_icmp=False)
+    assert prober.is_alive("127.0.0.1")
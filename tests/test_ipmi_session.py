@@ -0,0 +1,112 @@
+import pytest
+
+import main
+from board_cycle import parse_hot_swap_state
+from fake_shelf_manager import FakeShelfManager
+from ipmi_session import IpmiSessionPool
+
+BOARD_TARGET = 0x8C
+
+
+@pytest.fixture
+def shelf_manager():
+    shelf_manager = FakeShelfManager("127.0.0.1", port=0)
+    shelf_manager.start()
+    yield shelf_manager
+    shelf_manager.stop()
+
+
+@pytest.fixture
+def pool():
+    pool = IpmiSessionPool(timeout_secs=0.5, retries=2)
+    yield pool
+    pool.close()
+
+
+def _ipmitool_cmd(shelf_manager, command):
+    return "ipmitool -I lan -H 127.0.0.1 -p {0} -t 0x{1:x} -b 0 -A NONE {2}".format(shelf_manager.address[1],
+                                                                                    BOARD_TARGET, command)
+
+
+def _hot_swap_state(shelf_manager, pool):
+    result = pool.run(_ipmitool_cmd(shelf_manager, 'sensor get "Hot Swap"'))
+    assert result.return_code == 0
+    return parse_hot_swap_state(result.stdout)
+
+
+def test_sensor_get_reports_the_hot_swap_state(shelf_manager, pool):
+    result = pool.run(_ipmitool_cmd(shelf_manager, 'sensor get "Hot Swap"'))
+    assert result.return_code == 0
+    assert result.value == {"Hot Swap": [4]}
+    assert "[M4: FRU Active]" in result.stdout
+
+
+def test_picmg_deactivate_and_activate(shelf_manager, pool):
+    assert pool.run(_ipmitool_cmd(shelf_manager, "picmg deactivate 0")).return_code == 0
+    assert shelf_manager.get_board(BOARD_TARGET).hot_swap_state == 1
+    assert _hot_swap_state(shelf_manager, pool) == 1
+
+    assert pool.run(_ipmitool_cmd(shelf_manager, "picmg activate 0")).return_code == 0
+    assert _hot_swap_state(shelf_manager, pool) == 4
+
+
+def test_picmg_policy_set_unlocks_an_inactive_board(shelf_manager, pool):
+    pool.run(_ipmitool_cmd(shelf_manager, "picmg deactivate 0"))
+    assert _hot_swap_state(shelf_manager, pool) == 1
+
+    assert pool.run(_ipmitool_cmd(shelf_manager, "picmg policy set 0 1 0")).return_code == 0
+    assert not shelf_manager.get_board(BOARD_TARGET).locked
+    assert _hot_swap_state(shelf_manager, pool) == 4
+
+
+def test_unknown_sensor_fails(shelf_manager, pool):
+    result = pool.run(_ipmitool_cmd(shelf_manager, 'sensor get "Temp"'))
+    assert result.return_code == 1
+    assert result.stderr
+
+
+@pytest.mark.parametrize("command", ["mc info", "chassis status", "picmg deactivate"])
+def test_unsupported_commands_are_not_run_natively(shelf_manager, pool, command):
+    assert pool.run(_ipmitool_cmd(shelf_manager, command)) is None
+
+
+@pytest.mark.parametrize("cmd", ["ipmitool -I lanplus -H 127.0.0.1 -t 0x8c -b 0 -A NONE mc info",
+                                 "ipmitool -I lan -H 127.0.0.1 -t 0x8c -U admin picmg deactivate 0",
+                                 "echo picmg deactivate 0"])
+def test_unsupported_command_lines_are_not_run_natively(pool, cmd):
+    assert pool.run(cmd) is None
+
+
+class _RecordingPopen:
+    """
+    Record the command lines run through Popen instead of running them.
+    """
+    cmds = []
+
+    def __init__(self, cmd, **kwargs):
+        self.cmds.append(cmd)
+        self.returncode = 0
+
+    def communicate(self):
+        return b"ipmitool output\n", b""
+
+
+def test_execute_cmd_runs_supported_commands_natively(shelf_manager, pool, monkeypatch):
+    monkeypatch.setattr(main, "ipmi_sessions", pool)
+    monkeypatch.setattr(main, "Popen", _RecordingPopen)
+    _RecordingPopen.cmds = []
+
+    return_code, stdout, _ = main._execute_cmd(_ipmitool_cmd(shelf_manager, 'sensor get "Hot Swap"'))
+    assert return_code == 0
+    assert parse_hot_swap_state(stdout) == 4
+    assert _RecordingPopen.cmds == []
+
+
+def test_execute_cmd_falls_back_to_popen(shelf_manager, pool, monkeypatch):
+    monkeypatch.setattr(main, "ipmi_sessions", pool)
+    monkeypatch.setattr(main, "Popen", _RecordingPopen)
+    _RecordingPopen.cmds = []
+
+    cmd = _ipmitool_cmd(shelf_manager, "mc info")
+    assert main._execute_cmd(cmd) == (0, "ipmitool output\n", "")
+    assert _RecordingPopen.cmds == [cmd]
@@ -0,0 +1,343 @@
+# Record and replay of the SRPv3 transactions between pyrogue and the board
+
+import argparse
+import collections
+import struct
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+from board_emulator import SRP_HEADER, SRP_FOOTER, SRP_VERSION, SRP_NON_POSTED_READ, SRP_NON_POSTED_WRITE, \
+    SRP_POSTED_WRITE, SRP_NULL
+from metrics import summarize_latencies, format_latency_summary
+from transactions import TransactionWindow
+
+try:
+    import rogue.interfaces.memory as rim
+    import rogue.interfaces.stream as ris
+    _StreamSlave = ris.Slave
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+    _StreamSlave = object
+
+
+TRACE_MAGIC = b"SWTRACE\x01"
+
+# A trace record: (timestamp: float64 seconds since the epoch, kind: uint8, tDest: uint8, opcode: uint8,
+# status: uint8, transaction ID: uint32, address: uint64, size: uint32, data length: uint32), followed by the data
+# length bytes of the payload of a write request
+TRACE_RECORD = struct.Struct("<dBBBBIQII")
+
+# The record kinds. A marker record carries the test iteration number in its transaction ID.
+RECORD_REQUEST = 0
+RECORD_RESPONSE = 1
+RECORD_MARKER = 2
+
+TraceRecord = collections.namedtuple("TraceRecord", ["timestamp", "kind", "tdest", "opcode", "status", "tid",
+                                                     "address", "size", "data"])
+
+OPCODE_NAMES = {SRP_NON_POSTED_READ: "read", SRP_NON_POSTED_WRITE: "write", SRP_POSTED_WRITE: "posted_write",
+                SRP_NULL: "null"}
+
+
+class TraceRecorder:
+    """
+    Record every SRPv3 request and response frame between pyrogue and the board into a binary trace file, with
+    stream taps on the SRPv3 instance and on the RSSI application stream of each tDest.
+
+    The records are written as the frames pass, through a fixed-size file buffer, so that the memory use stays bounded
+    over a multi-hour capture. Only the payloads of the write requests are kept, so that the writes can be replayed.
+    """
+    def __init__(self, path, max_bytes=None, buffer_size=1 << 20):
+        """
+        Parameters
+        ----------
+        path : str
+            The trace file to write
+        max_bytes : int
+            The size at which to stop recording, or None to record until closed
+        buffer_size : int
+            The size of the file buffer, in bytes
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.records = 0
+        self.bytes_written = len(TRACE_MAGIC)
+        self._file = open(path, "wb", buffering=buffer_size)
+        self._file.write(TRACE_MAGIC)
+        self._lock = threading.Lock()
+        self._is_full = False
+        self._taps = []
+
+    def tap(self, tdest, is_response):
+        """
+        Create a stream tap recording the frames of a tDest, e.g. to attach with pr.streamTap(srp, tap) for the
+        requests, and pr.streamTap(rudp.application(dest=tdest), tap) for the responses.
+        """
+        tap = _TraceTap(self, tdest, is_response)
+        self._taps.append(tap)
+        return tap
+
+    def record_frame(self, tdest, is_response, frame, timestamp=None):
+        """
+        Record an SRPv3 request or response frame.
+        """
+        if len(frame) < SRP_HEADER.size:
+            return
+        header_word, tid, address_low, address_high, request_size = SRP_HEADER.unpack_from(frame)
+        if header_word & 0xFF != SRP_VERSION:
+            return
+
+        opcode = (header_word >> 8) & 0x3
+        status = 0
+        data = b""
+        if is_response:
+            if len(frame) >= SRP_HEADER.size + SRP_FOOTER.size:
+                status = min(SRP_FOOTER.unpack_from(frame, len(frame) - SRP_FOOTER.size)[0], 0xFF)
+        elif opcode in (SRP_NON_POSTED_WRITE, SRP_POSTED_WRITE):
+            data = bytes(frame[SRP_HEADER.size:SRP_HEADER.size + request_size + 1])
+        self._write(TRACE_RECORD.pack(time.time() if timestamp is None else timestamp,
+                                      RECORD_RESPONSE if is_response else RECORD_REQUEST, tdest, opcode, status, tid,
+                                      address_high << 32 | address_low, request_size + 1, len(data)) + data)
+
+    def mark(self, iteration):
+        """
+        Record the start of a test iteration, to replay the traffic of selected iterations only.
+        """
+        self._write(TRACE_RECORD.pack(time.time(), RECORD_MARKER, 0, 0, 0, iteration, 0, 0, 0))
+
+    def _write(self, record):
+        with self._lock:
+            if self._is_full or self._file.closed:
+                return
+            if self.max_bytes and self.bytes_written + len(record) > self.max_bytes:
+                self._is_full = True
+                logger.warning("The transaction trace {0} reached {1} bytes. Recording stopped."
+                               .format(self.path, self.bytes_written))
+                return
+            self._file.write(record)
+            self.records += 1
+            self.bytes_written += len(record)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        logger.info("Recorded {0} transaction trace records, {1} bytes, to {2}"
+                    .format(self.records, self.bytes_written, self.path))
+
+
+class _TraceTap(_StreamSlave):
+    def __init__(self, recorder, tdest, is_response):
+        _StreamSlave.__init__(self)
+        self._recorder = recorder
+        self._tdest = tdest
+        self._is_response = is_response
+
+    def _acceptFrame(self, frame):
+        data = bytearray(frame.getPayload())
+        frame.read(data, 0)
+        self._recorder.record_frame(self._tdest, self._is_response, data)
+
+
+def read_trace(path, first_iteration=None, last_iteration=None):
+    """
+    Read the records of a trace file, one at a time.
+
+    Parameters
+    ----------
+    path : str
+        The trace file
+    first_iteration : int
+        The test iteration to start reading at, from its marker record, or None to start at the first record
+    last_iteration : int
+        The last test iteration to read, or None to read to the end
+
+    Returns
+    -------
+    The trace records, in the order they were recorded : generator of TraceRecord
+
+    Raises ValueError
+    """
+    with open(path, "rb") as trace_file:
+        if trace_file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("{0} is not a transaction trace file".format(path))
+
+        is_selected = first_iteration is None
+        while True:
+            fields = trace_file.read(TRACE_RECORD.size)
+            if len(fields) < TRACE_RECORD.size:
+                return
+            timestamp, kind, tdest, opcode, status, tid, address, size, data_length = TRACE_RECORD.unpack(fields)
+            data = trace_file.read(data_length)
+            if kind == RECORD_MARKER:
+                if last_iteration is not None and tid > last_iteration:
+                    return
+                if first_iteration is not None and tid >= first_iteration:
+                    is_selected = True
+            if is_selected:
+                yield TraceRecord(timestamp, kind, tdest, opcode, status, tid, address, size, data)
+
+
+def summarize_trace(path, first_iteration=None, last_iteration=None, max_pending=65536):
+    """
+    Count the requests of a trace by tDest and operation, with their recorded errors and round-trip latency. The
+    responses are matched to the requests by tDest and transaction ID, keeping up to max_pending unanswered requests.
+
+    Returns
+    -------
+    The trace summary : dict
+    """
+    counts = collections.Counter()
+    errors = collections.Counter()
+    latencies = []
+    pending = collections.OrderedDict()
+    first_timestamp = last_timestamp = None
+    iterations = []
+
+    for record in read_trace(path, first_iteration, last_iteration):
+        first_timestamp = first_timestamp or record.timestamp
+        last_timestamp = record.timestamp
+        if record.kind == RECORD_MARKER:
+            iterations.append(record.tid)
+        elif record.kind == RECORD_REQUEST:
+            counts["tdest{0}_{1}".format(record.tdest, OPCODE_NAMES[record.opcode])] += 1
+            pending[(record.tdest, record.tid)] = record.timestamp
+            if len(pending) > max_pending:
+                pending.popitem(last=False)
+        else:
+            request_timestamp = pending.pop((record.tdest, record.tid), None)
+            if request_timestamp is not None:
+                latencies.append(record.timestamp - request_timestamp)
+            if record.status:
+                errors["tdest{0}_{1}".format(record.tdest, OPCODE_NAMES[record.opcode])] += 1
+
+    duration_secs = (last_timestamp - first_timestamp) if first_timestamp else 0.0
+    summary = summarize_latencies(latencies, duration_secs)
+    summary.update({
+        "duration_secs": duration_secs,
+        "iterations": [iterations[0], iterations[-1]] if iterations else None,
+        "requests": dict(counts),
+        "errors": dict(errors),
+        "unanswered": len(pending),
+    })
+    return summary
+
+
+def replay_trace(path, targets, speed=1.0, in_flight_depth=8, first_iteration=None, last_iteration=None,
+                 include_writes=True):
+    """
+    Re-issue the requests of a trace on a board or a board emulator.
+
+    Parameters
+    ----------
+    path : str
+        The trace file
+    targets : dict
+        The pyrogue device to issue the requests of each tDest on, with an offset of 0 on the SRPv3 instance of the
+        tDest, e.g. {0x0: FpgaTopLevel.AmcCarrierCore, 0x4: FpgaTopLevel.DDR}. The requests of the other tDests are
+        skipped.
+    speed : float
+        The replay speed relative to the recording, e.g. 1.0 for the original timing or 10.0 for 10 times faster, or 0
+        to replay as fast as possible
+    in_flight_depth : int
+        The maximum number of transactions in flight on each tDest
+    first_iteration : int
+        The first test iteration to replay, or None to replay from the start
+    last_iteration : int
+        The last test iteration to replay, or None to replay to the end
+    include_writes : bool
+        True to replay the writes, with their recorded payloads; False to replay the reads only
+
+    Returns
+    -------
+    The replay summary: the requests replayed and skipped, the transaction errors, and the round-trip latency : dict
+    """
+    windows = {tdest: TransactionWindow(device, depth=in_flight_depth) for tdest, device in targets.items()}
+    txn_types = {SRP_NON_POSTED_READ: rim.Read, SRP_NON_POSTED_WRITE: rim.Write, SRP_POSTED_WRITE: rim.Post}
+    replayed = skipped = 0
+    first_timestamp = None
+
+    logger.info("Replaying {0} at {1}".format(path, "full speed" if not speed else "{0:g}x speed".format(speed)))
+    start_time = time.perf_counter()
+    for record in read_trace(path, first_iteration, last_iteration):
+        if record.kind != RECORD_REQUEST:
+            continue
+        window = windows.get(record.tdest)
+        if window is None or record.opcode not in txn_types or \
+                (not include_writes and record.opcode != SRP_NON_POSTED_READ):
+            skipped += 1
+            continue
+
+        first_timestamp = first_timestamp or record.timestamp
+        if speed:
+            delay_secs = start_time + (record.timestamp - first_timestamp) / speed - time.perf_counter()
+            if delay_secs > 0:
+                time.sleep(delay_secs)
+
+        data = bytearray(record.data) if record.opcode != SRP_NON_POSTED_READ else bytearray(record.size)
+        window.submit(record.address, data, txn_types[record.opcode], operation="replay")
+        replayed += 1
+    for window in windows.values():
+        window.drain()
+    elapsed_secs = time.perf_counter() - start_time
+
+    summary = summarize_latencies([latency for window in windows.values() for latency in window.latencies],
+                                  elapsed_secs)
+    summary.update({
+        "replayed": replayed,
+        "skipped": skipped,
+        "errors": sum(window.errors for window in windows.values()),
+        "elapsed_secs": elapsed_secs,
+    })
+    logger.info("Replayed {0} requests ({1} skipped) in {2:.1f} seconds: {3}, {4} errors"
+                .format(replayed, skipped, elapsed_secs, format_latency_summary(summary), summary["errors"]))
+    return summary
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Summarize or replay a transaction trace.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    for command in ("summary", "replay"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("trace", help="The transaction trace file.")
+        subparser.add_argument("--first-iteration", type=int, help="The first test iteration of the trace to use.")
+        subparser.add_argument("--last-iteration", type=int, help="The last test iteration of the trace to use.")
+
+    replay_parser = subparsers.choices["replay"]
+    replay_parser.add_argument("--board-ip", help="The IP address of the board to replay on. Defaults to a local "
+                                                  "board emulator.")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="The replay speed relative to the recording, or 0 for full speed.")
+    replay_parser.add_argument("--in-flight-depth", type=int, default=8)
+    replay_parser.add_argument("--reads-only", action="store_true", help="Do not replay the writes.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+
+    if args.command == "summary":
+        summary = summarize_trace(args.trace, args.first_iteration, args.last_iteration)
+        logger.info("Trace of {0:.1f} seconds, iterations {1}: {2}, {3} unanswered requests"
+                    .format(summary["duration_secs"], summary["iterations"], format_latency_summary(summary),
+                            summary["unanswered"]))
+        for name, count in sorted(summary["requests"].items()):
+            logger.info("    {0}: {1} requests, {2} errors".format(name, count, summary["errors"].get(name, 0)))
+    else:
+        from benchmark import BoardSession
+        session = BoardSession(args.board_ip)
+        try:
+            summary = replay_trace(args.trace, {0x0: session.root.FpgaTopLevel.AmcCarrierCore,
+                                                0x4: session.root.FpgaTopLevel.DDR},
+                                   speed=args.speed, in_flight_depth=args.in_flight_depth,
+                                   first_iteration=args.first_iteration, last_iteration=args.last_iteration,
+                                   include_writes=not args.reads_only)
+        finally:
+            session.close()
+        if summary["errors"]:
+            raise SystemExit(1)
@@ -0,0 +1,146 @@
+# Pipelined raw memory transactions on a pyrogue Device
+
+import collections
+import struct
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import record_latency
+
+try:
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+InFlightTransaction = collections.namedtuple("InFlightTransaction", ["txn_id", "issue_time", "offset", "data",
+                                                                     "txn_type", "on_complete", "operation"])
+
+
+class TransactionWindow:
+    """
+    Keep up to a fixed number of raw memory transactions in flight on a pyrogue Device.
+
+    The transactions are issued with the same memory master API that pyrogue uses for the block background
+    transactions (_reqTransaction), and are retired in issue order. SRPv3 over RSSI delivers the transactions in order,
+    so a read issued after a write to the same address always returns the written value, no matter how many other
+    transactions are still in flight.
+    """
+    def __init__(self, device, depth=32):
+        """
+        Parameters
+        ----------
+        device : pr.Device
+            The device whose memory master issues the transactions. Offsets are relative to this device.
+        depth : int
+            The maximum number of transactions in flight
+        """
+        if depth < 1:
+            raise ValueError("Invalid in-flight depth ({0})".format(depth))
+
+        self.device = device
+        self.depth = depth
+        self.latencies = []
+        self.errors = 0
+        self._in_flight = collections.deque()
+
+    def submit(self, offset, data, txn_type, on_complete=None, operation=None):
+        """
+        Issue a transaction, retiring the oldest one first if the window is full.
+
+        Parameters
+        ----------
+        offset : int
+            The byte offset, relative to the device
+        data : bytearray
+            The write payload, or the buffer to receive the read data. The read size is the buffer size.
+        txn_type : int
+            rim.Read, rim.Write or rim.Post
+        on_complete : callable
+            Called as on_complete(transaction, error) once the transaction is retired
+        operation : str
+            The operation to record the latency of the transaction as, e.g. "register_write", or None not to record it
+        """
+        while len(self._in_flight) >= self.depth:
+            self.retire_oldest()
+
+        issue_time = time.perf_counter()
+        txn_id = self.device._reqTransaction(self.device.offset | offset, data, len(data), 0, txn_type)
+        self._in_flight.append(InFlightTransaction(txn_id, issue_time, offset, data, txn_type, on_complete, operation))
+
+    def retire_oldest(self):
+        """
+        Wait for the oldest in-flight transaction, and record its round-trip latency.
+
+        Returns
+        -------
+        The retired transaction : InFlightTransaction
+        """
+        transaction = self._in_flight.popleft()
+        self.device._waitTransaction(transaction.txn_id)
+        latency_secs = time.perf_counter() - transaction.issue_time
+        self.latencies.append(latency_secs)
+        if transaction.operation:
+            record_latency(transaction.operation, latency_secs)
+
+        error = self.device._getError()
+        if error:
+            self.errors += 1
+            self.device._clearError()
+        if transaction.on_complete:
+            transaction.on_complete(transaction, error)
+        return transaction
+
+    def drain(self):
+        """
+        Retire every transaction still in flight.
+        """
+        while self._in_flight:
+            self.retire_oldest()
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+
+class SharedTransactionWindow(TransactionWindow):
+    """
+    A transaction window shared by several threads, which take turns at issuing and retiring the transactions.
+
+    A pyrogue Device reports the errors of its transactions together, not per transaction. So when several windows have
+    transactions in flight on the same device, a failed transaction of one window may be counted, and cleared, by
+    another. Threads issuing concurrent traffic to the same device share one window instead, which retires all their
+    transactions in issue order.
+    """
+    def __init__(self, device, depth=32):
+        super().__init__(device, depth=depth)
+        self._lock = threading.RLock()
+
+    def submit(self, offset, data, txn_type, on_complete=None, operation=None):
+        with self._lock:
+            super().submit(offset, data, txn_type, on_complete=on_complete, operation=operation)
+
+    def retire_oldest(self):
+        with self._lock:
+            return super().retire_oldest()
+
+    def drain(self):
+        with self._lock:
+            super().drain()
+
+
+def pack_word(value):
+    """
+    Pack a 32-bit register value the way the SRPv3 bus carries it (little-endian).
+    """
+    return bytearray(struct.pack("<I", value & 0xFFFFFFFF))
+
+
+def unpack_word(data):
+    """
+    Unpack a 32-bit register value from a transaction buffer.
+    """
+    return struct.unpack_from("<I", data)[0]
@@ -0,0 +1,366 @@
+# Declarative register and DDR stress workloads, compiled into transaction plans
+
+import collections
+import contextvars
+import functools
+import itertools
+import threading
+import time
+
+from switchtest_logging import logging
+logger = logging.getLogger(__name__)
+
+from metrics import summarize_latencies, format_latency_summary
+from transactions import TransactionWindow, SharedTransactionWindow
+from ddr_benchmark import DDR_WINDOW_SIZE
+from ddr_integrity import build_pattern, find_mismatches, MISMATCH_REPORT_COUNT
+from open_loop import TokenBucket
+from poll_scheduler import variable_span
+
+try:
+    import numpy as np
+    import rogue.interfaces.memory as rim
+except ImportError as import_error:
+    logger.debug("ImportError exception: {0}. Make sure you've sourced the pyrogue env script.".format(import_error))
+
+
+WORKLOAD_OPERATIONS = ("write", "read", "verify")
+
+# The number of distinct register values written by a register step before its plan repeats
+REGISTER_PLAN_CYCLES = 256
+
+# A compiled workload step. Each plan is the flat list of the (offset, data, transaction type, operation name,
+# on_complete) transactions of one worker, run cyclically.
+CompiledStep = collections.namedtuple("CompiledStep", ["name", "device", "plans", "verifiers", "transactions_per_cycle",
+                                                       "bytes_per_cycle", "count", "in_flight_depth", "ops_per_sec",
+                                                       "duration_secs", "repeat"])
+
+
+def _parse_int(value):
+    """
+    Parse a workload integer setting, given as an int or as a string such as "0x400000".
+    """
+    return value if isinstance(value, int) else int(str(value), 0)
+
+
+def mix_cycle(mix):
+    """
+    Expand the read/write/verify weights of a workload step into the operations of one cycle: the writes first, then
+    the reads and the verified reads interleaved in proportion to their weights.
+
+    Parameters
+    ----------
+    mix : dict
+        The integer weight of each operation, e.g. {"write": 1, "verify": 1}
+
+    Returns
+    -------
+    The operations of one cycle : list
+
+    Raises ValueError
+    """
+    invalid_operations = set(mix) - set(WORKLOAD_OPERATIONS)
+    if invalid_operations or not any(mix.values()) or any(int(weight) < 0 for weight in mix.values()):
+        raise ValueError("Invalid workload mix ({0}). Give non-negative weights to {1}."
+                         .format(mix, ", ".join(WORKLOAD_OPERATIONS)))
+
+    cycle = ["write"] * int(mix.get("write", 0))
+    weights = {name: int(mix.get(name, 0)) for name in ("read", "verify") if int(mix.get(name, 0))}
+    credits = dict.fromkeys(weights, 0)
+    for _ in range(sum(weights.values())):
+        for name in weights:
+            credits[name] += weights[name]
+        name = max(credits, key=lambda name: credits[name])
+        credits[name] -= sum(weights.values())
+        cycle.append(name)
+    return cycle
+
+
+class _Verifier:
+    """
+    Count the transactions reading back other data than expected, for one worker of a step.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.mismatches = 0
+
+    def check(self, expected, transaction, error):
+        if error or transaction.data == expected:
+            return
+        self.mismatches += 1
+        if self.mismatches <= MISMATCH_REPORT_COUNT:
+            count, first_mismatches = find_mismatches(np.frombuffer(expected, dtype=np.uint32),
+                                                      np.frombuffer(transaction.data, dtype=np.uint32),
+                                                      transaction.offset)
+            logger.error("-- pyrogue: Workload step '{0}': {1} mismatching words at offset 0x{2:08X}. First mismatches "
+                         "(offset, expected, read): {3}"
+                         .format(self.name, count, transaction.offset,
+                                 ", ".join("(0x{0:08X}, 0x{1:08X}, 0x{2:08X})".format(*mismatch)
+                                           for mismatch in first_mismatches)))
+
+
+def _resolve_variable(top_level, path):
+    variable = top_level
+    for name in path.split("."):
+        if not hasattr(variable, name):
+            raise ValueError("Invalid workload register path '{0}': {1} has no '{2}'".format(path, variable.path, name))
+        variable = getattr(variable, name)
+    return variable
+
+
+def _plan_cycles(cycle_builder, cycle_count, transactions_per_cycle, in_flight_depth):
+    """
+    Build the transactions of enough cycles that no buffer of the plan is reused while it is still in flight.
+    """
+    cycle_count = max(cycle_count, -(-(in_flight_depth + 1) // transactions_per_cycle))
+    return [transaction for cycle_index in range(cycle_count) for transaction in cycle_builder(cycle_index)]
+
+
+def _compile_register_step(name, top_level, step_configs, cycle, concurrency, in_flight_depth):
+    variable = _resolve_variable(top_level, step_configs["register"])
+    device = variable.parent
+    offset, size = variable_span(variable)
+    if "verify" in cycle and "write" not in cycle:
+        raise ValueError("Invalid workload step '{0}': verified register reads need writes in the mix".format(name))
+    if "write" in cycle and concurrency > 1:
+        raise ValueError("Invalid workload step '{0}': concurrent workers cannot write the same register"
+                         .format(name))
+
+    verifiers = [_Verifier(name) for _ in range(concurrency)]
+    plans = []
+    for verifier in verifiers:
+        def _build_cycle(cycle_index, verifier=verifier):
+            value = (cycle_index & 0xFFFFFFFF).to_bytes(4, "little") * (size // 4)
+            transactions = []
+            for operation in cycle:
+                if operation == "write":
+                    transactions.append((offset, bytearray(value), rim.Write, "register_write", None))
+                elif operation == "read":
+                    transactions.append((offset, bytearray(size), rim.Read, "register_read", None))
+                else:
+                    transactions.append((offset, bytearray(size), rim.Read, "register_read",
+                                         functools.partial(verifier.check, bytearray(value))))
+            return transactions
+        plans.append(_plan_cycles(_build_cycle, REGISTER_PLAN_CYCLES, len(cycle), in_flight_depth))
+    return device, plans, verifiers, len(cycle), size * len(cycle)
+
+
+def _compile_ddr_step(name, ddr, step_configs, cycle, concurrency, in_flight_depth):
+    ddr_configs = step_configs["ddr"]
+    offset = _parse_int(ddr_configs.get("offset", 0))
+    size = _parse_int(ddr_configs.get("size", 0x400000))
+    block_size = _parse_int(ddr_configs.get("block_size", 0x10000))
+    pattern = ddr_configs.get("pattern", "address")
+    seed = int(ddr_configs.get("seed", 1))
+    if block_size <= 0 or block_size % 4 or offset % 4 or size < block_size or offset + size > DDR_WINDOW_SIZE:
+        raise ValueError("Invalid workload step '{0}': DDR range 0x{1:X}+0x{2:X} with 0x{3:X} byte blocks. Use blocks "
+                         "of a positive multiple of 4 bytes, within the 0x{4:X} byte DDR window."
+                         .format(name, offset, size, block_size, DDR_WINDOW_SIZE))
+
+    transaction_size = min(block_size, ddr._reqMaxAccess())
+    chunk_offsets = range(0, block_size, transaction_size)
+    block_offsets = range(offset, offset + size - block_size + 1, block_size)
+    verifiers = [_Verifier(name) for _ in range(concurrency)]
+    plans = []
+    for worker_index, verifier in enumerate(verifiers):
+        # The workers take turns at the blocks, so that they never write the same block
+        worker_block_offsets = block_offsets[worker_index::concurrency]
+        if not worker_block_offsets:
+            raise ValueError("Invalid workload step '{0}': fewer DDR blocks than workers".format(name))
+
+        def _build_cycle(cycle_index, worker_block_offsets=worker_block_offsets, verifier=verifier):
+            block_offset = worker_block_offsets[cycle_index % len(worker_block_offsets)]
+            data = None
+            if "write" in cycle or "verify" in cycle:
+                data = memoryview(build_pattern(pattern, block_offset, block_size // 4, seed=seed)).cast("B")
+            transactions = []
+            for operation in cycle:
+                for chunk_offset in chunk_offsets:
+                    chunk_size = min(transaction_size, block_size - chunk_offset)
+                    if operation == "write":
+                        transactions.append((block_offset + chunk_offset, data[chunk_offset:chunk_offset + chunk_size],
+                                             rim.Write, "ddr_write", None))
+                    elif operation == "read":
+                        transactions.append((block_offset + chunk_offset, bytearray(chunk_size), rim.Read,
+                                             "ddr_read", None))
+                    else:
+                        transactions.append((block_offset + chunk_offset, bytearray(chunk_size), rim.Read, "ddr_read",
+                                             functools.partial(verifier.check,
+                                                               data[chunk_offset:chunk_offset + chunk_size])))
+            return transactions
+        plans.append(_plan_cycles(_build_cycle, len(worker_block_offsets), len(cycle) * len(chunk_offsets),
+                                  in_flight_depth))
+    return ddr, plans, verifiers, len(cycle) * len(chunk_offsets), block_size * len(cycle)
+
+
+def compile_workload(top_level, workload_configs):
+    """
+    Compile the steps of a declarative workload into transaction plans.
+
+    All the work that does not depend on the transaction results is done here, once: the register paths are resolved,
+    the read/write/verify mix is expanded, and the write data, the read buffers and the expected read-back data of
+    every transaction are built. Running a step then only issues the planned transactions, cyclically.
+
+    Parameters
+    ----------
+    top_level : pr.Device
+        The FpgaTopLevel device the register paths are relative to
+    workload_configs : dict
+        The workload, with its "steps", each with either a "register" path or a "ddr" {"offset", "size",
+        "block_size", "pattern", "seed"} range, and its "mix", "count", "concurrency", "in_flight_depth",
+        "ops_per_sec", "duration_secs" and "repeat" settings
+
+    Returns
+    -------
+    The compiled steps : list of CompiledStep
+
+    Raises ValueError
+    """
+    steps = []
+    for step_index, step_configs in enumerate(workload_configs.get("steps", [])):
+        name = step_configs.get("name", "step{0}".format(step_index))
+        cycle = mix_cycle(step_configs.get("mix", {"write": 1, "verify": 1}))
+        concurrency = int(step_configs.get("concurrency", 1))
+        in_flight_depth = int(step_configs.get("in_flight_depth", 32))
+        count = int(step_configs.get("count", 0))
+        duration_secs = float(step_configs.get("duration_secs", 0))
+        if concurrency < 1 or in_flight_depth < 1 or not (count > 0 or duration_secs > 0):
+            raise ValueError("Invalid workload step '{0}': use a positive concurrency and in-flight depth, and a "
+                             "positive count or duration".format(name))
+
+        if "register" in step_configs:
+            device, plans, verifiers, transactions_per_cycle, bytes_per_cycle = _compile_register_step(
+                name, top_level, step_configs, cycle, concurrency, in_flight_depth)
+        elif "ddr" in step_configs:
+            device, plans, verifiers, transactions_per_cycle, bytes_per_cycle = _compile_ddr_step(
+                name, top_level.DDR, step_configs, cycle, concurrency, in_flight_depth)
+        else:
+            raise ValueError("Invalid workload step '{0}': give a 'register' path or a 'ddr' range".format(name))
+
+        steps.append(CompiledStep(name, device, plans, verifiers, transactions_per_cycle, bytes_per_cycle, count,
+                                  in_flight_depth, float(step_configs.get("ops_per_sec", 0)), duration_secs,
+                                  int(step_configs.get("repeat", 1))))
+    if not steps:
+        raise ValueError("Invalid workload: no steps")
+    return steps
+
+
+def _run_worker(window, plan, transaction_count, bucket, bucket_lock, deadline, result):
+    submit = window.submit
+    issued = 0
+    transactions = itertools.islice(itertools.cycle(plan), transaction_count)
+    if bucket is None and deadline is None:
+        for offset, data, txn_type, operation, on_complete in transactions:
+            submit(offset, data, txn_type, on_complete=on_complete, operation=operation)
+            issued += 1
+    else:
+        for offset, data, txn_type, operation, on_complete in transactions:
+            if bucket is not None:
+                with bucket_lock:
+                    due_time = bucket.take(time.perf_counter())
+                wait_secs = due_time - time.perf_counter()
+                if wait_secs > 0:
+                    time.sleep(wait_secs)
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            submit(offset, data, txn_type, on_complete=on_complete, operation=operation)
+            issued += 1
+    window.drain()
+    result.update(issued=issued)
+
+
+def run_workload_step(step):
+    """
+    Run one compiled workload step: its workers issue their planned transactions concurrently, until the step's cycle
+    count is reached or its duration has elapsed, at up to its target transaction rate, shared between the workers.
+    The workers share one transaction window on the step's device, so that the device's transaction errors are
+    counted in issue order.
+
+    Returns
+    -------
+    The step summary: the transactions issued, the throughput, the latency summary, and the transaction errors and
+    read-back mismatches : dict
+    """
+    if step.count:
+        # Split the cycles between the workers, as evenly as possible
+        cycle_counts = [step.count // len(step.plans) + (index < step.count % len(step.plans))
+                        for index in range(len(step.plans))]
+    else:
+        cycle_counts = [None] * len(step.plans)
+
+    mismatches = sum(verifier.mismatches for verifier in step.verifiers)
+    start_time = time.perf_counter()
+    bucket = None
+    if step.ops_per_sec > 0:
+        bucket = TokenBucket(step.ops_per_sec, burst=step.in_flight_depth, start_time=start_time)
+    bucket_lock = threading.Lock()
+    deadline = start_time + step.duration_secs if step.duration_secs > 0 else None
+    if len(step.plans) > 1:
+        window = SharedTransactionWindow(step.device, depth=step.in_flight_depth)
+    else:
+        window = TransactionWindow(step.device, depth=step.in_flight_depth)
+    results = [{} for _ in step.plans]
+    threads = []
+    for plan, cycle_count, result in zip(step.plans, cycle_counts, results):
+        transaction_count = None if cycle_count is None else cycle_count * step.transactions_per_cycle
+        threads.append(threading.Thread(target=contextvars.copy_context().run, name="workload-{0}".format(step.name),
+                                        args=(_run_worker, window, plan, transaction_count, bucket, bucket_lock,
+                                              deadline, result)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_secs = time.perf_counter() - start_time
+
+    if any("issued" not in result for result in results):
+        raise RuntimeError("A worker of the workload step '{0}' failed".format(step.name))
+    summary = summarize_latencies(window.latencies, elapsed_secs)
+    issued = sum(result["issued"] for result in results)
+    summary.update({
+        "step": step.name,
+        "elapsed_secs": elapsed_secs,
+        "issued": issued,
+        "mb_per_sec": issued * step.bytes_per_cycle / step.transactions_per_cycle / elapsed_secs / 1e6
+        if elapsed_secs > 0 else 0.0,
+        "errors": window.errors,
+        "mismatches": sum(verifier.mismatches for verifier in step.verifiers) - mismatches,
+    })
+    return summary
+
+
+def run_workload(steps, repeat=1):
+    """
+    Run the compiled steps of a workload in order, each as many times as its repeat count, and the whole sequence
+    repeat times.
+
+    Parameters
+    ----------
+    steps : list of CompiledStep
+        The steps from compile_workload
+    repeat : int
+        The number of times to run the sequence of steps
+
+    Returns
+    -------
+    The summary of each step run, and the total transaction errors and read-back mismatches : dict
+    """
+    summaries = []
+    logger.info("-- pyrogue: Start the workload, {0} steps, {1} times --".format(len(steps), repeat))
+    for _ in range(repeat):
+        for step in steps:
+            for _ in range(step.repeat):
+                summary = run_workload_step(step)
+                summaries.append(summary)
+                logger.info("-- pyrogue: Workload step '{0}': {1} transactions, {2:.1f} MB/s, {3}, {4} errors, {5} "
+                            "mismatches".format(step.name, summary["issued"], summary["mb_per_sec"],
+                                                format_latency_summary(summary), summary["errors"],
+                                                summary["mismatches"]))
+
+    mismatches = sum(summary["mismatches"] for summary in summaries)
+    errors = sum(summary["errors"] for summary in summaries)
+    logger.info("-- pyrogue: End the workload. {0} transaction errors, {1} mismatches --".format(errors, mismatches))
+    return {
+        "errors": errors,
+        "mismatches": mismatches,
+        "steps": summaries,
+    }